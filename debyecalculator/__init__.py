@@ -1 +1,2 @@
 from .debye_calculator import DebyeCalculator
+from .debye_session import DebyeSession
@@ -6,18 +6,19 @@ import sys
 import base64
 import hashlib
 import time
-import yaml
 import pkg_resources
 import warnings
 from glob import glob
 from datetime import datetime, timezone
-from typing import Union, Tuple, Any, List, Type
-from collections import namedtuple
+from typing import Union, Tuple, Any, List, Type, Dict, Iterable, Iterator
+from itertools import product, islice
+from collections import namedtuple, deque
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Handle import of torch (prerequisite)
 try:
     import torch
-    from torch.nn.functional import pdist
 except ModuleNotFoundError:
     raise ImportError(
         "\n\nDebyeCalculator requires PyTorch, which is not installed. "
@@ -28,17 +29,29 @@ except ModuleNotFoundError:
         "https://github.com/FrederikLizakJohansen/DebyeCalculator"
     )
 
+# Handle import of psutil (used to query the available memory on CPU, falls back to sysconf if missing)
+try:
+    import psutil
+except ModuleNotFoundError:
+    psutil = None
 
 import numpy as np
 import matplotlib.pyplot as plt
 
 from ase import Atoms
-from ase.io import read, write
+from ase.io import read, write, iread
 from ase.build import make_supercell
 from ase.build.tools import sort as ase_sort
 
 from debyecalculator.utility.profiling import Profiler
-from debyecalculator.utility.generate import generate_nanoparticles
+from debyecalculator.utility.cache import StructureCache
+from debyecalculator.utility.elements import get_element_table
+from debyecalculator.utility.xyz import read_xyz
+from debyecalculator.utility.neighbours import neighbour_pairs
+from debyecalculator.utility.generate import generate_nanoparticles, get_unit_cell
+from debyecalculator.utility.accumulate import RunningSum
+from debyecalculator.utility.lattice import lattice_sites, lattice_distances
+from debyecalculator.utility.workers import initialise_worker, compute_in_worker, compute_shards_in_worker
 
 import ipywidgets as widgets
 from IPython.display import display, HTML, clear_output
@@ -46,12 +59,23 @@ from ipywidgets import HBox, VBox, Layout
 from functools import partial
 from tqdm.auto import tqdm
 
-StructureTuple = namedtuple('StructureTuple', 'elements size occupancy xyz triu_indices unique_inverse unique_form_factors form_avg_sq structure_inverse')
+StructureTuple = namedtuple('StructureTuple', 'elements size occupancy xyz unique_form_factors form_avg_sq structure_inverse cell', defaults=(None,))
 IqTuple = namedtuple('IqTuple', 'q i')
 SqTuple = namedtuple('SqTuple', 'q s')
 FqTuple = namedtuple('FqTuple', 'q f')
 GrTuple = namedtuple('GrTuple', 'r g')
+PartialSqTuple = namedtuple('PartialSqTuple', 'q pairs s')
 AllTuple = namedtuple('AllTuple', 'r q i s f g')
+EstimateTuple = namedtuple('EstimateTuple', 'num_atoms num_pairs batch_size num_batches peak_bytes seconds')
+
+# Dtypes of the sinc evaluation and of the accumulation of the pair sum for each precision mode
+PRECISION_DTYPES = {
+    'float32': (torch.float32, torch.float32),
+    'mixed': (torch.float32, torch.float64),
+    'float64': (torch.float64, torch.float64),
+    'float16': (torch.float16, torch.float32),
+    'bfloat16': (torch.bfloat16, torch.float32),
+}
 
 ArrayLike = Union[np.ndarray, torch.Tensor]
 IntArrayLike = Union[List[int], np.ndarray, torch.Tensor]
@@ -84,10 +108,19 @@ class DebyeCalculator:
         rthres: float = 0.0,
         biso: float = 0.3,
         device: str = 'cuda',
-        batch_size: Union[int, None] = 10000,
+        batch_size: Union[int, str, None] = 10000,
         lorch_mod: bool = False,
         radiation_type: str = 'xray',
         profile: bool = False,
+        engine: str = 'exact',
+        histogram_bin_width: Union[float, None] = None,
+        histogram_error: float = 1e-4,
+        packing_budget: Union[int, None] = 0,
+        structure_cache_bytes: int = 0,
+        memory_budget_bytes: Union[int, None] = None,
+        realspace_margin: float = 10.0,
+        precision: str = 'float32',
+        compensated_summation: bool = False,
         _max_batch_size: int = 4000,
         _lightweight_mode: bool = False,
     ) -> None:
@@ -105,10 +138,19 @@ class DebyeCalculator:
             rthres (float): Threshold value for exclusion of distances below this value in the scattering calculation. Default is 0.0.
             biso (float): Debye-Waller isotropic atomic displacement parameter. Default is 0.3.
             device (str): Device to use for computations ('cuda' for CUDA-enabled GPU's or 'cpu' for CPU)
-            batch_size (int or None): Batch size for computation. If None, the batch size will be automatically set. Default is None.
+            batch_size (int, str or None): Batch size (number of atom pairs per tile) for computation. If 'auto', the largest batch size that fits memory_budget_bytes is chosen. If None, the batch size will be automatically set. Default is 10000.
             lorch_mod (bool): Flag to enable Lorch modification. Default is False.
             radiation_type (str): Type of radiation for form factor calculations ('xray' or 'neutron'). Default is 'xray'.
             profile (bool): Activate profiler. Default is False.
+            engine (str): Engine for the pair sum ('exact' evaluates every pair distance, 'partial' evaluates every pair distance with sinc sums accumulated per element pair, 'histogram' evaluates binned per-element-pair distance histograms, 'lattice' evaluates the distinct pair distances of particles generated from a CIF with their multiplicities). Default is 'exact'.
+            histogram_bin_width (float or None): Distance bin width in Å for the histogram engine. If None, the bin width is derived from histogram_error. Default is None.
+            histogram_error (float): Upper bound on the error of each sinc(Qr) term introduced by the binning of the histogram engine. Default is 1e-4.
+            packing_budget (int or None): Maximum total number of atom pairs of small structures packed into shared batches with the 'exact' engine, which reduces the number of batches (and kernel launches) for many small structures. If None, a pack fills one batch. Set to 0 to evaluate every structure on its own. Default is 0.
+            structure_cache_bytes (int): Size in bytes of the LRU cache of prepared structures, keyed by a hash of their content, device and Q-grid. Set to 0 to disable the cache. Default is 0.
+            memory_budget_bytes (int or None): Memory budget in bytes for the intermediates of a batch when batch_size is 'auto'. If None, half of the currently available device memory is used. Default is None.
+            realspace_margin (float): Margin in Å beyond rmax within which pairs are included by the 'realspace' G(r) method, to capture their broadened tails. Default is 10.0.
+            precision (str): Precision of the pair sum ('float32', 'mixed' for float32 sinc evaluation with float64 accumulation, 'float64', or 'float16'/'bfloat16' for half precision sinc evaluation with float32 accumulation). Results are float64 with 'mixed' and 'float64', and float32 otherwise. Default is 'float32'.
+            compensated_summation (bool): Flag to accumulate the partial sums of the batches with compensated (Kahan) summation, such that the rounding error of the accumulation does not grow with the number of batches. Default is False.
         """
 
         # Handling CUDA availability
@@ -137,6 +179,15 @@ class DebyeCalculator:
         self.batch_size = batch_size
         self.lorch_mod = lorch_mod
         self.radiation_type = radiation_type
+        self.engine = engine
+        self.histogram_bin_width = histogram_bin_width
+        self.histogram_error = histogram_error
+        self.packing_budget = packing_budget
+        self.structure_cache_bytes = structure_cache_bytes
+        self.memory_budget_bytes = memory_budget_bytes
+        self.realspace_margin = realspace_margin
+        self.precision = precision
+        self.compensated_summation = compensated_summation
 
         # Parameter constraint assertion
         self.parameter_constraint_assertion()
@@ -145,32 +196,24 @@ class DebyeCalculator:
         self.profile = profile
         if self.profile:
             self.profiler = Profiler()
+
+        # Cache of prepared structures
+        self.structure_cache = StructureCache(self.structure_cache_bytes)
+
+        # Memoised time calibrations of estimate()
+        self._time_calibrations = {}
         
         # Initialise ranges
         self.q = torch.arange(self.qmin, self.qmax, self.qstep).unsqueeze(-1).to(device=self.device)
         self.r = torch.arange(self.rmin, self.rmax, self.rstep).unsqueeze(-1).to(device=self.device)
 
-        # Form factor coefficients
-        with open(pkg_resources.resource_filename(__name__, 'utility/elements_info.yaml'), 'r') as yaml_file:
-            self.FORM_FACTOR_COEF = yaml.safe_load(yaml_file)
-        self.atomic_numbers_to_elements = {}
-        for i, (key, value) in enumerate(self.FORM_FACTOR_COEF.items()):
-            if i > 97:
-                break
-            self.atomic_numbers_to_elements[value[12]] = key
+        # Form factor coefficients (process-wide table, one tensor per device)
+        self.element_table = get_element_table()
+        self.form_factor_coef = self.element_table.tensor(self.device)
+        self.atomic_numbers_to_elements = self.element_table.atomic_numbers_to_elements
 
         # Formfactor retrieval lambda
-        for k,v in self.FORM_FACTOR_COEF.items():
-            if None in v:
-                v = [value if value is not None else np.nan for value in v]
-            self.FORM_FACTOR_COEF[k] = torch.tensor(v).to(device=self.device, dtype=torch.float32)
-        if radiation_type.lower() in ['xray', 'x']:
-            self.form_factor_func = lambda p: torch.sum(p[:5] * torch.exp(-1*p[6:11] * (self.q / (4*torch.pi)).pow(2)), dim=1) + p[5]
-        elif radiation_type.lower() in ['neutron', 'n']:
-            self.form_factor_func = lambda p: p[11].unsqueeze(-1)
-        else:
-            # Should not reach this point, here for safety
-            raise ValueError("Invalid radiation type")
+        self._initialise_form_factors()
 
         # Max batch size
         self._max_batch_size = _max_batch_size
@@ -216,12 +259,31 @@ class DebyeCalculator:
             raise ValueError("rthres must be non-negative.")
         if self.biso < 0:
             raise ValueError("biso must be non-negative.")
-        if self.batch_size is not None and self.batch_size < 0:
+        if isinstance(self.batch_size, str):
+            if self.batch_size != 'auto':
+                raise ValueError("batch_size must be a non-negative integer, 'auto' or None.")
+        elif self.batch_size is not None and self.batch_size < 0:
             raise ValueError("batch_size must be non-negative.")
+        if self.memory_budget_bytes is not None and self.memory_budget_bytes <= 0:
+            raise ValueError("memory_budget_bytes must be positive.")
+        if self.realspace_margin < 0:
+            raise ValueError("realspace_margin must be non-negative.")
+        if self.precision not in PRECISION_DTYPES:
+            raise ValueError(f"Invalid precision, valid precisions include {list(PRECISION_DTYPES)}")
         if self.device not in ['cpu', 'cuda']:
             raise ValueError("Invalid device")
         if self.radiation_type not in ['xray', 'x', 'neutron', 'n']:
             raise ValueError("Invalid radiation type")
+        if self.engine not in ['exact', 'partial', 'histogram', 'lattice']:
+            raise ValueError("Invalid engine")
+        if self.histogram_bin_width is not None and self.histogram_bin_width <= 0:
+            raise ValueError("histogram_bin_width must be positive.")
+        if self.histogram_error <= 0:
+            raise ValueError("histogram_error must be positive.")
+        if self.packing_budget is not None and self.packing_budget < 0:
+            raise ValueError("packing_budget must be non-negative or None.")
+        if self.structure_cache_bytes < 0:
+            raise ValueError("structure_cache_bytes must be non-negative.")
     
     def update_parameters(
         self,
@@ -251,8 +313,53 @@ class DebyeCalculator:
         if np.any([k in ['qmin','qmax','qstep','rmin', 'rmax', 'rstep', 'device'] for k in kwargs.keys()]):
             self.q = torch.arange(self.qmin, self.qmax, self.qstep).unsqueeze(-1).to(device=self.device)
             self.r = torch.arange(self.rmin, self.rmax, self.rstep).unsqueeze(-1).to(device=self.device)
-            for key,val in self.FORM_FACTOR_COEF.items():
-                self.FORM_FACTOR_COEF[key] = val.to(device=self.device)
+            self.form_factor_coef = self.element_table.tensor(self.device)
+
+        # Re-initialise form factors
+        if np.any([k in ['qmin','qmax','qstep', 'device', 'radiation_type'] for k in kwargs.keys()]):
+            self._initialise_form_factors()
+
+        # Re-initialise the structure cache
+        if 'structure_cache_bytes' in kwargs.keys():
+            self.structure_cache = StructureCache(self.structure_cache_bytes)
+
+    def _initialise_form_factors(
+        self,
+    ) -> None:
+        """
+        Set up the form factor evaluation for the current Q-grid and radiation type.
+
+        The Waasmaier-Kirfel form factors of a (n_elements, 14) coefficient matrix are evaluated in a single batched operation on the precomputed s^2 = (Q/4pi)^2 grid.
+        The form factors of each set of unique elements are memoised until the Q-grid, device or radiation type changes.
+        """
+        self._s2 = (self.q.squeeze(-1) / (4*torch.pi)).pow(2)
+        self._form_factor_memo = {}
+
+        if self.radiation_type.lower() in ['xray', 'x']:
+            self.form_factor_func = lambda p: torch.sum(p[:, None, :5] * torch.exp(-1*p[:, None, 6:11] * self._s2[None, :, None]), dim=-1) + p[:, 5:6]
+        elif self.radiation_type.lower() in ['neutron', 'n']:
+            self.form_factor_func = lambda p: p[:, 11:12]
+        else:
+            # Should not reach this point, here for safety
+            raise ValueError("Invalid radiation type")
+
+    def _form_factors(
+        self,
+        unique_elements: List[str],
+    ) -> torch.Tensor:
+        """
+        Get the (memoised) form factors of a set of unique elements.
+
+        Parameters:
+            unique_elements (List[str]): Unique element symbols.
+
+        Returns:
+            torch.Tensor: Form factors of shape (n_unique_elements, n_q), or (n_unique_elements, 1) for neutrons.
+        """
+        key = tuple(str(el) for el in unique_elements)
+        if key not in self._form_factor_memo:
+            self._form_factor_memo[key] = self.form_factor_func(self.form_factor_coef[self.element_table.rows(key)])
+        return self._form_factor_memo[key]
 
     def _initialise_structure(
         self,
@@ -292,21 +399,22 @@ class DebyeCalculator:
 
             return check_len and check_type and check_shape
 
-        def parse_elements(elements, size):
-            # Get unique elements and construc form factor stacks
-            unique_elements, inverse, counts = np.unique(elements, return_counts=True, return_inverse=True)
+        def parse_elements(elements, size, codes=None):
+            # Get unique elements and construc form factor stacks (codes are indices into the sorted unique elements, if already known)
+            if codes is None:
+                unique_elements, inverse, counts = np.unique(elements, return_counts=True, return_inverse=True)
+            else:
+                unique_elements, inverse, counts = elements, codes, np.bincount(codes, minlength=len(elements))
 
-            triu_indices = torch.triu_indices(size, size, 1)
-            unique_inverse = torch.from_numpy(inverse[triu_indices]).to(device=self.device)
-            unique_form_factors = torch.stack([self.form_factor_func(self.FORM_FACTOR_COEF[el]) for el in unique_elements])
+            unique_form_factors = self._form_factors(unique_elements)
 
             # Calculate average squared form factor and self scattering inverse indices
             counts = torch.from_numpy(counts).to(device=self.device)
             compositional_fractions = counts / torch.sum(counts)
             form_avg_sq = torch.sum(compositional_fractions.reshape(-1,1) * unique_form_factors, dim=0)**2
-            structure_inverse = torch.from_numpy(np.array([inverse[i] for i in range(size)])).to(device=self.device)
+            structure_inverse = torch.from_numpy(inverse).to(device=self.device)
 
-            return triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse
+            return unique_form_factors, form_avg_sq, structure_inverse
 
         if isinstance(structure_source, tuple):
             if is_valid_str_tuple(structure_source):
@@ -316,9 +424,9 @@ class DebyeCalculator:
                     xyz = torch.from_numpy(xyz)
                 xyz = xyz.to(device=self.device, dtype=torch.float32)
                 occupancy = torch.ones(xyz.shape[0]).to(device=self.device, dtype=torch.float32)
-                triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
+                unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
 
-                return StructureTuple(elements, size, occupancy, xyz, triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse)
+                return StructureTuple(elements, size, occupancy, xyz, unique_form_factors, form_avg_sq, structure_inverse)
 
             elif is_valid_int_tuple(structure_source):
 
@@ -329,9 +437,9 @@ class DebyeCalculator:
                     xyz = torch.from_numpy(xyz)
                 xyz = xyz.to(device=self.device, dtype=torch.float32)
                 occupancy = torch.ones(xyz.shape[0]).to(device=self.device, dtype=torch.float32)
-                triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
+                unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
 
-                return StructureTuple(elements, size, occupancy, xyz, triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse)
+                return StructureTuple(elements, size, occupancy, xyz, unique_form_factors, form_avg_sq, structure_inverse)
             else:
                 raise TypeError('Encountered an invalid structure source (type: tuple)')
         elif isinstance(structure_source, str):
@@ -341,41 +449,42 @@ class DebyeCalculator:
                 raise TypeError(f'Encountered invalid file path on {structure_source}')
             if ext == 'xyz':
                 try:
-                    structure = np.genfromtxt(structure_source, dtype='str', skip_header=2)
-                    elements = structure[:,0]
+                    structure = read_xyz(structure_source)
+                    elements = np.array(structure.symbols)[structure.codes]
                     size = len(elements)
+                    xyz = torch.from_numpy(structure.xyz).to(device=self.device, dtype=torch.float32)
 
                     # Append occupancy if nothing is provided
-                    if structure.shape[1] == 5:
-                        occupancy = torch.from_numpy(structure[:,-1]).to(device=self.device, dtype=torch.float32)
-                        xyz = torch.tensor(structure[:,1:-1].astype('float')).to(device=self.device, dtype=torch.float32)
+                    if structure.occupancy is not None:
+                        occupancy = torch.from_numpy(structure.occupancy).to(device=self.device, dtype=torch.float32)
                     else:
                         occupancy = torch.ones((size), dtype=torch.float32).to(device=self.device)
-                        xyz = torch.tensor(structure[:,1:].astype('float')).to(device=self.device, dtype=torch.float32)
                 except:
                     raise IOError(f'Encountered invalid file format when trying to load structure from {structure_source}')
                     
-                triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
+                unique_form_factors, form_avg_sq, structure_inverse = parse_elements(structure.symbols, size, structure.codes)
 
-                return StructureTuple(elements, size, occupancy, xyz, triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse)
+                return StructureTuple(elements, size, occupancy, xyz, unique_form_factors, form_avg_sq, structure_inverse)
 
             elif ext == 'cif':
                 if radii is not None:
                     structures = generate_nanoparticles(structure_source, radii, disable_pbar=disable_pbar, _lightweight_mode=self._lightweight_mode, device=self.device)
+
+                    # Lattice vectors of the unit cell, from which the particles are carved
+                    cell = torch.from_numpy(np.array(get_unit_cell(structure_source).cell)).to(device=self.device, dtype=torch.float64)
                     structure_tuple_list = []
                     for structure in structures:
-                        triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse = parse_elements(structure.elements, structure.size)
+                        unique_form_factors, form_avg_sq, structure_inverse = parse_elements(structure.elements, structure.size)
                         structure_tuple_list.append(
                             StructureTuple(
                                 elements = structure.elements,
                                 size = structure.size,
                                 occupancy = structure.occupancy.to(dtype=torch.float32, device=self.device),
                                 xyz = structure.xyz.to(dtype=torch.float32, device=self.device),
-                                triu_indices = triu_indices,
-                                unique_inverse = unique_inverse,
                                 unique_form_factors = unique_form_factors,
                                 form_avg_sq = form_avg_sq,
-                                structure_inverse = structure_inverse
+                                structure_inverse = structure_inverse,
+                                cell = cell,
                             )
                         )
 
@@ -393,462 +502,1815 @@ class DebyeCalculator:
             except:
                 raise ValueError(f'Encountered invalid Atoms object')
                 
-            triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
+            unique_form_factors, form_avg_sq, structure_inverse = parse_elements(elements, size)
 
-            return StructureTuple(elements, size, occupancy, xyz, triu_indices, unique_inverse, unique_form_factors, form_avg_sq, structure_inverse)
+            return StructureTuple(elements, size, occupancy, xyz, unique_form_factors, form_avg_sq, structure_inverse)
         else:
             raise TypeError('Encountered unknown structure source')
 
-    def iq(
+    def _histogram_bin_width(
         self,
-        structure_source: StructureSourceType,
-        radii: Union[List[float], float, None] = None,
-        keep_on_device: bool = False,
-        _self_scattering: bool = True,
-    ) -> Union[IqTuple, List[IqTuple]]:
+    ) -> float:
         """
-        Calculate the scattering intensity I(Q) for the given atomic structure(s).
+        Get the distance bin width used by the histogram engine.
 
-        Parameters:
-            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
-            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
-            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
-            _self_scattering (bool): Flag to compute self-scattering contribution. Default is True.
+        If no explicit bin width is set, it is derived from the error bound. Each bin is evaluated at its weighted mean distance, so the first order
+        error cancels and, as |sinc''(x)| <= 1/3, the error of each sinc(Qr) term is at most (Q * bin_width)^2 / 24 over the Q-range.
 
         Returns:
-            Union[IqTuple, List[IqTuple]]: IqTuple containing Q-values and scattering intensity I(Q) or a list of such tuples.
+            float: Bin width in Å.
+        """
+        if self.histogram_bin_width is not None:
+            return self.histogram_bin_width
+        return np.sqrt(24 * self.histogram_error) / max(self.qmax, 1e-12)
 
-        Raises:
-            TypeError: If the structure source is of an invalid type.
-            IOError: If there is an issue loading the structure from the specified file.
-            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+    def _bytes_per_pair(
+        self,
+        num_classes: Union[int, None] = None,
+    ) -> int:
         """
-        def compute_iq(structure):
+        Estimate the peak bytes of the intermediates per atom pair (or histogram bin) of a batch at the current Q-grid.
 
-            # Calculate distances and batch
-            if self.batch_size is None:
-                self.batch_size = self._max_batch_size
+        Per pair, the index decoding, distance and mask intermediates take about 96 bytes. The 'exact' engine forms 7 (pair, Q) intermediates
+        (the Q * r product, sinc, the two gathered form factors, their product and the weighted product). When the pairs are reduced per element-pair class
+        ('partial' and 'histogram' engines, real-space G(r)), 2 (pair, Q) intermediates (the Q * r product and sinc) and a column of the dense
+        (n_classes, pair) weight matrix of _accumulate_class_sums are formed instead, together with the class and column indices and weights (64 bytes).
+        The (pair, Q) intermediates are in the compute dtype of the precision mode, with a copy in the accumulation dtype if that differs, and
+        the float32 argument reduction of half precision (16 bytes).
 
-            dists = pdist(structure.xyz).split(self.batch_size)
-            indices = structure.triu_indices.split(self.batch_size, dim=1)
-            inverse_indices = structure.unique_inverse.split(self.batch_size, dim=1)
+        Parameters:
+            num_classes (Union[int, None]): Number of element-pair classes (n_unique_elements^2) if the pairs are reduced per class, or None for the 'exact' engine. Default is None.
 
-            if self.profile:
-                self.profiler.time('Batching and Distances')
-
-            # Calculate scattering using Debye Equation
-            iq = torch.zeros((len(self.q))).to(device=self.device, dtype=torch.float32)
-            for d, inv_idx, idx in zip(dists, inverse_indices, indices):
-                mask = d >= self.rthres
-                occ_product = structure.occupancy[idx[0]] * structure.occupancy[idx[1]]
-                sinc = torch.sinc(d[mask] * self.q / torch.pi)
-                ffp = structure.unique_form_factors[inv_idx[0]] * structure.unique_form_factors[inv_idx[1]]
-                iq += torch.sum(occ_product.unsqueeze(-1)[mask] * ffp[mask] * sinc.permute(1,0), dim=0)
-
-            # Apply Debye-Weller Isotropic Atomic Displacement
-            if self.biso != 0.0:
-                iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
-            
-            # Self-scattering contribution
-            if _self_scattering:
-                sinc = torch.ones((structure.size, len(self.q))).to(device=self.device)
-                iq += torch.sum((structure.occupancy.unsqueeze(-1) * structure.unique_form_factors[structure.structure_inverse])**2 * sinc, dim=0) / 2
-                iq *= 2
+        Returns:
+            int: Estimated bytes per pair.
+        """
+        compute_dtype, accumulate_dtype = PRECISION_DTYPES[self.precision]
+        compute_bytes, accumulate_bytes = compute_dtype.itemsize, accumulate_dtype.itemsize
+        extra_bytes = (accumulate_bytes if accumulate_dtype != compute_dtype else 0) + (16 if compute_bytes == 2 else 0)
 
-            if self.profile:
-                self.profiler.time('I(Q)')
+        if num_classes is None:
+            return 96 + (7 * compute_bytes + extra_bytes) * len(self.q)
+        return 96 + 64 + (2 * compute_bytes + extra_bytes) * len(self.q) + accumulate_bytes * num_classes
 
-            return iq
-        
-        if self.profile:
-            self.profiler.reset()
-        
-        if not isinstance(structure_source, list):
-            structure_source = [structure_source]
+    def _available_memory_bytes(
+        self,
+    ) -> int:
+        """
+        Get the currently available memory of the device, from the CUDA allocator statistics or (on CPU) psutil.
+        Without psutil, the available physical pages reported by sysconf are used, which excludes reclaimable page cache and so underestimates the available memory.
 
-        structures = []
-        for i, item in enumerate(structure_source):
-            structure_output = self._initialise_structure(item, radii, disable_pbar = True)
+        Returns:
+            int: Available memory in bytes.
+        """
+        if self.device == 'cuda':
+            free, _ = torch.cuda.mem_get_info()
+            return free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        if psutil is not None:
+            return psutil.virtual_memory().available
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            # Conservative fallback if the available memory cannot be queried
+            return 2**30
 
-            if isinstance(structure_output, list):
-                structures.extend(structure_output)
-            else:
-                structures.append(structure_output)
+    def _tile_size(
+        self,
+        num_classes: Union[int, None] = None,
+    ) -> int:
+        """
+        Get the number of atom pairs per batch.
 
-        if self.profile:
-            self.profiler.time('Setup structures and form factors')
+        With batch_size 'auto', this is the largest batch whose intermediates fit the memory budget, which is reported through the profiler.
 
-        output = []
-        for structure in structures:
-            output_tuple = IqTuple(self.q.squeeze(-1), compute_iq(structure))
-            if not keep_on_device:
-                output_tuple = output_tuple._replace(
-                    q = output_tuple.q.cpu().numpy(),
-                    i = output_tuple.i.cpu().numpy()
-                )
-            output.append(output_tuple)
+        Parameters:
+            num_classes (Union[int, None]): Number of element-pair classes if the pairs are reduced per class, as in _bytes_per_pair. Default is None.
 
-        return output if len(output) > 1 else output[0]
+        Returns:
+            int: Batch size.
+        """
+        if self.batch_size is None:
+            return self._max_batch_size
+        if self.batch_size != 'auto':
+            return self.batch_size
 
-    def sq(
+        budget = self.memory_budget_bytes if self.memory_budget_bytes is not None else self._available_memory_bytes() // 2
+        bytes_per_pair = self._bytes_per_pair(num_classes)
+        batch_size = max(1, int(budget // bytes_per_pair))
+
+        if self.profile:
+            self.profiler.note('Batch size (auto)', f'{batch_size} pairs ({bytes_per_pair} bytes per pair, {budget} bytes budget)')
+
+        return batch_size
+
+    def _sinc(
         self,
-        structure_source: StructureSourceType,
-        radii: Union[List[float], float, None] = None,
-        keep_on_device: bool = False,
-    ) -> Union[SqTuple, List[SqTuple]]:
+        d: torch.Tensor,
+    ) -> torch.Tensor:
         """
-        Calculate the structure function S(Q) for the given atomic structure(s)
+        Evaluate sinc(Qd) = sin(Qd) / (Qd) of a batch of distances at self.q in the compute dtype of the precision mode.
+
+        Half precision cannot represent the argument Qd (up to ~10^3 rad) accurately, so the argument is formed and reduced to [-pi, pi) in float32,
+        and only the sine and the division are evaluated in half precision.
 
         Parameters:
-            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object or as a tuple of (atomic_identities, atomic_positions)
-            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU
+            d (torch.Tensor): Distances.
 
         Returns:
-            SqTuple containing Q-values and structure function S(Q)
+            torch.Tensor: Sinc terms of shape (n_q, n).
         """
-        def compute_sq(structure):
-            # Calculate distances and batch
-            if self.batch_size is None:
-                self.batch_size = self._max_batch_size
-            dists = pdist(structure.xyz).split(self.batch_size)
-            indices = structure.triu_indices.split(self.batch_size, dim=1)
-            inverse_indices = structure.unique_inverse.split(self.batch_size, dim=1)
-            
-            if self.profile:
-                self.profiler.time('Batching and Distances')
-
-            # Calculate scattering using Debye Equation
-            iq = torch.zeros((len(self.q))).to(device=self.device, dtype=torch.float32)
-            for d, inv_idx, idx in zip(dists, inverse_indices, indices):
-                mask = d >= self.rthres
-                occ_product = structure.occupancy[idx[0]] * structure.occupancy[idx[1]]
-                sinc = torch.sinc(d[mask] * self.q / torch.pi)
-                ffp = structure.unique_form_factors[inv_idx[0]] * structure.unique_form_factors[inv_idx[1]]
-                iq += torch.sum(occ_product.unsqueeze(-1)[mask] * ffp[mask] * sinc.permute(1,0), dim=0)
-
-            # Apply Debye-Weller Isotropic Atomic Displacement
-            if self.biso != 0.0:
-                iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
-        
-            # Calculate S(Q) and F(Q)
-            sq = iq/structure.form_avg_sq/structure.size
-            
-            if self.profile:
-                self.profiler.time('S(Q)')
+        compute_dtype, _ = PRECISION_DTYPES[self.precision]
+        if compute_dtype.itemsize >= 4:
+            return torch.sinc(d.to(dtype=compute_dtype) * self.q.to(dtype=compute_dtype) / torch.pi)
 
-            return sq
-        
-        if self.profile:
-            self.profiler.reset()
-        
-        if not isinstance(structure_source, list):
-            structure_source = [structure_source]
+        x = d.to(dtype=torch.float32) * self.q
+        reduced = torch.remainder(x + torch.pi, 2 * torch.pi) - torch.pi
+        x = x.to(dtype=compute_dtype)
+        return torch.where(x == 0, 1.0, torch.sin(reduced.to(dtype=compute_dtype)) / x)
 
-        structures = []
-        for i, item in enumerate(structure_source):
-            structure_output = self._initialise_structure(item, radii, disable_pbar = True)
+    def _debye_sum(
+        self,
+        structure: StructureTuple,
+        start: int = 0,
+        stop: Union[int, None] = None,
+    ) -> torch.Tensor:
+        """
+        Calculate the pair term of the Debye scattering equation for a single structure, including the Debye-Waller factor.
 
-            if isinstance(structure_output, list):
-                structures.extend(structure_output)
-            else:
-                structures.append(structure_output)
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            start (int): First linear pair index to include, as in _pair_tiles. Default is 0.
+            stop (Union[int, None]): Linear pair index to stop before, as in _pair_tiles. If None, all pairs from start are included. Default is None.
+
+        Returns:
+            torch.Tensor: Sum over all unique atom pairs (in the range) of the scattering contributions, evaluated at self.q.
+        """
+        if self.engine in ['partial', 'histogram', 'lattice']:
+            return torch.sum(self._partial_debye_sums(structure, start, stop), dim=(0,1))
+
+        # Calculate scattering using Debye Equation
+        compute_dtype, accumulate_dtype = PRECISION_DTYPES[self.precision]
+        iq = RunningSum((len(self.q),), device=self.device, dtype=accumulate_dtype, compensated=self.compensated_summation)
+        for d, inv_idx, occ_product in self._pair_tiles(structure, start, stop):
+            sinc = self._sinc(d)
+            ffp = (structure.unique_form_factors[inv_idx[0]] * structure.unique_form_factors[inv_idx[1]]).to(dtype=compute_dtype)
+            iq.add_(torch.sum(occ_product.unsqueeze(-1).to(dtype=compute_dtype) * ffp * sinc.permute(1,0), dim=0, dtype=accumulate_dtype))
+        iq = iq.total()
 
         if self.profile:
-            self.profiler.time('Setup structures and form factors')
+            self.profiler.time('Debye Sum')
 
-        output = []
-        for structure in structures:
-            output_tuple = SqTuple(self.q.squeeze(-1), compute_sq(structure))
-            if not keep_on_device:
-                output_tuple = output_tuple._replace(
-                    q = output_tuple.q.cpu().numpy(),
-                    s = output_tuple.s.cpu().numpy()
-                )
-            output.append(output_tuple)
+        # Apply Debye-Weller Isotropic Atomic Displacement
+        if self.biso != 0.0:
+            iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
 
-        return output if len(output) > 1 else output[0]
+        return iq
 
-    def fq(
+    def _debye_sums(
         self,
-        structure_source: StructureSourceType,
-        radii: Union[List[float], float, None] = None,
-        keep_on_device: bool = False,
-    ) -> Union[FqTuple, List[FqTuple]]:
+        structures: List[StructureTuple],
+    ) -> List[torch.Tensor]:
         """
-        Calculate the structure function S(Q) for the given atomic structure(s).
+        Calculate the pair term of the Debye scattering equation for a list of structures.
+
+        With the 'exact' engine, consecutive structures of at most packing_budget atom pairs in total are packed and evaluated together by _packed_debye_sum.
+        Any other structure is evaluated on its own by _debye_sum.
 
         Parameters:
-            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
-            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
-            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            structures (List[StructureTuple]): Initialised structures.
 
         Returns:
-            Union[SqTuple, List[SqTuple]]: SqTuple containing Q-values and structure function S(Q) or a list of such tuples.
-
-        Raises:
-            TypeError: If the structure source is of an invalid type.
-            IOError: If there is an issue loading the structure from the specified file.
-            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+            List[torch.Tensor]: Pair term of each structure, evaluated at self.q.
         """
-        
-        def compute_fq(structure):
-            # Calculate distances and batch
-            if self.batch_size is None:
-                self.batch_size = self._max_batch_size
-            dists = pdist(structure.xyz).split(self.batch_size)
-            indices = structure.triu_indices.split(self.batch_size, dim=1)
-            inverse_indices = structure.unique_inverse.split(self.batch_size, dim=1)
-            
-            if self.profile:
-                self.profiler.time('Batching and Distances')
-
-            # Calculate scattering using Debye Equation
-            iq = torch.zeros((len(self.q))).to(device=self.device, dtype=torch.float32)
-            for d, inv_idx, idx in zip(dists, inverse_indices, indices):
-                mask = d >= self.rthres
-                occ_product = structure.occupancy[idx[0]] * structure.occupancy[idx[1]]
-                sinc = torch.sinc(d[mask] * self.q / torch.pi)
-                ffp = structure.unique_form_factors[inv_idx[0]] * structure.unique_form_factors[inv_idx[1]]
-                iq += torch.sum(occ_product.unsqueeze(-1)[mask] * ffp[mask] * sinc.permute(1,0), dim=0)
-
-            # Apply Debye-Weller Isotropic Atomic Displacement
-            if self.biso != 0.0:
-                iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
-        
-            # Calculate S(Q) and F(Q)
-            sq = iq/structure.form_avg_sq/structure.size
-            fq = self.q.squeeze(-1) * sq
-            
-            if self.profile:
-                self.profiler.time('F(Q)')
+        if self.engine != 'exact' or self.packing_budget == 0:
+            return [self._debye_sum(structure) for structure in structures]
 
-            return fq
-        
-        if self.profile:
-            self.profiler.reset()
-        
-        if not isinstance(structure_source, list):
-            structure_source = [structure_source]
+        iqs = []
+        for pack in self._packs(structures):
+            if len(pack) == 1:
+                iqs.append(self._debye_sum(pack[0]))
+            else:
+                iqs.extend(self._packed_debye_sum(pack))
 
-        structures = []
-        for i, item in enumerate(structure_source):
-            structure_output = self._initialise_structure(item, radii, disable_pbar = True)
+        return iqs
 
-            if isinstance(structure_output, list):
-                structures.extend(structure_output)
-            else:
-                structures.append(structure_output)
+    def _packs(
+        self,
+        structures: List[StructureTuple],
+    ) -> List[List[StructureTuple]]:
+        """
+        Greedily group consecutive structures into packs of at most packing_budget atom pairs in total (a larger structure forms a pack of its own).
 
-        if self.profile:
-            self.profiler.time('Setup structures and form factors')
+        Parameters:
+            structures (List[StructureTuple]): Initialised structures.
 
-        output = []
+        Returns:
+            List[List[StructureTuple]]: Packs of structures, in order.
+        """
+        budget = self._tile_size() if self.packing_budget is None else self.packing_budget
+
+        packs, pack, pack_pairs = [], [], 0
         for structure in structures:
-            output_tuple = FqTuple(self.q.squeeze(-1), compute_fq(structure))
-            if not keep_on_device:
-                output_tuple = output_tuple._replace(
-                    q = output_tuple.q.cpu().numpy(),
-                    f = output_tuple.f.cpu().numpy()
-                )
-            output.append(output_tuple)
+            num_pairs = structure.size * (structure.size - 1) // 2
+            if pack and pack_pairs + num_pairs > budget:
+                packs.append(pack)
+                pack, pack_pairs = [], 0
+            pack.append(structure)
+            pack_pairs += num_pairs
+        packs.append(pack)
 
-        return output if len(output) > 1 else output[0]
+        return packs
 
-    def gr(
+    def _undamped_debye_sums(
         self,
-        structure_source: StructureSourceType,
-        radii: Union[List[float], float, None] = None,
-        keep_on_device: bool = False,
-    ) -> Union[GrTuple, List[GrTuple]]:
+        structures: List[StructureTuple],
+    ) -> List[torch.Tensor]:
         """
-        Calculate the reduced pair distribution function G(r) for the given atomic structure(s).
+        Calculate the pair term of the Debye scattering equation for a list of structures, without the Debye-Waller factor.
 
         Parameters:
-            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
-            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
-            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            structures (List[StructureTuple]): Initialised structures.
 
         Returns:
-            Union[GrTuple, List[GrTuple]]: GrTuple containing r-values and reduced pair distribution function G(r) or a list of such tuples.
+            List[torch.Tensor]: Pair term of each structure, evaluated at self.q.
+        """
+        biso = self.biso
+        try:
+            self.biso = 0.0
+            return self._debye_sums(structures)
+        finally:
+            self.biso = biso
 
-        Raises:
-            TypeError: If the structure source is of an invalid type.
-            IOError: If there is an issue loading the structure from the specified file.
-            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+    def _packed_debye_sum(
+        self,
+        structures: List[StructureTuple],
+    ) -> torch.Tensor:
         """
-        def compute_gr(structure):
-            # Calculate distances and batch
-            if self.batch_size is None:
-                self.batch_size = self._max_batch_size
-            dists = pdist(structure.xyz).split(self.batch_size)
-            indices = structure.triu_indices.split(self.batch_size, dim=1)
-            inverse_indices = structure.unique_inverse.split(self.batch_size, dim=1)
-            
-            if self.profile:
-                self.profiler.time('Batching and Distances')
-
-            # Calculate scattering using Debye Equation
-            iq = torch.zeros((len(self.q))).to(device=self.device, dtype=torch.float32)
-            for d, inv_idx, idx in zip(dists, inverse_indices, indices):
-                mask = d >= self.rthres
-                occ_product = structure.occupancy[idx[0]] * structure.occupancy[idx[1]]
-                sinc = torch.sinc(d[mask] * self.q / torch.pi)
-                ffp = structure.unique_form_factors[inv_idx[0]] * structure.unique_form_factors[inv_idx[1]]
-                iq += torch.sum(occ_product.unsqueeze(-1)[mask] * ffp[mask] * sinc.permute(1,0), dim=0)
-
-            # Apply Debye-Weller Isotropic Atomic Displacement
-            if self.biso != 0.0:
-                iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
-        
-            # Calculate S(Q), F(Q) and G(r)
-            sq = iq/structure.form_avg_sq/structure.size
-            fq = self.q.squeeze(-1) * sq
+        Calculate the pair term of the Debye scattering equation for several structures at once, including the Debye-Waller factor.
 
-            damp = 1 if self.qdamp == 0.0 else torch.exp(-(self.r.squeeze(-1) * self.qdamp).pow(2) / 2)
-            lorch_mod = 1 if self.lorch_mod == None else torch.sinc(self.q * self.lorch_mod*(torch.pi / self.qmax))
-            gr = (2 / torch.pi) * torch.sum(fq.unsqueeze(-1) * torch.sin(self.q * self.r.permute(1,0))*self.qstep * lorch_mod, dim=0) * damp
-            
-            if self.profile:
-                self.profiler.time('G(r)')
-            
-            return gr
-        
-        if self.profile:
-            self.profiler.reset()
-        
-        if not isinstance(structure_source, list):
-            structure_source = [structure_source]
+        The structures are concatenated into a single (ragged) structure, and only the pairs within each structure are enumerated, such that
+        the tiles of batch_size pairs span many small structures and the per-structure sums are reduced with a single scatter.
 
-        structures = []
-        for i, item in enumerate(structure_source):
-            structure_output = self._initialise_structure(item, radii, disable_pbar = True)
+        Parameters:
+            structures (List[StructureTuple]): Initialised structures.
 
-            if isinstance(structure_output, list):
-                structures.extend(structure_output)
-            else:
-                structures.append(structure_output)
+        Returns:
+            torch.Tensor: Pair terms of shape (n_structures, n_q), evaluated at self.q.
+        """
+        batch_size = self._tile_size()
+
+        # Concatenate the structures, offsetting the unique element indices into the concatenated form factors
+        sizes = torch.tensor([structure.size for structure in structures], device=self.device, dtype=torch.int64)
+        atom_offsets = torch.cumsum(sizes, dim=0) - sizes
+        form_factor_counts = torch.tensor([len(structure.unique_form_factors) for structure in structures], device=self.device, dtype=torch.int64)
+        form_factor_offsets = torch.cumsum(form_factor_counts, dim=0) - form_factor_counts
+        xyz = torch.cat([structure.xyz for structure in structures])
+        occupancy = torch.cat([structure.occupancy for structure in structures])
+        unique_form_factors = torch.cat([structure.unique_form_factors for structure in structures])
+        structure_inverse = torch.cat([structure.structure_inverse + offset for structure, offset in zip(structures, form_factor_offsets)])
+
+        # Linear pair indices of each structure are consecutive ranges of the packed pair indices
+        num_pairs = sizes * (sizes - 1) // 2
+        pair_ends = torch.cumsum(num_pairs, dim=0)
+        pair_starts = pair_ends - num_pairs
+
+        compute_dtype, accumulate_dtype = PRECISION_DTYPES[self.precision]
+        iq = RunningSum((len(structures), len(self.q)), device=self.device, dtype=accumulate_dtype, compensated=self.compensated_summation)
+        for tile_start in range(0, int(pair_ends[-1]), batch_size):
+            k = torch.arange(tile_start, min(tile_start + batch_size, int(pair_ends[-1])), device=self.device, dtype=torch.int64)
+
+            # Structure of each pair, and row (i) and column (j) indices decoded from the pair index within that structure
+            s = torch.searchsorted(pair_ends, k, right=True)
+            k = k - pair_starts[s]
+            size, structure_pairs = sizes[s], num_pairs[s]
+            i = size - 2 - torch.floor(torch.sqrt((4*size*(size-1) - 7 - 8*k).to(dtype=torch.float64)) / 2 - 0.5).to(dtype=torch.int64)
+            j = k + i + 1 - structure_pairs + (size - i) * (size - i - 1) // 2
+            i, j = i + atom_offsets[s], j + atom_offsets[s]
+
+            distance_dtype = torch.float64 if compute_dtype == torch.float64 else torch.float32
+            d = torch.norm(xyz[i].to(dtype=distance_dtype) - xyz[j].to(dtype=distance_dtype), dim=-1)
+            mask = d >= self.rthres
+            i, j, s, d = i[mask], j[mask], s[mask], d[mask]
+
+            sinc = self._sinc(d)
+            ffp = (unique_form_factors[structure_inverse[i]] * unique_form_factors[structure_inverse[j]]).to(dtype=compute_dtype)
+            iq.add_((occupancy[i] * occupancy[j]).unsqueeze(-1).to(dtype=compute_dtype) * ffp * sinc.permute(1,0), index=s)
+        iq = iq.total()
 
         if self.profile:
-            self.profiler.time('Setup structures and form factors')
+            self.profiler.time('Debye Sum')
 
-        output = []
-        for structure in structures:
-            output_tuple = GrTuple(self.r.squeeze(-1), compute_gr(structure))
-            if not keep_on_device:
-                output_tuple = output_tuple._replace(
-                    r = output_tuple.r.cpu().numpy(),
-                    g = output_tuple.g.cpu().numpy()
-                )
-            output.append(output_tuple)
+        # Apply Debye-Weller Isotropic Atomic Displacement
+        if self.biso != 0.0:
+            iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
 
-        return output if len(output) > 1 else output[0]
+        return iq
 
-    def _get_all(
+    def _partial_debye_sums(
         self,
-        structure_source: StructureSourceType,
-        radii: Union[List[float], float, None] = None,
-        keep_on_device: bool = False,
-    ) -> Union[AllTuple, List[AllTuple]]:
+        structure: StructureTuple,
+        start: int = 0,
+        stop: Union[int, None] = None,
+    ) -> torch.Tensor:
         """
-        Calculate I(Q), S(Q), F(Q), and G(r) for the given atomic structure(s).
+        Calculate the pair term of the Debye scattering equation for each ordered pair of unique elements, including the Debye-Waller factor.
+
+        The sinc sums are accumulated per element-pair class without form factors, which are multiplied onto the (few) class sums only once at the end.
+        This is done by the 'partial' engine, for every pair distance, the 'histogram' engine, for binned pair distances, and the 'lattice' engine, for the distinct pair distances.
 
         Parameters:
-            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
-            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
-            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            structure (StructureTuple): Initialised structure.
+            start (int): First linear pair index to include, as in _pair_tiles (not with the 'lattice' engine). Default is 0.
+            stop (Union[int, None]): Linear pair index to stop before, as in _pair_tiles. If None, all pairs from start are included. Default is None.
 
         Returns:
-            Union[AllTuple, List[AllTuple]]: AllTuple containing r-values, Q-values, I(Q), S(Q), F(Q), and G(r) or a list of such tuples.
-
-        Raises:
-            TypeError: If the structure source is of an invalid type.
-            IOError: If there is an issue loading the structure from the specified file.
-            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+            torch.Tensor: Partial pair terms of shape (n_unique_elements, n_unique_elements, n_q), summing to the full pair term.
         """
-        def compute_all(structure):
-            # Calculate distances and batch
-            if self.batch_size is None:
-                self.batch_size = self._max_batch_size
-            dists = pdist(structure.xyz).split(self.batch_size)
-            indices = structure.triu_indices.split(self.batch_size, dim=1)
-            inverse_indices = structure.unique_inverse.split(self.batch_size, dim=1)
-            
-            if self.profile:
-                self.profiler.time('Batching and Distances')
-
-            # Calculate scattering using Debye Equation
-            iq = torch.zeros((len(self.q))).to(device=self.device, dtype=torch.float32)
-            for d, inv_idx, idx in zip(dists, inverse_indices, indices):
-                mask = d >= self.rthres
-                occ_product = structure.occupancy[idx[0]] * structure.occupancy[idx[1]]
-                sinc = torch.sinc(d[mask] * self.q / torch.pi)
-                ffp = structure.unique_form_factors[inv_idx[0]] * structure.unique_form_factors[inv_idx[1]]
-                iq += torch.sum(occ_product.unsqueeze(-1)[mask] * ffp[mask] * sinc.permute(1,0), dim=0)
-
-            # Apply Debye-Weller Isotropic Atomic Displacement
-            if self.biso != 0.0:
-                iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
-        
-            # Calculate S(Q), F(Q) and G(r)
-            sq = iq/structure.form_avg_sq/structure.size
-            fq = self.q.squeeze(-1) * sq
-
-            damp = 1 if self.qdamp == 0.0 else torch.exp(-(self.r.squeeze(-1) * self.qdamp).pow(2) / 2)
-            lorch_mod = 1 if self.lorch_mod == None else torch.sinc(self.q * self.lorch_mod*(torch.pi / self.qmax))
-            gr = (2 / torch.pi) * torch.sum(fq.unsqueeze(-1) * torch.sin(self.q * self.r.permute(1,0))*self.qstep * lorch_mod, dim=0) * damp
-            
-            # Self-scattering contribution
-            sinc = torch.ones((structure.size, len(self.q))).to(device=self.device)
-            iq += torch.sum((structure.occupancy.unsqueeze(-1) * structure.unique_form_factors[structure.structure_inverse])**2 * sinc, dim=0) / 2
-            iq *= 2
-            
-            if self.profile:
-                self.profiler.time('All')
+        num_unique = len(structure.unique_form_factors)
+        class_sums = RunningSum((num_unique**2, len(self.q)), device=self.device, dtype=PRECISION_DTYPES[self.precision][1], compensated=self.compensated_summation)
+
+        # Calculate sinc sums per element-pair class
+        lattice = self._lattice_distances(structure) if self.engine == 'lattice' else None
+        if self.engine == 'histogram':
+            for d, pair_class, weights in self._histogram_tiles(structure, start=start, stop=stop):
+                self._accumulate_class_sums(class_sums, d, pair_class, weights)
+        elif lattice is not None:
+            for d, pair_class, weights in zip(*[t.split(self._tile_size(num_unique**2)) for t in lattice]):
+                self._accumulate_class_sums(class_sums, d, pair_class, weights)
+        else:
+            for d, inv_idx, occ_product in self._pair_tiles(structure, start, stop, num_classes=num_unique**2):
+                self._accumulate_class_sums(class_sums, d, inv_idx[0] * num_unique + inv_idx[1], occ_product)
 
-            return iq, sq, fq, gr
-        
         if self.profile:
-            self.profiler.reset()
-        
-        if not isinstance(structure_source, list):
-            structure_source = [structure_source]
+            self.profiler.time('Debye Sum')
 
-        structures = []
-        for i, item in enumerate(structure_source):
-            structure_output = self._initialise_structure(item, radii, disable_pbar = True)
+        # Multiply form factor products onto the class sums
+        form_factors = structure.unique_form_factors
+        partials = class_sums.total().reshape(num_unique, num_unique, -1) * form_factors.unsqueeze(1) * form_factors.unsqueeze(0)
+
+        # Apply Debye-Weller Isotropic Atomic Displacement
+        if self.biso != 0.0:
+            partials *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
+
+        return partials
+
+    def _accumulate_class_sums(
+        self,
+        class_sums: RunningSum,
+        d: torch.Tensor,
+        pair_class: torch.Tensor,
+        weights: torch.Tensor,
+    ) -> None:
+        """
+        Add the weighted sinc terms of a batch of distances to the sums of their element-pair classes.
+
+        The sinc terms are evaluated in the compute dtype of the precision mode, and reduced in the dtype of the class sums (the accumulation dtype).
+
+        Parameters:
+            class_sums (RunningSum): Running sinc sums of shape (n_classes, n_q), updated in place.
+            d (torch.Tensor): Distances.
+            pair_class (torch.Tensor): Element-pair class of each distance.
+            weights (torch.Tensor): Weight of each distance.
+        """
+        # Scatter the weights into a (n_classes, batch) matrix, such that the reduction is a single matrix product and no (batch, n_q) form factor product is formed
+        class_weights = torch.zeros((len(class_sums), len(d)), device=self.device, dtype=class_sums.dtype)
+        class_weights[pair_class, torch.arange(len(d), device=self.device)] = weights.to(dtype=class_sums.dtype)
+        sinc = self._sinc(d).to(dtype=class_sums.dtype)
+        class_sums.add_(torch.matmul(class_weights, sinc.permute(1,0)))
+
+    def _pair_tiles(
+        self,
+        structure: StructureTuple,
+        start: int = 0,
+        stop: Union[int, None] = None,
+        num_classes: Union[int, None] = None,
+    ):
+        """
+        Generate the unique atom pairs of a structure in tiles of at most batch_size pairs.
+
+        The pairs are enumerated in the row-major order of the upper triangle of the distance matrix (the order of torch.nn.functional.pdist).
+        Row and column indices of each tile are decoded from the linear pair indices on the fly, such that the peak memory is bounded by the
+        tile size, and no index, distance or element tensor over all N(N-1)/2 pairs is ever materialised.
+        Distances are computed in float64 with the 'float64' precision mode, and in float32 otherwise.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            start (int): First linear pair index to generate. Default is 0.
+            stop (Union[int, None]): Linear pair index to stop before. If None, all pairs from start are generated. Default is None.
+            num_classes (Union[int, None]): Number of element-pair classes if the tiles are reduced per class, as in _tile_size. Default is None.
+
+        Yields:
+            Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: Distances, unique element indices (2, n) and occupancy products of the pairs in the tile that are not excluded by rthres.
+        """
+        size = structure.size
+        num_pairs = size * (size - 1) // 2
+        stop = num_pairs if stop is None else min(stop, num_pairs)
+
+        batch_size = self._tile_size(num_classes)
+        distance_dtype = torch.float64 if PRECISION_DTYPES[self.precision][0] == torch.float64 else torch.float32
+        for tile_start in range(start, stop, batch_size):
+            k = torch.arange(tile_start, min(tile_start + batch_size, stop), device=self.device, dtype=torch.int64)
+
+            # Decode row (i) and column (j) indices of the upper triangle from the linear pair index
+            i = size - 2 - torch.floor(torch.sqrt((4*size*(size-1) - 7 - 8*k).to(dtype=torch.float64)) / 2 - 0.5).to(dtype=torch.int64)
+            j = k + i + 1 - num_pairs + (size - i) * (size - i - 1) // 2
+
+            d = torch.norm(structure.xyz[i].to(dtype=distance_dtype) - structure.xyz[j].to(dtype=distance_dtype), dim=-1)
+            mask = d >= self.rthres
+            i, j = i[mask], j[mask]
+
+            inv_idx = torch.stack([structure.structure_inverse[i], structure.structure_inverse[j]])
+            occ_product = structure.occupancy[i] * structure.occupancy[j]
+
+            yield d[mask], inv_idx, occ_product
+
+    def _histogram_num_bins(
+        self,
+        structure: StructureTuple,
+        cutoff: Union[float, None] = None,
+    ) -> int:
+        """
+        Get the number of distance bins of each element-pair histogram of a structure.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            cutoff (Union[float, None]): Maximum pair distance, as in _histogram_tiles. Default is None.
+
+        Returns:
+            int: Number of bins.
+        """
+        # The particle diameter (or cutoff) bounds all pair distances
+        extent = torch.norm(structure.xyz.amax(dim=0) - structure.xyz.amin(dim=0)).item() if structure.size > 0 else 0.0
+        if cutoff is not None:
+            extent = min(extent, cutoff)
+        return int(extent / self._histogram_bin_width()) + 2
+
+    def _histogram_tiles(
+        self,
+        structure: StructureTuple,
+        cutoff: Union[float, None] = None,
+        start: int = 0,
+        stop: Union[int, None] = None,
+    ):
+        """
+        Bin all pair distances into per-element-pair distance histograms and generate the occupied bins in tiles of at most batch_size bins.
+
+        All pair distances are binned into a histogram for each (ordered) pair of unique elements, weighted by the occupancy products.
+        The Debye sum is then evaluated over the occupied bins only, at their weighted mean distance, such that the cost becomes O(N^2) + O(n_bins * n_q) instead of O(N^2 * n_q).
+        With a cutoff, only the pairs within the cutoff are found, with a cell list in O(N), and binned.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            cutoff (Union[float, None]): Maximum pair distance. If None, all pairs are binned. Default is None.
+            start (int): First linear pair index to bin without a cutoff, as in _pair_tiles. Default is 0.
+            stop (Union[int, None]): Linear pair index to stop before without a cutoff, as in _pair_tiles. If None, all pairs from start are binned. Default is None.
+
+        Yields:
+            Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: Weighted mean distances, element-pair classes and weights of the occupied bins in the tile.
+        """
+        bin_width = self._histogram_bin_width()
+        num_unique = len(structure.unique_form_factors)
+        num_bins = self._histogram_num_bins(structure, cutoff)
+
+        # Accumulate occupancy weighted histograms (and weighted distance sums) in double precision to keep bin counts exact
+        hist = torch.zeros((num_unique**2 * num_bins), dtype=torch.float64, device=self.device)
+        hist_dist = torch.zeros_like(hist)
+        pair_tiles = self._pair_tiles(structure, start, stop) if cutoff is None else self._neighbour_tiles(structure, cutoff)
+        for d, inv_idx, occ_product in pair_tiles:
+            occ_product = occ_product.to(dtype=torch.float64)
+            bins = torch.clamp((d / bin_width).long(), max=num_bins-1)
+            pair_class = inv_idx[0] * num_unique + inv_idx[1]
+            hist.index_add_(0, pair_class * num_bins + bins, occ_product)
+            hist_dist.index_add_(0, pair_class * num_bins + bins, occ_product * d)
+
+        if self.profile:
+            self.profiler.time('Histogram')
+
+        # Debye sum over the weighted mean distance of the occupied bins
+        occupied = torch.nonzero(hist).flatten()
+        weights = hist[occupied]
+        centres = (hist_dist[occupied] / weights).to(dtype=torch.float64 if PRECISION_DTYPES[self.precision][0] == torch.float64 else torch.float32)
+        weights = weights.to(dtype=torch.float32)
+        pair_classes = occupied // num_bins
+
+        batch_size = self._tile_size(num_unique**2)
+        for r, c, w in zip(centres.split(batch_size), pair_classes.split(batch_size), weights.split(batch_size)):
+            yield r, c, w
+
+    def _lattice_sites(
+        self,
+        structure: StructureTuple,
+    ) -> Union[Tuple[torch.Tensor, torch.Tensor, torch.Tensor], None]:
+        """
+        Decompose a structure generated from a CIF into lattice translations and basis sites of the unit cell, as in lattice_sites.
+
+        Basis sites do not mix elements or occupancies.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            Union[Tuple[torch.Tensor, torch.Tensor, torch.Tensor], None]: Integer translations, basis site of each atom and fractional positions of
+            the basis sites, or None (with a warning) if the structure has no unit cell or its atoms are not on the lattice.
+        """
+        if structure.cell is None:
+            warnings.warn("Warning: The 'lattice' engine requires particles generated from a CIF, every pair distance is evaluated instead (as by the 'partial' engine)", stacklevel=3)
+            return None
+
+        _, occupancy_codes = torch.unique(structure.occupancy, return_inverse=True)
+        sites = lattice_sites(structure.xyz, structure.cell, structure.structure_inverse * structure.size + occupancy_codes)
+        if sites is None:
+            warnings.warn("Warning: The atoms are not on the lattice of the unit cell, every pair distance is evaluated instead (as by the 'partial' engine)", stacklevel=3)
+        return sites
+
+    def _lattice_distances(
+        self,
+        structure: StructureTuple,
+    ) -> Union[Tuple[torch.Tensor, torch.Tensor, torch.Tensor], None]:
+        """
+        Find the distinct pair distances of a structure generated from a CIF, together with their element-pair classes and multiplicities.
+
+        The particles are carved from a perfect lattice, so most pair distances repeat exactly. The multiplicities of the pair vectors are found per pair
+        of basis sites from the lattice translations (with FFTs, see lattice_distances), and vectors of equal length are merged, such that the Debye sum
+        is evaluated over the distinct distances only, without binning error.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            Union[Tuple[torch.Tensor, torch.Tensor, torch.Tensor], None]: Distinct distances, element-pair classes and weights (multiplicities times
+            occupancy products) that are not excluded by rthres, or None if the structure cannot be decomposed into a lattice.
+        """
+        sites = self._lattice_sites(structure)
+        if sites is None:
+            return None
+        translations, site, offsets = sites
+
+        # Element and occupancy of each basis site
+        num_unique = len(structure.unique_form_factors)
+        site_inverse = torch.zeros(len(offsets), dtype=torch.int64, device=self.device).scatter_(0, site, structure.structure_inverse.to(dtype=torch.int64))
+        site_occupancy = torch.zeros(len(offsets), dtype=torch.float64, device=self.device).scatter_(0, site, structure.occupancy.to(dtype=torch.float64))
+
+        d, pair_classes, weights = lattice_distances(
+            translations, site, offsets, structure.cell,
+            site_classes = site_inverse.unsqueeze(1) * num_unique + site_inverse.unsqueeze(0),
+            site_weights = site_occupancy.unsqueeze(1) * site_occupancy.unsqueeze(0),
+            batch_size = self._tile_size(),
+        )
+
+        if self.profile:
+            self.profiler.time('Lattice distances')
+
+        mask = d >= self.rthres
+        distance_dtype = torch.float64 if PRECISION_DTYPES[self.precision][0] == torch.float64 else torch.float32
+        return d[mask].to(dtype=distance_dtype), pair_classes[mask], weights[mask].to(dtype=torch.float32)
+
+    def _neighbour_tiles(
+        self,
+        structure: StructureTuple,
+        cutoff: float,
+    ):
+        """
+        Generate the unique atom pairs of a structure within a cutoff distance, found with a cell list, in tiles of about batch_size pairs.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            cutoff (float): Maximum pair distance.
+
+        Yields:
+            Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: Distances, unique element indices (2, n) and occupancy products of the pairs in the tile that are not excluded by rthres.
+        """
+        for i, j, d in neighbour_pairs(structure.xyz, cutoff, self._tile_size()):
+            mask = d >= self.rthres
+            i, j = i[mask], j[mask]
+
+            inv_idx = torch.stack([structure.structure_inverse[i], structure.structure_inverse[j]])
+            occ_product = structure.occupancy[i] * structure.occupancy[j]
+
+            yield d[mask], inv_idx, occ_product
+
+    def _realspace_debye_sum(
+        self,
+        structure: StructureTuple,
+    ) -> torch.Tensor:
+        """
+        Calculate the pair term of the Debye scattering equation restricted to the pairs within rmax + realspace_margin, including the Debye-Waller factor.
+
+        The pairs are found with a cell list and binned as by the histogram engine, such that the cost is linear in the number of atoms for large particles.
+        G(r) up to rmax derived from this pair term only misses the (broadened) tails of the pairs beyond the cutoff.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            torch.Tensor: Sum over the unique atom pairs within the cutoff of the scattering contributions, evaluated at self.q.
+        """
+        num_unique = len(structure.unique_form_factors)
+        class_sums = RunningSum((num_unique**2, len(self.q)), device=self.device, dtype=PRECISION_DTYPES[self.precision][1], compensated=self.compensated_summation)
+        for d, pair_class, weights in self._histogram_tiles(structure, cutoff=self.rmax + self.realspace_margin):
+            self._accumulate_class_sums(class_sums, d, pair_class, weights)
+
+        if self.profile:
+            self.profiler.time('Debye Sum (real-space)')
+
+        form_factors = structure.unique_form_factors
+        iq = torch.sum(class_sums.total().reshape(num_unique, num_unique, -1) * form_factors.unsqueeze(1) * form_factors.unsqueeze(0), dim=(0,1))
+
+        # Apply Debye-Weller Isotropic Atomic Displacement
+        if self.biso != 0.0:
+            iq *= torch.exp(-self.q.squeeze(-1).pow(2) * self.biso/(8*torch.pi**2))
+
+        return iq
+
+    def _initialise_structures(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+    ) -> List[StructureTuple]:
+        """
+        Initialise all structures of a (list of) structure source(s).
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+
+        Returns:
+            List[StructureTuple]: Flat list of the initialised structures.
+        """
+        if not isinstance(structure_source, list):
+            structure_source = [structure_source]
+
+        structures = []
+        for i, item in enumerate(structure_source):
+            key = self._structure_cache_key(item, radii) if self.structure_cache.max_bytes > 0 else None
+            structure_output = self.structure_cache.get(key) if key is not None else None
+            if structure_output is None:
+                structure_output = self._initialise_structure(item, radii, disable_pbar = True)
+                if key is not None:
+                    # Tuple sources may share memory with the caller's arrays, which may be modified in place after the call
+                    cached_output = [self._copy_structure(s) for s in structure_output] if isinstance(structure_output, list) else self._copy_structure(structure_output)
+                    self.structure_cache.put(key, cached_output, self._structure_nbytes(cached_output))
 
             if isinstance(structure_output, list):
                 structures.extend(structure_output)
             else:
                 structures.append(structure_output)
 
+        return structures
+
+    @staticmethod
+    def _copy_structure(
+        structure: StructureTuple,
+    ) -> StructureTuple:
+        """
+        Copy the atom-wise data of a prepared structure, such that it shares no memory with the structure source.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            StructureTuple: Copy of the structure.
+        """
+        return structure._replace(
+            elements = list(structure.elements),
+            occupancy = structure.occupancy.clone(),
+            xyz = structure.xyz.clone(),
+            structure_inverse = structure.structure_inverse.clone(),
+        )
+
+    def _structure_cache_key(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+    ) -> Union[str, None]:
+        """
+        Get the structure cache key of a structure source, a hash of its content together with the device, Q-grid and radiation type.
+
+        Files are hashed by their bytes, such that a cache hit skips parsing altogether.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+
+        Returns:
+            Union[str, None]: Hex digest of the hash, or None if the structure source cannot be hashed (it is then never cached).
+        """
+        def array_bytes(a):
+            a = a.detach().cpu().numpy() if isinstance(a, torch.Tensor) else np.asarray(a)
+            return str(a.dtype).encode() + str(a.shape).encode() + np.ascontiguousarray(a).tobytes()
+
+        h = hashlib.sha256()
+        h.update(repr((self.device, self.qmin, self.qmax, self.qstep, self.radiation_type)).encode())
+        try:
+            if isinstance(structure_source, str):
+                with open(structure_source, 'rb') as f:
+                    h.update(f.read())
+                h.update(repr((structure_source.split('.')[-1], radii, self._lightweight_mode)).encode())
+            elif isinstance(structure_source, tuple) and len(structure_source) == 2:
+                elements, xyz = structure_source
+                h.update(b'\0'.join(str(e).encode() for e in elements) if isinstance(elements, list) else array_bytes(elements))
+                h.update(array_bytes(xyz))
+            elif isinstance(structure_source, Atoms):
+                h.update(array_bytes(structure_source.get_atomic_numbers()))
+                h.update(array_bytes(structure_source.get_positions()))
+            else:
+                return None
+        except (OSError, TypeError, ValueError):
+            return None
+
+        return h.hexdigest()
+
+    def _structure_nbytes(
+        self,
+        structure_output: Union[StructureTuple, List[StructureTuple]],
+    ) -> int:
+        """
+        Estimate the size in bytes of (a list of) prepared structure(s).
+
+        Parameters:
+            structure_output (Union[StructureTuple, List[StructureTuple]]): Initialised structure(s).
+
+        Returns:
+            int: Size in bytes of the tensors and element symbols.
+        """
+        if isinstance(structure_output, list):
+            return sum(self._structure_nbytes(structure) for structure in structure_output)
+
+        nbytes = sum(sys.getsizeof(element) for element in structure_output.elements)
+        for t in [structure_output.occupancy, structure_output.xyz, structure_output.unique_form_factors, structure_output.form_avg_sq, structure_output.structure_inverse]:
+            nbytes += t.element_size() * t.nelement()
+        return nbytes
+
+    def _derive_outputs(
+        self,
+        structure: StructureTuple,
+        iq: torch.Tensor,
+        outputs: Tuple[str, ...],
+        _self_scattering: bool = True,
+        partials: Union[torch.Tensor, None] = None,
+    ) -> Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]:
+        """
+        Derive the requested scattering quantities from the pair term of the Debye scattering equation.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            iq (torch.Tensor): Pair term of the Debye scattering equation, as returned by _debye_sum.
+            outputs (Tuple[str, ...]): Names of the quantities to derive, any of 'iq', 'sq', 'fq', 'gr' and 'sq_partial'.
+            _self_scattering (bool): Flag to compute self-scattering contribution to I(Q). Default is True.
+            partials (Union[torch.Tensor, None]): Partial pair terms as returned by _partial_debye_sums. Required for 'sq_partial'. Default is None.
+
+        Returns:
+            Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]: The requested quantities, keyed by name.
+        """
+        q = self.q.squeeze(-1)
+        results = {}
+
+        if 'sq_partial' in outputs:
+            # Combine the ordered element pairs (a,b) and (b,a), normalised such that the partials sum to S(Q)
+            unique_elements = sorted(set(structure.elements))
+            pairs, sq_partial = [], []
+            for a in range(len(unique_elements)):
+                for b in range(a, len(unique_elements)):
+                    pairs.append((unique_elements[a], unique_elements[b]))
+                    partial = partials[a,b] if a == b else partials[a,b] + partials[b,a]
+                    sq_partial.append(partial/structure.form_avg_sq/structure.size)
+            results['sq_partial'] = PartialSqTuple(q, pairs, torch.stack(sq_partial))
+
+        if 'iq' in outputs:
+            # Self-scattering contribution
+            if _self_scattering:
+                self_scattering = torch.sum((structure.occupancy.unsqueeze(-1) * structure.unique_form_factors[structure.structure_inverse])**2, dim=0)
+                results['iq'] = IqTuple(q, 2 * iq + self_scattering)
+            else:
+                results['iq'] = IqTuple(q, iq.clone())
+
+            if self.profile:
+                self.profiler.time('I(Q)')
+
+        if any(name in outputs for name in ['sq', 'fq', 'gr']):
+            # Calculate S(Q) and F(Q)
+            sq = iq/structure.form_avg_sq/structure.size
+            fq = q * sq
+            if 'sq' in outputs:
+                results['sq'] = SqTuple(q, sq)
+            if 'fq' in outputs:
+                results['fq'] = FqTuple(q, fq)
+
+            if self.profile:
+                self.profiler.time('S(Q) and F(Q)')
+
+            if 'gr' in outputs:
+                damp = 1 if self.qdamp == 0.0 else torch.exp(-(self.r.squeeze(-1) * self.qdamp).pow(2) / 2)
+                gr = torch.matmul(fq, self._sine_transform_kernel(self.r, self.lorch_mod).to(dtype=fq.dtype)) * damp
+                results['gr'] = GrTuple(self.r.squeeze(-1), gr)
+
+                if self.profile:
+                    self.profiler.time('G(r)')
+
+        return results
+
+    def _sine_transform_kernel(
+        self,
+        r: torch.Tensor,
+        lorch_mod: bool,
+    ) -> torch.Tensor:
+        """
+        Get the kernel of the (undamped) sine Fourier transformation from F(Q) to G(r), such that G(r) = F(Q) @ kernel.
+
+        Parameters:
+            r (torch.Tensor): r-values of shape (n_r, 1).
+            lorch_mod (bool): Flag to apply the Lorch modification.
+
+        Returns:
+            torch.Tensor: Kernel of shape (n_q, n_r).
+        """
+        lorch = 1 if lorch_mod == None else torch.sinc(self.q * lorch_mod*(torch.pi / self.qmax))
+        return (2 / torch.pi) * torch.sin(self.q * r.permute(1,0))*self.qstep * lorch
+
+    def compute(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        keep_on_device: bool = False,
+        _self_scattering: bool = True,
+        gr_method: str = 'reciprocal',
+    ) -> Union[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]], List[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]]]:
+        """
+        Calculate any subset of I(Q), S(Q), F(Q) and G(r) for the given atomic structure(s).
+
+        The O(N^2) pair sum of the Debye scattering equation is evaluated exactly once per structure, and all requested quantities are derived from it.
+        Small structures are packed together, within the packing budget, and evaluated in shared batches.
+        With the 'partial', 'histogram' or 'lattice' engine, the partial structure functions S_ab(Q) of each pair of elements, which sum to S(Q), can be requested as 'sq_partial'.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, any of 'iq', 'sq', 'fq', 'gr' and 'sq_partial'. Default is ('iq', 'sq', 'fq', 'gr').
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            _self_scattering (bool): Flag to compute self-scattering contribution to I(Q). Default is True.
+            gr_method (str): Method for G(r), either 'reciprocal' (the sine transformation of F(Q) from all pairs) or 'realspace' (the sine transformation of F(Q) from the pairs within rmax + realspace_margin only, found with a cell list). Default is 'reciprocal'.
+
+        Returns:
+            Union[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]], List[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]]]: Dictionary mapping each requested name to its IqTuple, SqTuple, FqTuple, GrTuple or PartialSqTuple, or a list of such dictionaries.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If an invalid output is requested (or 'sq_partial' with the 'exact' engine), the file extension is not valid or when providing .cif data file, radii is not provided.
+        """
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        outputs = tuple(outputs)
+        for name in outputs:
+            if name not in ['iq', 'sq', 'fq', 'gr', 'sq_partial']:
+                raise ValueError(f"Invalid output '{name}', valid outputs include ['iq', 'sq', 'fq', 'gr', 'sq_partial']")
+        if 'sq_partial' in outputs and self.engine not in ['partial', 'histogram', 'lattice']:
+            raise ValueError("The output 'sq_partial' requires the 'partial', 'histogram' or 'lattice' engine")
+        if gr_method not in ['reciprocal', 'realspace']:
+            raise ValueError("Invalid gr_method, valid methods include ['reciprocal', 'realspace']")
+        realspace = gr_method == 'realspace' and 'gr' in outputs
+        pair_outputs = tuple(name for name in outputs if not (realspace and name == 'gr'))
+
+        if self.profile:
+            self.profiler.reset()
+
+        structures = self._initialise_structures(structure_source, radii)
+
         if self.profile:
             self.profiler.time('Setup structures and form factors')
 
+        if pair_outputs and 'sq_partial' not in outputs:
+            iqs = self._debye_sums(structures)
+
         output = []
-        for structure in structures:
-            iq, sq, fq, gr = compute_all(structure)
-            output_tuple = AllTuple(
-                self.r.squeeze(-1),
-                self.q.squeeze(-1),
-                iq,
-                sq,
-                fq,
-                gr
-            )
+        for n, structure in enumerate(structures):
+            if not pair_outputs:
+                results = {}
+            elif 'sq_partial' in outputs:
+                partials = self._partial_debye_sums(structure)
+                results = self._derive_outputs(structure, torch.sum(partials, dim=(0,1)), pair_outputs, _self_scattering, partials)
+            else:
+                results = self._derive_outputs(structure, iqs[n], pair_outputs, _self_scattering)
+            if realspace:
+                results.update(self._derive_outputs(structure, self._realspace_debye_sum(structure), ('gr',)))
             if not keep_on_device:
-                output_tuple = output_tuple._replace(
-                    r = output_tuple.r.cpu().numpy(),
-                    q = output_tuple.q.cpu().numpy(),
-                    i = output_tuple.i.cpu().numpy(),
-                    s = output_tuple.s.cpu().numpy(),
-                    f = output_tuple.f.cpu().numpy(),
-                    g = output_tuple.g.cpu().numpy()
-                )
-            output.append(output_tuple)
+                results = {name: type(result)(*[t.cpu().numpy() if isinstance(t, torch.Tensor) else t for t in result]) for name, result in results.items()}
+            output.append(results)
+
+        return output if len(output) > 1 else output[0]
+
+    def sweep(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('gr',),
+        keep_on_device: bool = False,
+        **parameter_grids: Any,
+    ) -> Union[List[Tuple[Dict[str, Any], Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple]]]], List[List[Tuple[Dict[str, Any], Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple]]]]]]:
+        """
+        Calculate any subset of I(Q), S(Q), F(Q) and G(r) over a grid of the post-processing parameters biso, qdamp, lorch_mod, rmin, rmax and rstep.
+
+        None of these parameters affect the pair distances, so the pair sum of the Debye scattering equation is evaluated exactly once per structure,
+        without the Debye-Waller factor. Every parameter combination is then derived from it with vectorised transformations.
+        Parameters without a grid keep their current value.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, any of 'iq', 'sq', 'fq' and 'gr'. Default is ('gr',).
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            **parameter_grids: Value or list of values for any of biso, qdamp, lorch_mod, rmin, rmax and rstep.
+
+        Returns:
+            Union[List[Tuple[Dict[str, Any], Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple]]]], List[List[...]]]: For each parameter combination
+            (in the order of itertools.product over biso, qdamp, lorch_mod, rmin, rmax, rstep), a tuple of the parameter values and the dictionary of the requested quantities,
+            or a list of such lists for multiple structures.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If an invalid output or parameter is requested, a parameter value is negative, the file extension is not valid or when providing .cif data file, radii is not provided.
+        """
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        outputs = tuple(outputs)
+        for name in outputs:
+            if name not in ['iq', 'sq', 'fq', 'gr']:
+                raise ValueError(f"Invalid output '{name}', valid outputs include ['iq', 'sq', 'fq', 'gr']")
+
+        # Parameter grids, defaulting to the current values
+        parameter_names = ['biso', 'qdamp', 'lorch_mod', 'rmin', 'rmax', 'rstep']
+        for name in parameter_grids:
+            if name not in parameter_names:
+                raise ValueError(f"Invalid sweep parameter '{name}', valid parameters include {parameter_names}")
+        grids = {}
+        for name in parameter_names:
+            values = parameter_grids.get(name, getattr(self, name))
+            grids[name] = list(values) if isinstance(values, (list, tuple, np.ndarray)) else [values]
+            if name != 'lorch_mod' and any(value < 0 for value in grids[name]):
+                raise ValueError(f"{name} must be non-negative.")
+
+        if self.profile:
+            self.profiler.reset()
+
+        structures = self._initialise_structures(structure_source, radii)
+
+        if self.profile:
+            self.profiler.time('Setup structures and form factors')
+
+        # Pair sums without the Debye-Waller factor
+        iqs = self._undamped_debye_sums(structures)
+
+        q = self.q.squeeze(-1)
+        biso_grid = torch.tensor(grids['biso'], device=self.device, dtype=torch.float32)
+        debye_waller = torch.exp(-q.pow(2) * biso_grid.unsqueeze(-1)/(8*torch.pi**2))
+
+        # Sine transformation kernels and damping of each r-grid, shared by all structures
+        r_grids, kernels, damps = {}, {}, {}
+        for rmin, rmax, rstep in product(grids['rmin'], grids['rmax'], grids['rstep']):
+            r_grids[rmin, rmax, rstep] = torch.arange(rmin, rmax, rstep).unsqueeze(-1).to(device=self.device)
+        if 'gr' in outputs:
+            for (rmin, rmax, rstep), r in r_grids.items():
+                for lorch_mod in grids['lorch_mod']:
+                    kernels[lorch_mod, rmin, rmax, rstep] = self._sine_transform_kernel(r, lorch_mod)
+                for qdamp in grids['qdamp']:
+                    damps[qdamp, rmin, rmax, rstep] = 1 if qdamp == 0.0 else torch.exp(-(r.squeeze(-1) * qdamp).pow(2) / 2)
+
+        output = []
+        for structure, iq in zip(structures, iqs):
+            # All Debye-Waller factors at once, shape (n_biso, n_q)
+            iq = iq * debye_waller
+            sq = iq/structure.form_avg_sq/structure.size
+            fq = q * sq
+            self_scattering = torch.sum((structure.occupancy.unsqueeze(-1) * structure.unique_form_factors[structure.structure_inverse])**2, dim=0)
+            undamped_gr = {key: torch.matmul(fq, kernel.to(dtype=fq.dtype)) for key, kernel in kernels.items()}
+
+            sweep_results = []
+            for combination in product(*[enumerate(grids[name]) for name in parameter_names]):
+                (b, biso), (_, qdamp), (_, lorch_mod), (_, rmin), (_, rmax), (_, rstep) = combination
+                results = {}
+                if 'iq' in outputs:
+                    results['iq'] = IqTuple(q, 2 * iq[b] + self_scattering)
+                if 'sq' in outputs:
+                    results['sq'] = SqTuple(q, sq[b])
+                if 'fq' in outputs:
+                    results['fq'] = FqTuple(q, fq[b])
+                if 'gr' in outputs:
+                    gr = undamped_gr[lorch_mod, rmin, rmax, rstep][b] * damps[qdamp, rmin, rmax, rstep]
+                    results['gr'] = GrTuple(r_grids[rmin, rmax, rstep].squeeze(-1), gr)
+                if not keep_on_device:
+                    results = {name: type(result)(*[t.cpu().numpy() for t in result]) for name, result in results.items()}
+                parameters = dict(zip(parameter_names, [biso, qdamp, lorch_mod, rmin, rmax, rstep]))
+                sweep_results.append((parameters, results))
+            output.append(sweep_results)
+
+        if self.profile:
+            self.profiler.time('Sweep')
 
         return output if len(output) > 1 else output[0]
 
+    def stream(
+        self,
+        trajectory: Union[str, Iterable[StructureSourceType]],
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        keep_on_device: bool = False,
+        prefetch: int = 1,
+        index: Union[str, int, slice] = ':',
+    ) -> Iterator[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]]:
+        """
+        Calculate any subset of I(Q), S(Q), F(Q) and G(r) frame by frame for a trajectory.
+
+        Frames are read lazily, and the next prefetch frame(s) are read in a background thread while the current frame is calculated,
+        such that the peak memory is that of a few frames rather than the whole trajectory.
+
+        Parameters:
+            trajectory (Union[str, Iterable[StructureSourceType]]): Path to a trajectory readable by ASE (e.g. multi-frame (extended) XYZ or .traj),
+                or an iterable/iterator of structure sources, e.g. ASE Atoms objects or tuples of (atomic_identities, atomic_positions).
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, as in compute(). Default is ('iq', 'sq', 'fq', 'gr').
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            prefetch (int): Number of frames read ahead in a background thread. Set to 0 to read frames in the calling thread. Default is 1.
+            index (Union[str, int, slice]): Frames to read from a trajectory path, in ASE index syntax. Default is ':' (all frames).
+
+        Yields:
+            Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]: The requested quantities of each frame, keyed by name.
+
+        Raises:
+            ValueError: If prefetch is negative, or an invalid output is requested.
+        """
+        if prefetch < 0:
+            raise ValueError("prefetch must be non-negative.")
+
+        frames = iread(trajectory, index=index) if isinstance(trajectory, str) else iter(trajectory)
+        if prefetch > 0:
+            frames = self._prefetch(frames, prefetch)
+
+        for frame in frames:
+            yield self.compute(frame, outputs=outputs, keep_on_device=keep_on_device)
+
+    @staticmethod
+    def _prefetch(
+        frames: Iterator[Any],
+        prefetch: int,
+    ) -> Iterator[Any]:
+        """
+        Read ahead up to prefetch items of an iterator in a background thread.
+
+        Parameters:
+            frames (Iterator[Any]): Iterator to read from. It is only advanced by the (single) background thread.
+            prefetch (int): Maximum number of items read ahead.
+
+        Yields:
+            Any: The items of the iterator, in order.
+        """
+        end = object()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = deque(executor.submit(next, frames, end) for _ in range(prefetch))
+            while True:
+                frame = pending.popleft().result()
+                if frame is end:
+                    break
+                pending.append(executor.submit(next, frames, end))
+                yield frame
+
+    def map(
+        self,
+        structure_sources: Iterable[StructureSourceType],
+        radii: Union[List[float], float, None] = None,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        workers: Union[int, None] = None,
+        backend: str = 'process',
+        threads_per_worker: Union[int, None] = None,
+        gr_method: str = 'reciprocal',
+    ) -> Iterator[Union[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]], List[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]]]]:
+        """
+        Calculate any subset of I(Q), S(Q), F(Q) and G(r) for many structures in parallel, with a pool of worker processes or threads.
+
+        Each worker has its own DebyeCalculator with the parameters of this one and its own number of PyTorch intra-op threads, such that many
+        medium-sized structures saturate a CPU node rather than sharing the intra-op threads of one process, which scale poorly for small batches.
+        The structure sources are read lazily and handed out to the workers one at a time, with at most two per worker in flight,
+        and the results are yielded in the order of the structure sources.
+
+        With the 'process' backend, the workers are started with the 'spawn' method, so scripts calling map must guard their entry point with
+        if __name__ == '__main__', and the structure sources and results are pickled between the processes.
+        With the 'thread' backend, the number of intra-op threads is process-wide in PyTorch, so it is set for all workers and restored afterwards.
+
+        Parameters:
+            structure_sources (Iterable[StructureSourceType]): Iterable of atomic structure sources in XYZ/CIF format, ASE Atoms objects, or tuples of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIFs.
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, as in compute(). Default is ('iq', 'sq', 'fq', 'gr').
+            workers (Union[int, None]): Number of worker processes or threads. If None, the number of CPUs is used. Default is None.
+            backend (str): Either 'process' or 'thread'. Default is 'process'.
+            threads_per_worker (Union[int, None]): Number of PyTorch intra-op threads of each worker. If None, the CPUs are divided evenly between the workers. Default is None.
+            gr_method (str): Method for G(r), as in compute(). Default is 'reciprocal'.
+
+        Yields:
+            Union[Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]], List[Dict[...]]]: The results of compute() for each structure source, as numpy arrays on CPU.
+
+        Raises:
+            ValueError: If the backend is invalid, or workers or threads_per_worker is not positive.
+        """
+        if backend not in ['process', 'thread']:
+            raise ValueError("Invalid backend, valid backends include ['process', 'thread']")
+        num_cpus = os.cpu_count() or 1
+        workers = num_cpus if workers is None else workers
+        if workers < 1:
+            raise ValueError("workers must be positive.")
+        threads_per_worker = max(1, num_cpus // workers) if threads_per_worker is None else threads_per_worker
+        if threads_per_worker < 1:
+            raise ValueError("threads_per_worker must be positive.")
+
+        initargs = (dict(self._parameters(), profile=False), threads_per_worker)
+        kwargs = dict(radii=radii, outputs=outputs, gr_method=gr_method)
+        if backend == 'process':
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=initialise_worker, initargs=initargs)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, initializer=initialise_worker, initargs=initargs)
+
+        num_threads = torch.get_num_threads()
+        try:
+            with executor:
+                structure_sources = iter(structure_sources)
+                pending = deque(executor.submit(compute_in_worker, source, kwargs) for source in islice(structure_sources, 2 * workers))
+                while pending:
+                    result = pending.popleft().result()
+                    for source in islice(structure_sources, 1):
+                        pending.append(executor.submit(compute_in_worker, source, kwargs))
+                    yield result
+        finally:
+            torch.set_num_threads(num_threads)
+
+    def _parameters(
+        self,
+    ) -> Dict[str, Any]:
+        """
+        Get the parameters of the DebyeCalculator as keyword arguments of its constructor.
+
+        Returns:
+            Dict[str, Any]: Keyword arguments that create a DebyeCalculator with the same parameters.
+        """
+        return dict(
+            qmin=self.qmin, qmax=self.qmax, qstep=self.qstep, qdamp=self.qdamp, rmin=self.rmin, rmax=self.rmax, rstep=self.rstep,
+            rthres=self.rthres, biso=self.biso, device=self.device, batch_size=self.batch_size, lorch_mod=self.lorch_mod,
+            radiation_type=self.radiation_type, profile=self.profile, engine=self.engine, histogram_bin_width=self.histogram_bin_width,
+            histogram_error=self.histogram_error, packing_budget=self.packing_budget, structure_cache_bytes=self.structure_cache_bytes,
+            memory_budget_bytes=self.memory_budget_bytes, realspace_margin=self.realspace_margin, precision=self.precision,
+            compensated_summation=self.compensated_summation, _max_batch_size=self._max_batch_size, _lightweight_mode=self._lightweight_mode,
+        )
+
+    def compute_shard(
+        self,
+        structure_source: StructureSourceType,
+        shard: int,
+        num_shards: int,
+        directory: str,
+        radii: Union[float, None] = None,
+    ) -> str:
+        """
+        Evaluate one shard of the pair sum of a single (huge) structure and write it to a file in a directory, to be reduced by reduce_shards.
+
+        The N(N-1)/2 unique atom pairs are split into num_shards contiguous ranges of equal size of the linear pair index of _pair_tiles,
+        such that the shards are balanced. Shards are independent, so they can be evaluated by separate processes, or by the tasks of a job
+        array on hosts that share a filesystem, with no coordination beyond the shard files. Each file is written under a temporary name
+        and renamed when complete, such that a reduction never reads a partially written shard.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            shard (int): Index of the shard, from 0 to num_shards - 1.
+            num_shards (int): Number of shards.
+            directory (str): Directory of the shard files, created if it does not exist.
+            radii (Union[float, None]): Radius of the particle to generate with parsed CIF.
+
+        Returns:
+            str: Path of the shard file.
+
+        Raises:
+            ValueError: If the structure source holds more than one structure, the engine is 'lattice', or the shard is out of range.
+        """
+        structure = self._initialise_shard_structure(structure_source, radii)
+        return self._compute_shards(structure, [shard], num_shards, directory)[0]
+
+    def _compute_shards(
+        self,
+        structure: StructureTuple,
+        shards: List[int],
+        num_shards: int,
+        directory: str,
+    ) -> List[str]:
+        """
+        Evaluate shards of the pair sum of a structure and write them to files in a directory, as in compute_shard.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+            shards (List[int]): Indices of the shards.
+            num_shards (int): Number of shards.
+            directory (str): Directory of the shard files, created if it does not exist.
+
+        Returns:
+            List[str]: Paths of the shard files.
+
+        Raises:
+            ValueError: If a shard is out of range.
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards must be positive.")
+        os.makedirs(directory, exist_ok=True)
+        num_pairs = structure.size * (structure.size - 1) // 2
+        fingerprint = self._shard_fingerprint(structure)
+
+        paths = []
+        for shard in shards:
+            if not 0 <= shard < num_shards:
+                raise ValueError(f"shard must be in the range [0, {num_shards - 1}].")
+            start, stop = shard * num_pairs // num_shards, (shard + 1) * num_pairs // num_shards
+
+            # Pair terms (including the Debye-Waller factor, which is common to all pairs) are linear in the pairs, so the shards sum to the full pair term
+            if self.engine == 'exact':
+                values = self._debye_sum(structure, start, stop)
+            else:
+                values = self._partial_debye_sums(structure, start, stop)
+
+            path = self._shard_path(directory, shard, num_shards)
+            temporary_path = f'{path}.{os.getpid()}.tmp.npz'
+            np.savez(temporary_path, values=values.cpu().numpy().astype(np.float64), fingerprint=np.array(fingerprint), shard=shard, num_shards=num_shards)
+            os.replace(temporary_path, path)
+            paths.append(path)
+
+        return paths
+
+    def reduce_shards(
+        self,
+        structure_source: StructureSourceType,
+        num_shards: int,
+        directory: str,
+        radii: Union[float, None] = None,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        keep_on_device: bool = False,
+        _self_scattering: bool = True,
+    ) -> Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]:
+        """
+        Sum the shards of the pair sum of a single structure, written by compute_shard, and derive any subset of I(Q), S(Q), F(Q) and G(r).
+
+        The shards are summed in double precision in the order of their index, such that the result does not depend on which host evaluated which shard.
+        The shards must have been evaluated with the same structure and parameters as this DebyeCalculator, which is checked with a fingerprint.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            num_shards (int): Number of shards.
+            directory (str): Directory of the shard files.
+            radii (Union[float, None]): Radius of the particle to generate with parsed CIF.
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, as in compute(). Default is ('iq', 'sq', 'fq', 'gr').
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            _self_scattering (bool): Flag to compute self-scattering contribution to I(Q). Default is True.
+
+        Returns:
+            Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]: The requested quantities, keyed by name.
+
+        Raises:
+            FileNotFoundError: If shard files are missing, listing their indices.
+            ValueError: If a shard file belongs to another structure or parameters, an invalid output is requested, or the structure source holds more than one structure.
+        """
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        outputs = tuple(outputs)
+        for name in outputs:
+            if name not in ['iq', 'sq', 'fq', 'gr', 'sq_partial']:
+                raise ValueError(f"Invalid output '{name}', valid outputs include ['iq', 'sq', 'fq', 'gr', 'sq_partial']")
+        if 'sq_partial' in outputs and self.engine not in ['partial', 'histogram']:
+            raise ValueError("The output 'sq_partial' requires the 'partial' or 'histogram' engine")
+
+        structure = self._initialise_shard_structure(structure_source, radii)
+        fingerprint = self._shard_fingerprint(structure)
+
+        missing = [shard for shard in range(num_shards) if not os.path.isfile(self._shard_path(directory, shard, num_shards))]
+        if missing:
+            raise FileNotFoundError(f"Missing {len(missing)} of {num_shards} shards in {directory}: {missing}")
+
+        total = None
+        for shard in range(num_shards):
+            with np.load(self._shard_path(directory, shard, num_shards), allow_pickle=False) as data:
+                if str(data['fingerprint']) != fingerprint:
+                    raise ValueError(f"Shard {shard} in {directory} was evaluated for another structure or other parameters")
+                total = data['values'] if total is None else total + data['values']
+
+        values = torch.from_numpy(total).to(device=self.device, dtype=PRECISION_DTYPES[self.precision][1])
+        if self.engine == 'exact':
+            results = self._derive_outputs(structure, values, outputs, _self_scattering)
+        else:
+            results = self._derive_outputs(structure, torch.sum(values, dim=(0,1)), outputs, _self_scattering, values)
+        if not keep_on_device:
+            results = {name: type(result)(*[t.cpu().numpy() if isinstance(t, torch.Tensor) else t for t in result]) for name, result in results.items()}
+
+        return results
+
+    def compute_sharded(
+        self,
+        structure_source: StructureSourceType,
+        num_shards: int,
+        directory: str,
+        radii: Union[float, None] = None,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        workers: Union[int, None] = None,
+        threads_per_worker: Union[int, None] = None,
+        keep_on_device: bool = False,
+    ) -> Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]:
+        """
+        Evaluate the shards of the pair sum of a single structure with local worker processes and reduce them, as compute_shard and reduce_shards.
+
+        Shards whose files already exist in the directory (e.g. from an interrupted run, or from other hosts) are not evaluated again.
+        The missing shards are dealt round-robin to the workers, which each prepare the structure once.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            num_shards (int): Number of shards.
+            directory (str): Directory of the shard files, created if it does not exist.
+            radii (Union[float, None]): Radius of the particle to generate with parsed CIF.
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, as in compute(). Default is ('iq', 'sq', 'fq', 'gr').
+            workers (Union[int, None]): Number of worker processes. If None, the number of CPUs is used. Default is None.
+            threads_per_worker (Union[int, None]): Number of PyTorch intra-op threads of each worker. If None, the CPUs are divided evenly between the workers. Default is None.
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+
+        Returns:
+            Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple, PartialSqTuple]]: The requested quantities, keyed by name.
+
+        Raises:
+            ValueError: If workers or threads_per_worker is not positive, or as compute_shard and reduce_shards.
+        """
+        num_cpus = os.cpu_count() or 1
+        workers = num_cpus if workers is None else workers
+        if workers < 1:
+            raise ValueError("workers must be positive.")
+        threads_per_worker = max(1, num_cpus // workers) if threads_per_worker is None else threads_per_worker
+        if threads_per_worker < 1:
+            raise ValueError("threads_per_worker must be positive.")
+        if num_shards < 1:
+            raise ValueError("num_shards must be positive.")
+
+        # Validate the structure source before starting the workers
+        self._initialise_shard_structure(structure_source, radii)
+
+        missing = [shard for shard in range(num_shards) if not os.path.isfile(self._shard_path(directory, shard, num_shards))]
+        if missing:
+            workers = min(workers, len(missing))
+            initargs = (dict(self._parameters(), profile=False), threads_per_worker)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=initialise_worker, initargs=initargs) as executor:
+                futures = [executor.submit(compute_shards_in_worker, structure_source, missing[w::workers], dict(num_shards=num_shards, directory=directory, radii=radii)) for w in range(workers)]
+                for future in futures:
+                    future.result()
+
+        return self.reduce_shards(structure_source, num_shards, directory, radii=radii, outputs=outputs, keep_on_device=keep_on_device)
+
+    def _initialise_shard_structure(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[float, None] = None,
+    ) -> StructureTuple:
+        """
+        Initialise the single structure of a structure source whose pair sum is sharded.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[float, None]): Radius of the particle to generate with parsed CIF.
+
+        Returns:
+            StructureTuple: Initialised structure.
+
+        Raises:
+            ValueError: If the structure source holds more than one structure, or the engine is 'lattice'.
+        """
+        if self.engine == 'lattice':
+            raise ValueError("Sharding requires the 'exact', 'partial' or 'histogram' engine")
+        structures = self._initialise_structures(structure_source, radii)
+        if len(structures) != 1:
+            raise ValueError("Sharding requires a structure source holding a single structure")
+        return structures[0]
+
+    def _shard_fingerprint(
+        self,
+        structure: StructureTuple,
+    ) -> str:
+        """
+        Get a hash of a structure and the parameters of the pair sum, which identifies the shards that can be reduced together.
+
+        The device is not included, such that shards evaluated on different devices can be reduced together.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            str: Hex digest of the hash.
+        """
+        h = hashlib.sha256()
+        h.update(repr((
+            self.engine, self.qmin, self.qmax, self.qstep, self.rthres, self.biso, self.radiation_type.lower()[0], self.precision,
+            self._histogram_bin_width() if self.engine == 'histogram' else None, structure.size,
+        )).encode())
+        h.update(b'\0'.join(str(e).encode() for e in structure.elements))
+        h.update(structure.xyz.cpu().numpy().tobytes())
+        h.update(structure.occupancy.cpu().numpy().tobytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def _shard_path(
+        directory: str,
+        shard: int,
+        num_shards: int,
+    ) -> str:
+        """
+        Get the path of a shard file.
+
+        Parameters:
+            directory (str): Directory of the shard files.
+            shard (int): Index of the shard.
+            num_shards (int): Number of shards.
+
+        Returns:
+            str: Path of the shard file.
+        """
+        return os.path.join(directory, f'shard_{shard:06d}_of_{num_shards:06d}.npz')
+
+    def estimate(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        calibrate: bool = True,
+        calibration_radii: Tuple[float, ...] = (6.0, 10.0),
+        gr_method: str = 'reciprocal',
+    ) -> Union[EstimateTuple, List[EstimateTuple]]:
+        """
+        Estimate the memory and time cost of compute() for the given atomic structure(s) without running the calculation.
+
+        The peak memory is predicted from the structure, the intermediates of one batch of atom pairs (or histogram bins) of the configured engine,
+        the histograms of the 'histogram' engine, the cell list of the real-space G(r) and the G(r) transformation kernel.
+        Structures that compute() packs together with the 'exact' engine share their batches, so each reports the batches and peak memory of its pack.
+        The time is predicted from a linear model in the number of pairs, calibrated once per device and parameter set with a quick
+        DebyeBenchmarker run on small particles of the benchmark structure.
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, as in compute(). Default is ('iq', 'sq', 'fq', 'gr').
+            calibrate (bool): Flag to calibrate the time estimate with a micro-benchmark. If False, the estimated time is None. Default is True.
+            calibration_radii (Tuple[float, ...]): Radii of the benchmark particles used for calibration. Default is (6.0, 10.0).
+            gr_method (str): Method for G(r), as in compute(). The time of the 'realspace' method (and of the 'lattice' engine) is not estimated (None). Default is 'reciprocal'.
+
+        Returns:
+            Union[EstimateTuple, List[EstimateTuple]]: EstimateTuple containing the number of atoms, number of pairs, batch size, number of batches,
+            peak memory in bytes and estimated time in seconds, or a list of such tuples.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If the gr_method is invalid, the file extension is not valid or when providing .cif data file, radii is not provided.
+        """
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        outputs = tuple(outputs)
+        if gr_method not in ['reciprocal', 'realspace']:
+            raise ValueError("Invalid gr_method, valid methods include ['reciprocal', 'realspace']")
+        realspace = gr_method == 'realspace' and 'gr' in outputs
+        pair_outputs = tuple(name for name in outputs if not (realspace and name == 'gr'))
+
+        structures = self._initialise_structures(structure_source, radii)
+
+        if realspace and calibrate:
+            warnings.warn("Warning: The time of the 'realspace' G(r) method is not estimated", stacklevel=2)
+            seconds_per_pair = None
+        elif self.engine == 'lattice' and calibrate:
+            warnings.warn("Warning: The time of the 'lattice' engine is not estimated", stacklevel=2)
+            seconds_per_pair = None
+        else:
+            seconds_per_pair = self._time_calibration(outputs, calibration_radii) if calibrate else None
+
+        # The sine transformation kernel and its product with the Lorch modification
+        kernel_bytes = 2 * 4 * len(self.q) * len(self.r) if 'gr' in outputs else 0
+
+        # Batch size, number of batches and peak bytes of the pair sum of each structure, shared within packs
+        costs = []
+        if not pair_outputs:
+            costs = [(0, 0, 0)] * len(structures)
+        elif self.engine == 'exact' and self.packing_budget != 0 and 'sq_partial' not in outputs:
+            for pack in self._packs(structures):
+                costs.extend([self._packed_pair_sum_cost(pack)] * len(pack))
+        else:
+            costs = [self._pair_sum_cost(structure) for structure in structures]
+
+        estimates = []
+        for structure, (batch_size, num_batches, peak_bytes) in zip(structures, costs):
+            num_pairs = structure.size * (structure.size - 1) // 2
+            if realspace:
+                realspace_batches, realspace_bytes = self._realspace_cost(structure)
+                num_batches += realspace_batches
+                peak_bytes = max(peak_bytes, self._structure_nbytes(structure) + realspace_bytes)
+                batch_size = batch_size or self._tile_size()
+            seconds = None if seconds_per_pair is None else seconds_per_pair[0] + seconds_per_pair[1] * num_pairs
+            estimates.append(EstimateTuple(structure.size, num_pairs, batch_size, num_batches, peak_bytes + kernel_bytes, seconds))
+
+        return estimates if len(estimates) > 1 else estimates[0]
+
+    def _pair_sum_cost(
+        self,
+        structure: StructureTuple,
+    ) -> Tuple[int, int, int]:
+        """
+        Estimate the batch size, number of batches and peak bytes of the pair sum of a single structure with the configured engine.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            Tuple[int, int, int]: Batch size (of the atom pairs), number of batches and peak bytes including the structure.
+        """
+        num_pairs = structure.size * (structure.size - 1) // 2
+        num_classes = len(structure.unique_form_factors)**2
+        structure_bytes = self._structure_nbytes(structure)
+
+        if self.engine == 'exact':
+            batch_size = self._tile_size()
+            return batch_size, -(-num_pairs // batch_size), structure_bytes + min(num_pairs, batch_size) * self._bytes_per_pair()
+
+        # The class sums and the partial pair terms formed from them
+        class_bytes = 2 * 4 * num_classes * len(self.q)
+        sites = self._lattice_sites(structure) if self.engine == 'lattice' else None
+        if sites is not None:
+            translations, _, offsets = sites
+            num_cells = int(torch.prod(2 * (translations.amax(dim=0) - translations.amin(dim=0)) + 1))
+            num_site_pairs = len(offsets) * (len(offsets) + 1) // 2
+
+            # The occupancy grids of the sites and their spectra, and the candidate distances (at most one per atom pair and per site pair and lattice translation)
+            # with their count, class, weight, translation and merge key (64 bytes)
+            num_distances = min(num_pairs, num_site_pairs * num_cells)
+            lattice_bytes = 3 * 8 * len(offsets) * num_cells + 64 * num_distances
+            batch_size = self._tile_size(num_classes)
+            return batch_size, -(-num_distances // batch_size), structure_bytes + class_bytes + max(lattice_bytes, min(num_distances, batch_size) * self._bytes_per_pair(num_classes))
+
+        if self.engine in ['partial', 'lattice']:
+            batch_size = self._tile_size(num_classes)
+            return batch_size, -(-num_pairs // batch_size), structure_bytes + class_bytes + min(num_pairs, batch_size) * self._bytes_per_pair(num_classes)
+
+        batch_size = self._tile_size()
+        num_batches, histogram_bytes = self._histogram_cost(num_pairs, num_classes, self._histogram_num_bins(structure), batch_size)
+        return batch_size, -(-num_pairs // batch_size) + num_batches, structure_bytes + class_bytes + histogram_bytes
+
+    def _histogram_cost(
+        self,
+        num_pairs: int,
+        num_classes: int,
+        num_bins: int,
+        batch_size: int,
+        bytes_per_pair: int = 136,
+    ) -> Tuple[int, int]:
+        """
+        Estimate the number of bin batches and peak bytes of binning pair distances into element-pair histograms and summing over the occupied bins.
+
+        Parameters:
+            num_pairs (int): Number of binned pairs.
+            num_classes (int): Number of element-pair classes.
+            num_bins (int): Number of bins of each histogram.
+            batch_size (int): Number of pairs per binning batch.
+            bytes_per_pair (int): Bytes of the binning intermediates per pair, the pair decoding and distance intermediates (96 bytes)
+                together with the bin and class indices and the two float64 weights. Default is 136.
+
+        Returns:
+            Tuple[int, int]: Number of bin batches and peak bytes.
+        """
+        # Two float64 (n_classes * n_bins) histograms, of the weights and weighted distances
+        histogram_bytes = 2 * 8 * num_classes * num_bins
+        binning_bytes = min(num_pairs, batch_size) * bytes_per_pair
+
+        # At most one occupied bin per pair, each with its index, weight, distance sum, mean distance and class (40 bytes)
+        num_occupied = min(num_pairs, num_classes * num_bins)
+        bin_batch_size = self._tile_size(num_classes)
+        summing_bytes = 40 * num_occupied + min(num_occupied, bin_batch_size) * self._bytes_per_pair(num_classes)
+
+        return -(-num_occupied // bin_batch_size), histogram_bytes + max(binning_bytes, summing_bytes)
+
+    def _packed_pair_sum_cost(
+        self,
+        structures: List[StructureTuple],
+    ) -> Tuple[int, int, int]:
+        """
+        Estimate the batch size, number of batches and peak bytes of the pair sum of a pack of structures with the 'exact' engine.
+
+        Parameters:
+            structures (List[StructureTuple]): Initialised structures of a pack, as returned by _packs.
+
+        Returns:
+            Tuple[int, int, int]: Batch size, number of (shared) batches and peak bytes including the structures.
+        """
+        if len(structures) == 1:
+            return self._pair_sum_cost(structures[0])
+
+        batch_size = self._tile_size()
+        num_pairs = sum(structure.size * (structure.size - 1) // 2 for structure in structures)
+
+        # The concatenated structures, and per pair, the structure index and its pair offsets (24 bytes) and the (n_structures, n_q) sums
+        structure_bytes = 2 * sum(self._structure_nbytes(structure) for structure in structures)
+        tile_bytes = min(num_pairs, batch_size) * (self._bytes_per_pair() + 24) + 4 * len(structures) * len(self.q)
+
+        return batch_size, -(-num_pairs // batch_size), structure_bytes + tile_bytes
+
+    def _realspace_cost(
+        self,
+        structure: StructureTuple,
+    ) -> Tuple[int, int]:
+        """
+        Estimate the number of batches and peak bytes (excluding the structure) of the real-space G(r) of a single structure.
+
+        The number of candidate pairs of the cell list is estimated from the mean number of atoms per occupied cell of the bounding box.
+
+        Parameters:
+            structure (StructureTuple): Initialised structure.
+
+        Returns:
+            Tuple[int, int]: Number of batches and peak bytes.
+        """
+        cutoff = self.rmax + self.realspace_margin
+        num_classes = len(structure.unique_form_factors)**2
+        batch_size = self._tile_size()
+        if structure.size < 2:
+            return 0, 0
+
+        # Cells of the bounding box, and the candidate pairs of each atom in the 14 cells of the half shell
+        dims = torch.floor((structure.xyz.amax(dim=0) - structure.xyz.amin(dim=0)) / cutoff) + 1
+        num_cells = int(torch.prod(dims).item())
+        num_candidates = int(14 * structure.size * min(structure.size, structure.size / num_cells))
+        num_pairs = min(num_candidates, structure.size * (structure.size - 1) // 2)
+
+        # Per atom, the cell, sorting and neighbour cell intermediates (128 bytes), per cell the counts and starts (16 bytes),
+        # and per candidate pair the indices, distance and masks (128 bytes)
+        cell_list_bytes = 128 * structure.size + 16 * num_cells + min(num_candidates, batch_size) * 128
+
+        histogram_batches, histogram_bytes = self._histogram_cost(num_pairs, num_classes, self._histogram_num_bins(structure, cutoff), batch_size, bytes_per_pair=40)
+        # Each of the 14 cell offsets is enumerated in separate batches
+        num_batches = 14 + -(-num_candidates // batch_size) + histogram_batches
+
+        return num_batches, cell_list_bytes + 2 * 4 * num_classes * len(self.q) + histogram_bytes
+
+    def _time_calibration(
+        self,
+        outputs: Tuple[str, ...],
+        calibration_radii: Tuple[float, ...],
+    ) -> Tuple[float, float]:
+        """
+        Calibrate a linear model of the time of compute() in the number of pairs, t = a + b * num_pairs, with DebyeBenchmarker.
+
+        The calibration is memoised per device, Q-grid, r-grid, engine, batch size and outputs.
+
+        Parameters:
+            outputs (Tuple[str, ...]): Quantities to calculate.
+            calibration_radii (Tuple[float, ...]): Radii of the benchmark particles.
+
+        Returns:
+            Tuple[float, float]: Fixed time a and time per pair b, in seconds.
+        """
+        # Imported here, as the benchmark module imports DebyeCalculator
+        from debyecalculator.utility.benchmark import DebyeBenchmarker
+
+        parameters = dict(
+            qmin=self.qmin, qmax=self.qmax, qstep=self.qstep, qdamp=self.qdamp, rmin=self.rmin, rmax=self.rmax, rstep=self.rstep,
+            rthres=self.rthres, biso=self.biso, device=self.device, batch_size=self.batch_size, lorch_mod=self.lorch_mod,
+            radiation_type=self.radiation_type, engine=self.engine, histogram_bin_width=self.histogram_bin_width,
+            histogram_error=self.histogram_error, memory_budget_bytes=self.memory_budget_bytes, precision=self.precision,
+            compensated_summation=self.compensated_summation,
+        )
+        key = (tuple(sorted(parameters.items(), key=lambda item: item[0])), outputs, tuple(calibration_radii))
+        if key not in self._time_calibrations:
+            benchmarker = DebyeBenchmarker(function='compute', radii=list(calibration_radii), show_progress_bar=False, outputs=list(outputs), **parameters)
+            stat = benchmarker.benchmark(repetitions=1, dummy_repititions=1)
+            num_pairs = np.array(stat.num_atoms) * (np.array(stat.num_atoms) - 1) / 2
+            if len(num_pairs) > 1 and np.ptp(num_pairs) > 0:
+                b, a = np.polyfit(num_pairs, stat.means, 1)
+            else:
+                a, b = 0.0, stat.means[-1] / max(num_pairs[-1], 1)
+            self._time_calibrations[key] = (max(float(a), 0.0), max(float(b), 0.0))
+
+        return self._time_calibrations[key]
+
+    def iq(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        keep_on_device: bool = False,
+        _self_scattering: bool = True,
+    ) -> Union[IqTuple, List[IqTuple]]:
+        """
+        Calculate the scattering intensity I(Q) for the given atomic structure(s).
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            _self_scattering (bool): Flag to compute self-scattering contribution. Default is True.
+
+        Returns:
+            Union[IqTuple, List[IqTuple]]: IqTuple containing Q-values and scattering intensity I(Q) or a list of such tuples.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+        """
+        output = self.compute(structure_source, radii, outputs=('iq',), keep_on_device=keep_on_device, _self_scattering=_self_scattering)
+        return [o['iq'] for o in output] if isinstance(output, list) else output['iq']
+
+    def sq(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        keep_on_device: bool = False,
+    ) -> Union[SqTuple, List[SqTuple]]:
+        """
+        Calculate the structure function S(Q) for the given atomic structure(s)
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object or as a tuple of (atomic_identities, atomic_positions)
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU
+
+        Returns:
+            SqTuple containing Q-values and structure function S(Q)
+        """
+        output = self.compute(structure_source, radii, outputs=('sq',), keep_on_device=keep_on_device)
+        return [o['sq'] for o in output] if isinstance(output, list) else output['sq']
+
+    def fq(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        keep_on_device: bool = False,
+    ) -> Union[FqTuple, List[FqTuple]]:
+        """
+        Calculate the structure function S(Q) for the given atomic structure(s).
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+
+        Returns:
+            Union[SqTuple, List[SqTuple]]: SqTuple containing Q-values and structure function S(Q) or a list of such tuples.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+        """
+        output = self.compute(structure_source, radii, outputs=('fq',), keep_on_device=keep_on_device)
+        return [o['fq'] for o in output] if isinstance(output, list) else output['fq']
+
+    def gr(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        keep_on_device: bool = False,
+        gr_method: str = 'reciprocal',
+    ) -> Union[GrTuple, List[GrTuple]]:
+        """
+        Calculate the reduced pair distribution function G(r) for the given atomic structure(s).
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+            gr_method (str): Method for G(r), either 'reciprocal' or 'realspace' (pairs within rmax + realspace_margin only, found with a cell list). Default is 'reciprocal'.
+
+        Returns:
+            Union[GrTuple, List[GrTuple]]: GrTuple containing r-values and reduced pair distribution function G(r) or a list of such tuples.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided, or the gr_method is invalid.
+        """
+        output = self.compute(structure_source, radii, outputs=('gr',), keep_on_device=keep_on_device, gr_method=gr_method)
+        return [o['gr'] for o in output] if isinstance(output, list) else output['gr']
+
+    def _get_all(
+        self,
+        structure_source: StructureSourceType,
+        radii: Union[List[float], float, None] = None,
+        keep_on_device: bool = False,
+    ) -> Union[AllTuple, List[AllTuple]]:
+        """
+        Calculate I(Q), S(Q), F(Q), and G(r) for the given atomic structure(s).
+
+        Parameters:
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[List[float], float, None]): List/float of radii/radius of particle(s) to generate with parsed CIF.
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+
+        Returns:
+            Union[AllTuple, List[AllTuple]]: AllTuple containing r-values, Q-values, I(Q), S(Q), F(Q), and G(r) or a list of such tuples.
+
+        Raises:
+            TypeError: If the structure source is of an invalid type.
+            IOError: If there is an issue loading the structure from the specified file.
+            ValueError: If the file extension is not valid or when providing .cif data file, radii is not provided.
+        """
+        output = self.compute(structure_source, radii, outputs=('iq', 'sq', 'fq', 'gr'), keep_on_device=keep_on_device)
+        all_tuple = lambda o: AllTuple(o['gr'].r, o['iq'].q, o['iq'].i, o['sq'].s, o['fq'].f, o['gr'].g)
+        return [all_tuple(o) for o in output] if isinstance(output, list) else all_tuple(output)
+
     def _is_notebook(
         self,
     ) -> bool:
@@ -900,7 +2362,7 @@ class DebyeCalculator:
         rthres = self.rthres
         biso = self.biso
         device = 'cuda' if torch.cuda.is_available() else self.device
-        batch_size = self.batch_size
+        batch_size = self._tile_size()
         lorch_mod = self.lorch_mod
         radiation_type = self.radiation_type
         profile = False
@@ -0,0 +1,307 @@
+import warnings
+from typing import Union, Tuple, List, Dict
+
+import numpy as np
+import torch
+
+from debyecalculator.debye_calculator import (
+    DebyeCalculator,
+    PRECISION_DTYPES,
+    StructureSourceType,
+    StructureTuple,
+    IqTuple,
+    SqTuple,
+    FqTuple,
+    GrTuple,
+)
+
+IndexLike = Union[int, List[int], np.ndarray, torch.Tensor]
+
+class DebyeSession:
+    """
+    Keep the pair term of the Debye scattering equation of a single structure up to date under local changes, as in Monte Carlo and RMC refinements.
+
+    Moving, substituting or changing the occupancy of k atoms only changes the pair terms that involve those atoms, so the pair term is updated by
+    subtracting their old and adding their new contributions in O(k * N * n_q) instead of recalculating all O(N^2) pairs.
+    The updated pair term is accumulated in double precision, and a full recalculation every drift_check_interval updates bounds the accumulated drift.
+    """
+
+    def __init__(
+        self,
+        calculator: DebyeCalculator,
+        structure_source: StructureSourceType,
+        radii: Union[float, None] = None,
+        drift_check_interval: int = 1000,
+        drift_tolerance: float = 1e-4,
+    ) -> None:
+        """
+        Initialize a DebyeSession for a single structure.
+
+        Parameters:
+            calculator (DebyeCalculator): Calculator providing the scattering parameters. Its Q-grid, device and radiation type are followed by the session.
+            structure_source (StructureSourceType): Atomic structure source in XYZ/CIF format, ASE Atoms object, or as a tuple of (atomic_identities, atomic_positions).
+            radii (Union[float, None]): Radius of the particle to generate with parsed CIF.
+            drift_check_interval (int): Number of updates between full recalculations of the pair term. Set to 0 to disable. Default is 1000.
+            drift_tolerance (float): Relative deviation between the updated and recalculated pair term above which a warning is issued. Default is 1e-4.
+
+        Raises:
+            ValueError: If the structure source holds more than one structure, the calculator uses the 'histogram' or 'lattice' engine, or a parameter is invalid.
+        """
+        if calculator.engine in ['histogram', 'lattice']:
+            raise ValueError("DebyeSession requires the 'exact' or 'partial' engine")
+        if drift_check_interval < 0:
+            raise ValueError("drift_check_interval must be non-negative.")
+        if drift_tolerance <= 0:
+            raise ValueError("drift_tolerance must be positive.")
+
+        structures = calculator._initialise_structures(structure_source, radii)
+        if len(structures) != 1:
+            raise ValueError(f'DebyeSession holds a single structure, but got {len(structures)}')
+        structure = structures[0]
+
+        self.calculator = calculator
+        self.drift_check_interval = drift_check_interval
+        self.drift_tolerance = drift_tolerance
+
+        # Mutable state of the structure, with elements as codes into the (growing) list of symbols
+        self.symbols, codes = np.unique(structure.elements, return_inverse=True)
+        self.symbols = [str(symbol) for symbol in self.symbols]
+        self.codes = torch.from_numpy(codes.reshape(-1)).to(device=calculator.device)
+        self.xyz = structure.xyz.clone()
+        self.occupancy = structure.occupancy.clone()
+
+        self.updates = 0
+        self.last_drift = 0.0
+        self.recompute()
+
+    def _grid_key(
+        self,
+    ) -> Tuple:
+        return (self.calculator.qmin, self.calculator.qmax, self.calculator.qstep, self.calculator.radiation_type, self.calculator.device)
+
+    @property
+    def structure(
+        self,
+    ) -> StructureTuple:
+        """
+        The current structure as a StructureTuple.
+        """
+        unique_codes, inverse, counts = torch.unique(self.codes, return_inverse=True, return_counts=True)
+        unique_form_factors = self.form_factors[unique_codes]
+        compositional_fractions = counts / torch.sum(counts)
+        form_avg_sq = torch.sum(compositional_fractions.reshape(-1,1) * unique_form_factors, dim=0)**2
+        elements = [self.symbols[c] for c in self.codes.tolist()]
+
+        return StructureTuple(elements, len(elements), self.occupancy, self.xyz, unique_form_factors, form_avg_sq, inverse)
+
+    def recompute(
+        self,
+    ) -> float:
+        """
+        Recalculate the full pair term, replacing the updated one.
+
+        Returns:
+            float: Maximum deviation of the updated pair term from the recalculated one, relative to the maximum of the recalculated pair term.
+        """
+        self.form_factors = self.calculator._form_factors(self.symbols)
+        recomputed = self.calculator._undamped_debye_sums([self.structure])[0].to(dtype=torch.float64)
+
+        if getattr(self, '_grid', None) == self._grid_key():
+            self.last_drift = (torch.max(torch.abs(self.pair_sum - recomputed)) / torch.clamp(torch.max(torch.abs(recomputed)), min=1e-12)).item()
+            if self.last_drift > self.drift_tolerance:
+                warnings.warn(f"Warning: The incrementally updated Debye sum drifted by {self.last_drift:.2e} (relative) from a full recalculation", stacklevel=2)
+
+        self.pair_sum = recomputed
+        self._grid = self._grid_key()
+        self.updates = 0
+
+        return self.last_drift
+
+    def _index(
+        self,
+        idx: IndexLike,
+    ) -> torch.Tensor:
+        idx = torch.as_tensor(idx, device=self.calculator.device, dtype=torch.int64).reshape(-1)
+        if len(torch.unique(idx)) != len(idx):
+            raise ValueError('Atom indices must be unique')
+        return idx
+
+    def _affected_pair_sum(
+        self,
+        idx: torch.Tensor,
+    ) -> torch.Tensor:
+        """
+        Calculate the sum of the pair terms that involve at least one of the atoms idx, in O(k * N * n_q).
+
+        The pair terms are evaluated in the compute dtype of the precision mode of the calculator and summed in its accumulation dtype, as in a full calculation.
+
+        Parameters:
+            idx (torch.Tensor): Unique atom indices.
+
+        Returns:
+            torch.Tensor: Pair term of the affected pairs in double precision, evaluated at the Q-grid of the calculator.
+        """
+        calc = self.calculator
+        compute_dtype, accumulate_dtype = PRECISION_DTYPES[calc.precision]
+        distance_dtype = torch.float64 if compute_dtype == torch.float64 else torch.float32
+        num_q = len(calc.q)
+        size = len(self.xyz)
+        chunk = max(1, calc._tile_size() // len(idx))
+
+        # Pairs within idx appear in two rows, and are weighted by a half in each
+        self_weights = torch.ones((len(idx), size), device=calc.device, dtype=torch.float32)
+        self_weights[:, idx] = 0.5
+        self_weights[torch.arange(len(idx), device=calc.device), idx] = 0.0
+
+        xyz = self.xyz.to(dtype=distance_dtype)
+        form_factors_i = (self.form_factors[self.codes[idx]] * self.occupancy[idx].unsqueeze(-1)).to(dtype=compute_dtype)
+        pair_sum = torch.zeros(num_q, device=calc.device, dtype=torch.float64)
+        for start in range(0, size, chunk):
+            stop = min(start + chunk, size)
+            d = torch.norm(xyz[idx].unsqueeze(1) - xyz[start:stop].unsqueeze(0), dim=-1)
+            weights = (self_weights[:, start:stop] * (d >= calc.rthres) * self.occupancy[start:stop]).to(dtype=compute_dtype)
+            form_factors_j = self.form_factors[self.codes[start:stop]].to(dtype=compute_dtype)
+            sinc = calc._sinc(d.reshape(-1)).permute(1,0).reshape(len(idx), stop - start, num_q)
+            rows = torch.sum(weights.unsqueeze(-1) * form_factors_j.unsqueeze(0) * sinc, dim=1, dtype=accumulate_dtype)
+            pair_sum += torch.sum(form_factors_i * rows, dim=0, dtype=accumulate_dtype).to(dtype=torch.float64)
+
+        return pair_sum
+
+    def _update(
+        self,
+        idx: torch.Tensor,
+        apply,
+    ) -> None:
+        if self._grid != self._grid_key():
+            apply()
+            self.recompute()
+            return
+
+        old = self._affected_pair_sum(idx)
+        apply()
+        self.pair_sum += self._affected_pair_sum(idx) - old
+
+        self.updates += 1
+        if self.drift_check_interval > 0 and self.updates >= self.drift_check_interval:
+            self.recompute()
+
+    def move_atoms(
+        self,
+        idx: IndexLike,
+        new_xyz: Union[np.ndarray, torch.Tensor],
+    ) -> None:
+        """
+        Move atoms to new positions.
+
+        Parameters:
+            idx (IndexLike): Unique indices of the atoms to move.
+            new_xyz (Union[np.ndarray, torch.Tensor]): New positions of shape (k, 3).
+        """
+        idx = self._index(idx)
+        new_xyz = torch.as_tensor(new_xyz, device=self.calculator.device, dtype=torch.float32).reshape(len(idx), 3)
+
+        def apply():
+            self.xyz[idx] = new_xyz
+        self._update(idx, apply)
+
+    def swap_elements(
+        self,
+        idx: IndexLike,
+        new_el: Union[str, List[str]],
+    ) -> None:
+        """
+        Substitute the element of atoms.
+
+        Parameters:
+            idx (IndexLike): Unique indices of the atoms to substitute.
+            new_el (Union[str, List[str]]): New element symbol, or one symbol per atom.
+
+        Raises:
+            ValueError: If an element symbol is unknown.
+        """
+        idx = self._index(idx)
+        new_el = [new_el] * len(idx) if isinstance(new_el, str) else list(new_el)
+        for el in new_el:
+            if el not in self.calculator.element_table:
+                raise ValueError(f'Encountered unknown element {el}')
+            if el not in self.symbols:
+                self.symbols.append(el)
+        self.form_factors = self.calculator._form_factors(self.symbols)
+        new_codes = torch.tensor([self.symbols.index(el) for el in new_el], device=self.calculator.device, dtype=torch.int64)
+
+        def apply():
+            self.codes[idx] = new_codes
+        self._update(idx, apply)
+
+    def set_occupancy(
+        self,
+        idx: IndexLike,
+        occ: Union[float, List[float], np.ndarray, torch.Tensor],
+    ) -> None:
+        """
+        Change the occupancy of atoms.
+
+        Parameters:
+            idx (IndexLike): Unique indices of the atoms.
+            occ (Union[float, List[float], np.ndarray, torch.Tensor]): New occupancy, or one occupancy per atom.
+        """
+        idx = self._index(idx)
+        occ = torch.as_tensor(occ, device=self.calculator.device, dtype=torch.float32).expand(len(idx))
+
+        def apply():
+            self.occupancy[idx] = occ
+        self._update(idx, apply)
+
+    def compute(
+        self,
+        outputs: Union[str, List[str], Tuple[str, ...]] = ('iq', 'sq', 'fq', 'gr'),
+        keep_on_device: bool = False,
+    ) -> Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple]]:
+        """
+        Calculate any subset of I(Q), S(Q), F(Q) and G(r) of the current structure from the updated pair term.
+
+        Parameters:
+            outputs (Union[str, List[str], Tuple[str, ...]]): Name(s) of the quantities to calculate, any of 'iq', 'sq', 'fq' and 'gr'. Default is all four.
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+
+        Returns:
+            Dict[str, Union[IqTuple, SqTuple, FqTuple, GrTuple]]: The requested quantities, keyed by name.
+
+        Raises:
+            ValueError: If an invalid output is requested.
+        """
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        outputs = tuple(outputs)
+        for name in outputs:
+            if name not in ['iq', 'sq', 'fq', 'gr']:
+                raise ValueError(f"Invalid output '{name}', valid outputs include ['iq', 'sq', 'fq', 'gr']")
+
+        if self._grid != self._grid_key():
+            self.recompute()
+
+        calc = self.calculator
+        iq = self.pair_sum.to(dtype=PRECISION_DTYPES[calc.precision][1])
+        if calc.biso != 0.0:
+            iq = iq * torch.exp(-calc.q.squeeze(-1).pow(2) * calc.biso/(8*torch.pi**2))
+
+        results = calc._derive_outputs(self.structure, iq, outputs)
+        if not keep_on_device:
+            results = {name: type(result)(*[t.cpu().numpy() for t in result]) for name, result in results.items()}
+
+        return results
+
+    def iq(
+        self,
+        keep_on_device: bool = False,
+    ) -> IqTuple:
+        """
+        Calculate the scattering intensity I(Q) of the current structure.
+
+        Parameters:
+            keep_on_device (bool): Flag to keep the results on the class device. Default is False, and will return numpy arrays on CPU.
+
+        Returns:
+            IqTuple: Q-values and scattering intensity I(Q).
+        """
+        return self.compute(outputs='iq', keep_on_device=keep_on_device)['iq']
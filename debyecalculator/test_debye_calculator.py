@@ -1,6 +1,11 @@
 import pytest, torch
-from debyecalculator import DebyeCalculator
-from debyecalculator.utility.generate import generate_nanoparticles
+import subprocess, sys, os
+from unittest import mock
+from debyecalculator import DebyeCalculator, DebyeSession
+from debyecalculator.utility.generate import generate_nanoparticles, find_bonds, SUPERCELL_CACHE
+from debyecalculator.utility.elements import get_element_table, _read_element_table
+from debyecalculator.utility.xyz import read_xyz
+from debyecalculator.utility.accumulate import RunningSum
 import numpy as np
 from ase.io import read
 import pkg_resources
@@ -332,6 +337,596 @@ def test_get_all_tuple():
     assert np.allclose(gr_str, gr_expected, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {gr_expected}, but got {gr_str}"
     assert np.allclose(gr_int, gr_expected, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {gr_expected}, but got {gr_int}"
 
+def test_compute_subset():
+    # Count evaluations of the pair sum
+    calc_compute = DebyeCalculator(qstep=0.1)
+    debye_sum = calc_compute._debye_sum
+    num_calls = []
+    calc_compute._debye_sum = lambda structure: num_calls.append(1) or debye_sum(structure)
+
+    # Calculate I(Q) and G(r) in one pass
+    output = calc_compute.compute('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', outputs=('iq', 'gr'))
+    assert len(num_calls) == 1, f"Expected the pair sum to be evaluated once, but it was evaluated {len(num_calls)} times"
+    assert sorted(output.keys()) == ['gr', 'iq'], f"Expected outputs ['gr', 'iq'], but got {sorted(output.keys())}"
+
+    # Check that the calculated Iq and Gr match the expected values
+    ph = np.loadtxt('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal_Iq.dat')
+    q_expected, iq_expected = ph[:,0], ph[:,1]
+    assert np.allclose(output['iq'].q, q_expected, atol=1e-04, rtol=1e-03), f"Expected Q to be {q_expected}, but got {output['iq'].q}"
+    assert np.allclose(output['iq'].i, iq_expected, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {iq_expected}, but got {output['iq'].i}"
+
+    ph = np.loadtxt('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal_Gr.dat')
+    r_expected, gr_expected = ph[:,0], ph[:,1]
+    assert np.allclose(output['gr'].r, r_expected, atol=1e-04, rtol=1e-03), f"Expected r to be {r_expected}, but got {output['gr'].r}"
+    assert np.allclose(output['gr'].g, gr_expected, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {gr_expected}, but got {output['gr'].g}"
+
+    # Invalid outputs
+    with pytest.raises(ValueError):
+        calc_compute.compute('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', outputs=('x',))
+
+def test_histogram_engine_xyz():
+    # Calculate Iq and Gr using the histogram engine
+    calc_histogram = DebyeCalculator(qstep=0.1, engine='histogram')
+    r, q, iq, sq, fq, gr = calc_histogram._get_all('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+
+    # Check that the binned Iq and Gr match the expected values of the exact engine
+    ph = np.loadtxt('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal_Iq.dat')
+    q_expected, iq_expected = ph[:,0], ph[:,1]
+    assert np.allclose(iq, iq_expected, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {iq_expected}, but got {iq}"
+
+    ph = np.loadtxt('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal_Gr.dat')
+    r_expected, gr_expected = ph[:,0], ph[:,1]
+    assert np.allclose(gr, gr_expected, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {gr_expected}, but got {gr}"
+
+def test_histogram_engine_cif():
+    # Calculate Iq and Gr using the histogram engine
+    calc_histogram = DebyeCalculator(qstep=0.05, engine='histogram')
+    r, q, iq, sq, fq, gr = calc_histogram._get_all('data/AntiFluorite_Co2O.cif', radii=10.0)
+
+    # Check that the binned Iq and Gr match the expected values of the exact engine
+    ph = np.genfromtxt('debyecalculator/unittests_files/iq_AntiFluorite_Co2O_radius10.0.dat', delimiter=',', skip_header=15)
+    q_expected, iq_expected = ph[:,0], ph[:,1]
+    assert np.allclose(iq, iq_expected, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {iq_expected}, but got {iq}"
+
+    ph = np.genfromtxt('debyecalculator/unittests_files/gr_AntiFluorite_Co2O_radius10.0.dat', delimiter=',', skip_header=15)
+    r_expected, gr_expected = ph[:,0], ph[:,1]
+    assert np.allclose(gr, gr_expected, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {gr_expected}, but got {gr}"
+
+def test_partial_engine_cif():
+    # Calculate Iq and partial Sq using the element-pair engine
+    calc_partial = DebyeCalculator(qstep=0.05, engine='partial')
+    results = calc_partial.compute('data/AntiFluorite_Co2O.cif', radii=10.0, outputs=('iq', 'sq', 'sq_partial'))
+
+    # Check that Iq matches the expected values of the exact engine
+    ph = np.genfromtxt('debyecalculator/unittests_files/iq_AntiFluorite_Co2O_radius10.0.dat', delimiter=',', skip_header=15)
+    q_expected, iq_expected = ph[:,0], ph[:,1]
+    assert np.allclose(results['iq'].i, iq_expected, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {iq_expected}, but got {results['iq'].i}"
+
+    # Check that the partials cover each pair of elements once and sum to Sq
+    assert results['sq_partial'].pairs == [('Co', 'Co'), ('Co', 'O'), ('O', 'O')]
+    assert np.allclose(np.sum(results['sq_partial'].s, axis=0), results['sq'].s, atol=1e-04, rtol=1e-03)
+
+    # Partials are not available with the exact engine
+    with pytest.raises(ValueError):
+        DebyeCalculator().compute('data/AntiFluorite_Co2O.cif', radii=5.0, outputs='sq_partial')
+
+def test_lattice_engine_cif():
+    # Calculate Iq and Gr using the lattice engine
+    calc_lattice = DebyeCalculator(qstep=0.05, engine='lattice')
+    r, q, iq, sq, fq, gr = calc_lattice._get_all('data/AntiFluorite_Co2O.cif', radii=10.0)
+
+    # Check that Iq and Gr from the distinct distances match the expected values of the exact engine
+    ph = np.genfromtxt('debyecalculator/unittests_files/iq_AntiFluorite_Co2O_radius10.0.dat', delimiter=',', skip_header=15)
+    q_expected, iq_expected = ph[:,0], ph[:,1]
+    assert np.allclose(iq, iq_expected, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {iq_expected}, but got {iq}"
+
+    ph = np.genfromtxt('debyecalculator/unittests_files/gr_AntiFluorite_Co2O_radius10.0.dat', delimiter=',', skip_header=15)
+    r_expected, gr_expected = ph[:,0], ph[:,1]
+    assert np.allclose(gr, gr_expected, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {gr_expected}, but got {gr}"
+
+    # The lattice engine has no binning error, so it matches the exact engine to float32 precision on each bundled CIF
+    for cif in ['data/AntiFluorite_Co2O.cif', 'data/ICSD_CollCode1504.cif', 'data/icsd_000001_cc.cif', 'data/icsd_000029_cc.cif']:
+        iq_exact = DebyeCalculator(qstep=0.05).iq(cif, radii=6.0).i
+        iq_lattice = calc_lattice.iq(cif, radii=6.0).i
+        assert np.max(np.abs(iq_lattice - iq_exact)) <= 1e-05 * np.max(np.abs(iq_exact)), f"Expected the lattice engine to match the exact engine on {cif}"
+
+    # The unit cell of a CIF is parsed once, also for its lattice vectors
+    with mock.patch('debyecalculator.utility.generate.read', side_effect=AssertionError('CIF parsed again')):
+        calc_lattice.iq('data/AntiFluorite_Co2O.cif', radii=4.0)
+        DebyeCalculator(qstep=0.05).iq('data/AntiFluorite_Co2O.cif', radii=4.0)
+
+    # Partials, and structures without a unit cell, which fall back to evaluating every pair distance
+    results = calc_lattice.compute('data/AntiFluorite_Co2O.cif', radii=6.0, outputs=('sq', 'sq_partial'))
+    assert np.allclose(np.sum(results['sq_partial'].s, axis=0), results['sq'].s, atol=1e-04, rtol=1e-03)
+    with pytest.warns(UserWarning, match="lattice"):
+        iq_fallback = calc_lattice.iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz').i
+    assert np.allclose(iq_fallback, DebyeCalculator(qstep=0.05, engine='partial').iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz').i)
+
+def test_packed_structures():
+    # Calculate Iq and Gr of several small particles, packed together and one by one
+    calc_packed = DebyeCalculator(qstep=0.05, packing_budget=None)
+    calc_single = DebyeCalculator(qstep=0.05, packing_budget=0)
+    radii = [3.0, 4.0, 5.0, 6.0]
+    packed = calc_packed.compute('data/AntiFluorite_Co2O.cif', radii=radii, outputs=('iq', 'gr'))
+    single = calc_single.compute('data/AntiFluorite_Co2O.cif', radii=radii, outputs=('iq', 'gr'))
+
+    # Check that packing does not change the results, up to the float32 summation order
+    assert len(packed) == len(radii)
+    for p, s in zip(packed, single):
+        assert np.allclose(p['iq'].i, s['iq'].i, atol=1e-04 * np.max(np.abs(s['iq'].i)), rtol=1e-03), f"Expected I(Q) to be {s['iq'].i}, but got {p['iq'].i}"
+        assert np.allclose(p['gr'].g, s['gr'].g, atol=1e-04 * np.max(np.abs(s['gr'].g)), rtol=1e-03), f"Expected G(r) to be {s['gr'].g}, but got {p['gr'].g}"
+
+    # Packs of 22 structures of 45 pairs fill batches of 1000 pairs, so 100 structures take 5 batches instead of 100
+    structures = [(['Au'] * 10, torch.rand((10, 3)) * 10) for _ in range(100)]
+    for packing_budget, num_batches in [(None, 5), (0, 100)]:
+        with mock.patch('torch.sinc', wraps=torch.sinc) as sinc:
+            DebyeCalculator(batch_size=1000, packing_budget=packing_budget).iq(structures)
+        assert sinc.call_count == num_batches
+
+def test_sweep():
+    # Sweep the post-processing parameters of Gr and Iq
+    calc_sweep = DebyeCalculator(qstep=0.1)
+    sweep = calc_sweep.sweep('data/AntiFluorite_Co2O.cif', radii=5.0, outputs=('iq', 'gr'), biso=[0.1, 0.5], qdamp=[0.0, 0.04], lorch_mod=[False, True], rmax=[10.0, 20.0])
+    assert len(sweep) == 16
+
+    # Check each parameter combination against a separate calculation
+    for parameters, results in sweep:
+        calc_reference = DebyeCalculator(qstep=0.1, **parameters)
+        reference = calc_reference.compute('data/AntiFluorite_Co2O.cif', radii=5.0, outputs=('iq', 'gr'))
+        assert np.allclose(results['iq'].i, reference['iq'].i, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {reference['iq'].i}, but got {results['iq'].i}"
+        assert np.allclose(results['gr'].r, reference['gr'].r)
+        assert np.allclose(results['gr'].g, reference['gr'].g, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {reference['gr'].g}, but got {results['gr'].g}"
+
+    # The sweep does not change the parameters of the calculator
+    assert calc_sweep.biso == 0.3 and calc_sweep.qdamp == 0.04
+
+    with pytest.raises(ValueError):
+        calc_sweep.sweep('data/AntiFluorite_Co2O.cif', radii=5.0, qmax=[10.0])
+    with pytest.raises(ValueError):
+        calc_sweep.sweep('data/AntiFluorite_Co2O.cif', radii=5.0, biso=[-1.0])
+
+def test_structure_cache():
+    # Calculate Iq twice for the same structures with the structure cache enabled
+    calc_cache = DebyeCalculator(qstep=0.1, structure_cache_bytes=2**24)
+    iq_first = calc_cache.iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+    iq_second = calc_cache.iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+    assert calc_cache.structure_cache.hits == 1 and calc_cache.structure_cache.misses == 1
+    assert np.allclose(iq_first.i, iq_second.i)
+
+    # Equal content hits the cache, changed content or Q-grid does not
+    xyz = torch.rand((10, 3)) * 10
+    calc_cache.iq((['Au'] * 10, xyz))
+    calc_cache.iq((['Au'] * 10, xyz.clone()))
+    calc_cache.iq((['Au'] * 10, xyz + 1))
+    calc_cache.update_parameters(qmax=20.0)
+    calc_cache.iq((['Au'] * 10, xyz))
+    assert calc_cache.structure_cache.hits == 2 and calc_cache.structure_cache.misses == 4
+
+    # Modifying the source arrays in place after the call does not modify the cached structure
+    xyz_numpy = np.random.rand(10, 3).astype(np.float32) * 10
+    xyz_original = xyz_numpy.copy()
+    calc_cache.iq((['Au'] * 10, xyz_numpy))
+    xyz_numpy *= 1.5
+    iq_cached = calc_cache.iq((['Au'] * 10, xyz_original.copy()))
+    assert np.allclose(iq_cached.i, DebyeCalculator(qstep=0.1, qmax=20.0).iq((['Au'] * 10, xyz_original)).i)
+
+    # Least recently used structures are evicted to stay within the byte budget
+    calc_cache.update_parameters(structure_cache_bytes=calc_cache.structure_cache.nbytes // 4)
+    for n in range(5):
+        calc_cache.iq((['Au'] * 10, xyz + n))
+    assert len(calc_cache.structure_cache) < 5
+    assert calc_cache.structure_cache.nbytes <= calc_cache.structure_cache_bytes
+
+def test_element_table(tmp_path):
+    # The element table is loaded once per process and matches the YAML file
+    table = get_element_table()
+    assert get_element_table() is table
+    assert DebyeCalculator(device='cpu').form_factor_coef is table.tensor('cpu')
+    assert table.symbols == list(element_info.keys())
+    for symbol, values in element_info.items():
+        expected = np.array([np.nan if v is None else v for v in values], dtype=float)
+        assert np.allclose(table[symbol], expected, equal_nan=True)
+    assert all(table.atomic_numbers_to_elements[n] == symbol for symbol, n in element_to_atomic_number.items())
+    assert table.number_rows(np.array([8, 27, 8])).tolist() == table.rows(['O', 'Co', 'O'])
+    with pytest.raises(KeyError):
+        table.number_rows(np.array([8, 200]))
+
+    # The binary cache reproduces the table parsed from the YAML file
+    yaml_path = pkg_resources.resource_filename('debyecalculator', 'utility/elements_info.yaml')
+    parsed = _read_element_table(yaml_path, str(tmp_path / 'elements_info.npy'))
+    cached = _read_element_table(yaml_path, str(tmp_path / 'elements_info.npy'))
+    assert (tmp_path / 'elements_info.npy').exists()
+    assert cached.symbols == parsed.symbols
+    assert np.array_equal(cached.coefficients, parsed.coefficients, equal_nan=True)
+
+def test_form_factors():
+    # Form factors of many elements at once match the Waasmaier-Kirfel function of each element
+    calc_ff = DebyeCalculator(device='cpu', qstep=0.1)
+    elements = ['Co', 'Cr', 'Fe', 'Mn', 'Ni', 'O']
+    form_factors = calc_ff._form_factors(elements)
+    s2 = (calc_ff.q.squeeze(-1).numpy() / (4*np.pi))**2
+    for el, ff in zip(elements, form_factors):
+        p = np.array(element_info[el], dtype=float)
+        expected = np.sum(p[:5, None] * np.exp(-p[6:11, None] * s2), axis=0) + p[5]
+        assert np.allclose(ff.numpy(), expected, atol=1e-04, rtol=1e-04)
+
+    # Form factors are memoised per set of elements, and re-evaluated on a new Q-grid or radiation type
+    assert calc_ff._form_factors(elements) is form_factors
+    calc_ff.update_parameters(qmax=10.0)
+    assert calc_ff._form_factors(elements).shape == (len(elements), len(calc_ff.q))
+    calc_ff.update_parameters(radiation_type='neutron')
+    assert np.allclose(calc_ff._form_factors(elements).squeeze(-1).numpy(), [element_info[el][11] for el in elements])
+
+def test_read_xyz(tmp_path):
+    # The chunked reader matches np.genfromtxt on the bundled XYZ file, also across chunk boundaries
+    xyz_file = 'debyecalculator/unittests_files/structure_AntiFluorite_Co2O_radius10.0.xyz'
+    expected = np.genfromtxt(xyz_file, dtype='str', skip_header=2)
+    for chunk_size in [7, 65536]:
+        structure = read_xyz(xyz_file, chunk_size=chunk_size)
+        assert structure.symbols == sorted(set(expected[:,0]))
+        assert np.array_equal(np.array(structure.symbols)[structure.codes], expected[:,0])
+        assert np.allclose(structure.xyz, expected[:,1:4].astype(float))
+        assert structure.occupancy is None
+
+    # Occupancies are read from a fifth column
+    occupancy_file = tmp_path / 'occupancy.xyz'
+    occupancy_file.write_text('2\ncomment\nFe 0.0 0.0 0.0 0.5\nO 1.5 0.0 0.0 1.0\n')
+    structure = read_xyz(str(occupancy_file))
+    assert structure.symbols == ['Fe', 'O'] and list(structure.codes) == [0, 1]
+    assert np.allclose(structure.occupancy, [0.5, 1.0])
+    iq = calc.iq(str(occupancy_file))
+    iq_expected = calc.iq((['Fe', 'O'], np.array([[0.0, 0.0, 0.0], [1.5, 0.0, 0.0]])))
+    assert not np.allclose(iq.i, iq_expected.i)
+
+    with pytest.raises(ValueError):
+        occupancy_file.write_text('2\ncomment\nFe 0.0 0.0 0.0 0.5\nO 1.5 0.0 0.0\n')
+        read_xyz(str(occupancy_file))
+
+def test_stream_trajectory(tmp_path):
+    # Write a small multi-frame trajectory
+    from ase.io import write
+    atoms = read('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+    frames = []
+    for n in range(3):
+        frame = atoms.copy()
+        frame.positions += np.random.RandomState(n).normal(scale=0.05, size=frame.positions.shape)
+        frames.append(frame)
+    write(str(tmp_path / 'trajectory.xyz'), frames, format='extxyz')
+    write(str(tmp_path / 'trajectory.traj'), frames)
+
+    # Streamed results match separate calculations of each frame, with and without prefetching
+    expected = [calc.compute(frame, outputs=('iq', 'gr')) for frame in frames]
+    for trajectory, prefetch in [(str(tmp_path / 'trajectory.xyz'), 1), (str(tmp_path / 'trajectory.traj'), 2), (iter(frames), 0)]:
+        results = list(calc.stream(trajectory, outputs=('iq', 'gr'), prefetch=prefetch))
+        assert len(results) == len(frames)
+        for result, reference in zip(results, expected):
+            assert np.allclose(result['iq'].i, reference['iq'].i, atol=1e-04, rtol=1e-03)
+            assert np.allclose(result['gr'].g, reference['gr'].g, atol=1e-04, rtol=1e-03)
+
+    # Frames are read lazily
+    stream = calc.stream(str(tmp_path / 'trajectory.xyz'), outputs='iq', index='1:')
+    assert np.allclose(next(stream)['iq'].i, expected[1]['iq'].i, atol=1e-04, rtol=1e-03)
+
+    with pytest.raises(ValueError):
+        next(calc.stream(iter(frames), prefetch=-1))
+
+def test_debye_session():
+    # Apply random local updates to a session
+    calc_session = DebyeCalculator(qstep=0.1)
+    session = DebyeSession(calc_session, 'debyecalculator/unittests_files/structure_AntiFluorite_Co2O_radius10.0.xyz', drift_check_interval=0)
+    rng = np.random.RandomState(0)
+    for _ in range(10):
+        idx = rng.choice(session.structure.size, 3, replace=False)
+        session.move_atoms(idx, session.xyz[idx].cpu() + torch.from_numpy(rng.normal(scale=0.2, size=(3, 3))))
+    session.swap_elements([0, 1], 'Ni')
+    session.swap_elements(2, 'O')
+
+    # The updated results match a full calculation of the updated structure
+    structure = session.structure
+    expected = calc_session.compute((structure.elements, structure.xyz.clone()), outputs=('iq', 'gr'))
+    results = session.compute(outputs=('iq', 'gr'))
+    assert np.allclose(results['iq'].i, expected['iq'].i, atol=1e-04, rtol=1e-03), f"Expected I(Q) to be {expected['iq'].i}, but got {results['iq'].i}"
+    assert np.allclose(results['gr'].g, expected['gr'].g, atol=1e-04, rtol=1e-03), f"Expected G(r) to be {expected['gr'].g}, but got {results['gr'].g}"
+
+    # Occupancy changes are tracked, and the drift check compares against a full recalculation
+    session.set_occupancy([3, 4, 5], 0.5)
+    assert session.recompute() < 1e-05
+    session.set_occupancy([3, 4, 5], 1.0)
+    assert np.allclose(session.iq().i, expected['iq'].i, atol=1e-04, rtol=1e-03)
+
+    with pytest.raises(ValueError):
+        session.move_atoms([0, 0], np.zeros((2, 3)))
+    with pytest.raises(ValueError):
+        session.swap_elements(0, 'Xx')
+
+def test_debye_session_precision():
+    # A float64 session keeps tracking a full float64 calculation through local updates, and returns float64 results
+    calc_session = DebyeCalculator(qstep=0.1, device='cpu', precision='float64')
+    session = DebyeSession(calc_session, 'debyecalculator/unittests_files/structure_AntiFluorite_Co2O_radius10.0.xyz', drift_check_interval=0)
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        idx = rng.choice(session.structure.size, 3, replace=False)
+        session.move_atoms(idx, session.xyz[idx].cpu() + torch.from_numpy(rng.normal(scale=0.2, size=(3, 3))))
+
+    structure = session.structure
+    expected = calc_session.iq((structure.elements, structure.xyz.clone()))
+    iq = session.iq()
+    assert iq.i.dtype == np.float64
+    assert np.max(np.abs(iq.i - expected.i)) <= 1e-08 * np.max(np.abs(expected.i)), f"Expected I(Q) to be {expected.i}, but got {iq.i}"
+
+def test_auto_batch_size():
+    # The automatic batch size is the largest batch whose intermediates fit the memory budget
+    calc_auto = DebyeCalculator(qstep=0.1, batch_size='auto', memory_budget_bytes=2**22, profile=True)
+    assert calc_auto._tile_size() == 2**22 // (96 + 7 * 4 * len(calc_auto.q))
+    assert 'Batch size (auto)' in calc_auto.profiler.notes()
+
+    # Reducing the pairs per element-pair class adds a dense (n_classes, batch) weight matrix
+    assert calc_auto._tile_size(num_classes=100) == 2**22 // (96 + 64 + 2 * 4 * len(calc_auto.q) + 4 * 100)
+    assert calc_auto._tile_size(num_classes=10**5) < calc_auto._tile_size(num_classes=1)
+    calc_auto.update_parameters(memory_budget_bytes=None)
+    assert calc_auto._tile_size() >= 1
+
+    # Results do not depend on the batch size
+    iq_auto = calc_auto.iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+    iq_fixed = DebyeCalculator(qstep=0.1, batch_size=1000).iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+    assert np.allclose(iq_auto.i, iq_fixed.i, atol=1e-04, rtol=1e-03)
+
+def test_estimate():
+    # Estimate the cost of a calculation without running it
+    calc_estimate = DebyeCalculator(qstep=0.1, batch_size=1000)
+    estimate = calc_estimate.estimate('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', calibrate=False)
+    size = len(read('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz'))
+    assert estimate.num_atoms == size
+    assert estimate.num_pairs == size * (size - 1) // 2
+    assert estimate.batch_size == 1000
+    assert estimate.num_batches == -(-estimate.num_pairs // 1000)
+    assert estimate.peak_bytes > 1000 * calc_estimate._bytes_per_pair()
+    assert estimate.seconds is None
+
+    # Packed structures share their batches
+    xyz = torch.rand((3, 40, 3)) * 10
+    calc_estimate.update_parameters(packing_budget=3000)
+    packed = calc_estimate.estimate([(['Au'] * 40, x) for x in xyz], calibrate=False)
+    assert all(e.num_batches == -(-3 * 780 // 1000) for e in packed)
+    calc_estimate.update_parameters(packing_budget=0)
+    assert all(e.num_batches == 1 for e in calc_estimate.estimate([(['Au'] * 40, x) for x in xyz], calibrate=False))
+
+    # The histograms of the histogram engine and the cell list of the real-space G(r) are included
+    calc_estimate.update_parameters(engine='histogram')
+    structure = calc_estimate._initialise_structures('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')[0]
+    estimate = calc_estimate.estimate('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', calibrate=False)
+    assert estimate.peak_bytes > 2 * 8 * len(structure.unique_form_factors)**2 * calc_estimate._histogram_num_bins(structure)
+    estimate = calc_estimate.estimate('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', outputs='gr', calibrate=False, gr_method='realspace')
+    assert estimate.peak_bytes > 0 and estimate.seconds is None
+
+    # The lattice engine evaluates fewer distances than atom pairs
+    calc_estimate.update_parameters(engine='lattice')
+    estimate = calc_estimate.estimate('data/AntiFluorite_Co2O.cif', radii=10.0, outputs='iq', calibrate=False)
+    assert 0 < estimate.num_batches < -(-estimate.num_pairs // 1000)
+    calc_estimate.update_parameters(engine='exact')
+
+    # The calibrated time estimate is positive, and grows with the number of pairs
+    estimates = calc_estimate.estimate('data/AntiFluorite_Co2O.cif', radii=[3.0, 6.0], outputs='iq', calibration_radii=(3.0, 5.0))
+    assert len(estimates) == 2
+    assert all(e.seconds > 0 for e in estimates)
+    assert (estimates[0].seconds - estimates[1].seconds) * (estimates[0].num_pairs - estimates[1].num_pairs) >= 0
+
+def test_realspace_gr():
+    # The real-space G(r) only includes the pairs within rmax + realspace_margin, found with a cell list
+    calc_realspace = DebyeCalculator(rmax=8.0, biso=0.3, realspace_margin=10.0)
+    r, gr = calc_realspace.gr('data/AntiFluorite_Co2O.cif', radii=10.0)
+    r_realspace, gr_realspace = calc_realspace.gr('data/AntiFluorite_Co2O.cif', radii=10.0, gr_method='realspace')
+    assert np.allclose(r, r_realspace)
+    assert np.allclose(gr, gr_realspace, atol=1e-03 * np.abs(gr).max())
+
+    # With the other outputs, only G(r) is replaced
+    results = calc_realspace.compute('data/AntiFluorite_Co2O.cif', radii=10.0, outputs=('iq', 'gr'), gr_method='realspace')
+    assert np.allclose(results['gr'].g, gr_realspace)
+    assert np.allclose(results['iq'].i, calc_realspace.iq('data/AntiFluorite_Co2O.cif', radii=10.0).i)
+
+    with pytest.raises(ValueError):
+        calc_realspace.gr('data/AntiFluorite_Co2O.cif', radii=10.0, gr_method='x')
+
+def test_precision_modes():
+    # Calculate Iq and Gr in each precision mode, relative to float64
+    results = {}
+    for precision in ['float64', 'mixed', 'float32', 'float16', 'bfloat16']:
+        results[precision] = DebyeCalculator(qstep=0.05, precision=precision).compute('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', outputs=('iq', 'gr'))
+    reference = results['float64']
+    assert reference['iq'].i.dtype == np.float64 and results['mixed']['iq'].i.dtype == np.float64
+    assert results['float32']['iq'].i.dtype == np.float32 and results['float16']['iq'].i.dtype == np.float32
+    for precision, tolerance in [('mixed', 1e-05), ('float32', 1e-05), ('float16', 1e-02), ('bfloat16', 1e-01)]:
+        for name, field in [('iq', 'i'), ('gr', 'g')]:
+            value, reference_value = getattr(results[precision][name], field), getattr(reference[name], field)
+            assert np.max(np.abs(value - reference_value)) <= tolerance * np.max(np.abs(reference_value)), f"Expected {name} in {precision} within {tolerance} of float64"
+
+    # The engines and the sweep follow the precision mode
+    calc_float64 = DebyeCalculator(qstep=0.05, precision='float64', engine='partial')
+    iq_partial = calc_float64.iq('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz')
+    assert np.allclose(iq_partial.i, reference['iq'].i, rtol=1e-06)
+    sweep = calc_float64.sweep('debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz', outputs='gr', qdamp=[0.04])
+    assert np.allclose(sweep[0][1]['gr'].g, reference['gr'].g, rtol=1e-06, atol=1e-06 * np.max(np.abs(reference['gr'].g)))
+
+def test_compensated_summation():
+    # A plain float32 running sum drifts with the number of additions, a compensated one does not
+    values = torch.full((100000, 2), 0.1, dtype=torch.float32)
+    plain, compensated = RunningSum((2,)), RunningSum((2,), compensated=True)
+    for value in values:
+        plain.add_(value)
+        compensated.add_(value)
+    reference = values.to(dtype=torch.float64).sum(dim=0)
+    assert torch.all(torch.abs(plain.total() - reference) > 1e-1), "Expected the plain running sum to drift"
+    assert torch.allclose(compensated.total().to(dtype=torch.float64), reference, rtol=1e-6, atol=0)
+
+    # Compensated summation in the batch loops of the engines and of packed structures
+    xyz_path = 'debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz'
+    reference = DebyeCalculator(qstep=0.05, precision='float64').iq(xyz_path)
+    for parameters in [dict(), dict(engine='partial'), dict(engine='histogram')]:
+        iq = DebyeCalculator(qstep=0.05, batch_size=100, compensated_summation=True, **parameters).iq(xyz_path)
+        assert iq.i.dtype == np.float32
+        assert np.allclose(iq.i, reference.i, rtol=1e-04 if parameters else 1e-05)
+    calc = DebyeCalculator(qstep=0.05, packing_budget=None, compensated_summation=True)
+    structures = [xyz_path, ('debyecalculator/unittests_files/structure_AntiFluorite_Co2O_radius10.0.xyz')]
+    for iq_packed, iq_single in zip(calc.iq(structures), [calc.iq(structure) for structure in structures]):
+        assert np.allclose(iq_packed.i, iq_single.i, rtol=1e-05)
+
+def test_map():
+    # Calculate many structures with a pool of workers, in the order of the structure sources
+    calc_map = DebyeCalculator(qstep=0.1)
+    structures = [(['Au'] * n, torch.rand((n, 3)) * 10) for n in [20, 50, 10, 40, 30]]
+    expected = [calc_map.compute(structure, outputs=('iq', 'gr')) for structure in structures]
+    num_threads = torch.get_num_threads()
+    for backend, workers in [('thread', 3), ('process', 2)]:
+        results = list(calc_map.map(iter(structures), outputs=('iq', 'gr'), workers=workers, backend=backend, threads_per_worker=1))
+        assert len(results) == len(structures)
+        for result, expected_result in zip(results, expected):
+            assert np.allclose(result['iq'].i, expected_result['iq'].i) and np.allclose(result['gr'].g, expected_result['gr'].g)
+        assert torch.get_num_threads() == num_threads
+
+    # CIF sources with radii yield a list per source
+    results = list(calc_map.map(['data/AntiFluorite_Co2O.cif'] * 2, radii=[3.0, 4.0], outputs='iq', workers=2, backend='thread'))
+    assert len(results) == 2 and all(len(result) == 2 for result in results)
+
+    for parameters in [dict(backend='x'), dict(workers=0), dict(threads_per_worker=0)]:
+        with pytest.raises(ValueError):
+            next(calc_map.map(structures, **parameters))
+
+def test_shards(tmp_path):
+    # Evaluate the pair sum of a structure in shards, written to files, and reduce them
+    xyz_path = 'debyecalculator/unittests_files/icsd_001504_cc_r6_lc_2.85_6_tetragonal.xyz'
+    for engine, outputs in [('exact', ('iq', 'gr')), ('histogram', ('iq', 'sq', 'sq_partial'))]:
+        calc_shards = DebyeCalculator(qstep=0.05, engine=engine)
+        directory = str(tmp_path / engine)
+        paths = [calc_shards.compute_shard(xyz_path, shard, 5, directory) for shard in range(5)]
+        assert len(set(paths)) == 5 and not [f for f in os.listdir(directory) if f.endswith('.tmp.npz')]
+        results, expected = calc_shards.reduce_shards(xyz_path, 5, directory, outputs=outputs), calc_shards.compute(xyz_path, outputs=outputs)
+        for name in outputs:
+            assert np.allclose(results[name][-1], expected[name][-1], rtol=1e-05, atol=1e-05 * np.max(np.abs(expected[name][-1]))), f"Expected the reduced {name} to match compute()"
+
+    # Missing shards and shards of other parameters are detected
+    calc_shards = DebyeCalculator(qstep=0.05)
+    os.remove(paths[2])
+    with pytest.raises(FileNotFoundError):
+        calc_shards.reduce_shards(xyz_path, 5, str(tmp_path / 'histogram'))
+    with pytest.raises(ValueError):
+        DebyeCalculator(qstep=0.05, biso=0.5).reduce_shards(xyz_path, 5, str(tmp_path / 'exact'))
+    with pytest.raises(ValueError):
+        calc_shards.compute_shard(xyz_path, 5, 5, str(tmp_path / 'exact'))
+
+    # The local driver only evaluates the missing shards
+    directory = str(tmp_path / 'exact')
+    os.remove(os.path.join(directory, os.listdir(directory)[0]))
+    results = calc_shards.compute_sharded(xyz_path, 5, directory, outputs='iq', workers=2)
+    assert len(os.listdir(directory)) == 5
+    assert np.allclose(results['iq'].i, calc_shards.iq(xyz_path).i, rtol=1e-05)
+
+def test_find_bonds():
+    element_table = get_element_table()
+    for cif in ['data/AntiFluorite_Co2O.cif', 'data/ICSD_CollCode1504.cif', 'data/icsd_000001_cc.cif', 'data/icsd_000029_cc.cif', 'debyecalculator/utility/benchmark_structure.cif']:
+        cell = read(cif) * (3, 3, 3)
+        positions = torch.from_numpy(cell.get_positions()).to(dtype=torch.float32)
+        atomic_radii = torch.tensor(element_table.coefficients[element_table.rows(cell.get_chemical_symbols()), 13])
+
+        # Dense reference with the full distance and bond threshold matrices
+        cell_dists = torch.cdist(positions, positions)
+        bond_threshold = ((atomic_radii.unsqueeze(1) + atomic_radii) * 1.25).to(dtype=torch.float32)
+        bond_threshold.fill_diagonal_(0.)
+        direction_expected = torch.argwhere(cell_dists < bond_threshold).T
+
+        # Bonds from the neighbour search
+        direction, edge_dists = find_bonds(positions, atomic_radii, batch_size=1000)
+        assert torch.equal(direction, direction_expected), f"Expected the bonds of {cif} to match the dense bond matrix"
+        assert torch.allclose(edge_dists, torch.norm(positions[direction[0]] - positions[direction[1]], dim=-1))
+
+    # Without bonds, atoms closer than 1.1 times the smallest distance are connected (and each atom to itself)
+    positions = torch.tensor([[0., 0., 0.], [10., 0., 0.], [20., 0., 0.], [35., 0., 0.]])
+    direction, edge_dists = find_bonds(positions, torch.ones(4))
+    assert direction.tolist() == [[0, 0, 1, 1, 1, 2, 2, 3], [0, 1, 0, 1, 2, 1, 2, 3]]
+    assert edge_dists.tolist() == [0., 10., 10., 0., 10., 10., 0., 0.]
+
+def test_generate_nanoparticle_series():
+    # A series of radii gives the same nanoparticles as generating each radius on its own
+    radii = [3.0, 4.5, 6.0, 8.0]
+    series = generate_nanoparticles('data/ICSD_CollCode1504.cif', radii=radii, device='cpu', disable_pbar=True)
+    for r, nanoparticle in zip(sorted(radii, reverse=True), series):
+        expected = generate_nanoparticles('data/ICSD_CollCode1504.cif', radii=r, device='cpu', disable_pbar=True)[0]
+        assert nanoparticle.elements == expected.elements
+        assert torch.equal(nanoparticle.xyz, expected.xyz)
+
+    # Index views select the same atoms from the shared supercell
+    views = generate_nanoparticles('data/ICSD_CollCode1504.cif', radii=radii, device='cpu', disable_pbar=True, _return_indices=True)
+    for view, nanoparticle in zip(views, series):
+        assert list(view.supercell.symbols[view.indices]) == nanoparticle.elements
+        assert np.array_equal(view.supercell.positions[view.indices], nanoparticle.xyz.numpy())
+
+def test_generate_nanoparticle_skewed_cell(tmp_path):
+    # The primitive (rhombohedral) cell of fcc copper gives the same nanoparticle as its conventional (cubic) cell
+    from ase.build import bulk
+    from ase.io import write
+    write(str(tmp_path / 'primitive.cif'), bulk('Cu', 'fcc', a=3.6))
+    write(str(tmp_path / 'cubic.cif'), bulk('Cu', 'fcc', a=3.6, cubic=True))
+    primitive = generate_nanoparticles(str(tmp_path / 'primitive.cif'), radii=[12.0, 25.0], device='cpu', disable_pbar=True, _reverse_order=False)
+    cubic = generate_nanoparticles(str(tmp_path / 'cubic.cif'), radii=12.0, device='cpu', disable_pbar=True)
+    assert primitive[0].size == cubic[0].size
+    assert np.allclose(np.sort(np.linalg.norm(primitive[0].xyz.numpy(), axis=1)), np.sort(np.linalg.norm(cubic[0].xyz.numpy(), axis=1)), atol=1e-05)
+
+    # The nanoparticle of a radius does not depend on the other radii
+    SUPERCELL_CACHE.clear()
+    alone = generate_nanoparticles(str(tmp_path / 'primitive.cif'), radii=12.0, device='cpu', disable_pbar=True)[0]
+    assert alone.elements == primitive[0].elements
+    assert np.allclose(alone.xyz.numpy(), primitive[0].xyz.numpy(), atol=1e-05)
+
+def test_supercell_cache(tmp_path):
+    SUPERCELL_CACHE.clear()
+    cif = str(tmp_path / 'structure.cif')
+    with open('data/ICSD_CollCode1504.cif', 'r') as f:
+        content = f.read()
+    with open(cif, 'w') as f:
+        f.write(content)
+
+    # Smaller radii are served from the supercell of the largest radius so far, as if generated together with it
+    expected = generate_nanoparticles(cif, radii=[4.0, 8.0], device='cpu', disable_pbar=True, _reverse_order=False)
+    nanoparticle = generate_nanoparticles(cif, radii=4.0, device='cpu', disable_pbar=True)[0]
+    assert (SUPERCELL_CACHE.hits, SUPERCELL_CACHE.misses) == (1, 1)
+    assert nanoparticle.elements == expected[0].elements
+    assert torch.equal(nanoparticle.xyz, expected[0].xyz)
+
+    # A larger radius finds the cached supercell, but rebuilds it for that radius
+    generate_nanoparticles(cif, radii=10.0, device='cpu', disable_pbar=True)
+    generate_nanoparticles(cif, radii=[6.0, 10.0], device='cpu', disable_pbar=True)
+    assert (SUPERCELL_CACHE.hits, SUPERCELL_CACHE.misses) == (3, 1)
+    assert len(SUPERCELL_CACHE) == 1
+
+    # Other settings or an edited CIF build a new supercell
+    generate_nanoparticles(cif, radii=4.0, device='cpu', disable_pbar=True, _benchmarking=True)
+    with open(cif, 'w') as f:
+        f.write(content + '\n')
+    generate_nanoparticles(cif, radii=4.0, device='cpu', disable_pbar=True)
+    assert (SUPERCELL_CACHE.hits, SUPERCELL_CACHE.misses) == (3, 3)
+    assert len(SUPERCELL_CACHE) == 3
+
+def test_peak_memory_flat_in_structure_size():
+    # Measure the peak resident memory of a fresh process calculating I(Q) for structures of increasing size
+    script = (
+        "import resource, warnings, torch\n"
+        "warnings.simplefilter('ignore')\n"
+        "from debyecalculator import DebyeCalculator\n"
+        "calc = DebyeCalculator(qmin=1.0, qmax=2.0, qstep=0.5, device='cpu', batch_size=100000)\n"
+        "xyz = torch.rand((int(sys.argv[1]), 3)) * 100\n"
+        "calc.iq((['Au'] * len(xyz), xyz))\n"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+    )
+    peak_rss = []
+    for size in [1000, 6000]:
+        output = subprocess.run([sys.executable, '-c', 'import sys\n' + script, str(size)], capture_output=True, text=True, check=True)
+        peak_rss.append(int(output.stdout.split()[-1]))
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    growth_mb = (peak_rss[1] - peak_rss[0]) / (1024**2 if sys.platform == 'darwin' else 1024)
+
+    # Materialising the 18M pairs of the larger structure would add several hundred MB
+    assert growth_mb < 64, f"Expected peak memory to stay flat, but it grew by {growth_mb:.1f} MB"
+
 def test_generate_nanoparticle():
 
     # Load structure from xyz:
@@ -379,3 +974,16 @@ def test_invalid_input():
     with pytest.raises(ValueError):
         calc.update_parameters(radiation_type = 'x')
 
+    # Test invalid update of the remaining parameters, each on a fresh (valid) calculator
+    invalid_parameters = [
+        dict(batch_size = 'x'),
+        dict(batch_size = 'auto', memory_budget_bytes = 0),
+        dict(engine = 'x'),
+        dict(packing_budget = -1),
+        dict(structure_cache_bytes = -1),
+        dict(realspace_margin = -1.0),
+        dict(precision = 'x'),
+    ]
+    for parameters in invalid_parameters:
+        with pytest.raises(ValueError):
+            DebyeCalculator().update_parameters(**parameters)
@@ -0,0 +1,59 @@
+import torch
+
+class RunningSum:
+    """
+    RunningSum
+    This class provides a running sum of tensors of a fixed shape, optionally compensated. It is used by DebyeCalculator to accumulate the
+    partial sums of the batches of the pair sum. A plain running sum accumulates a rounding error that grows linearly with the number of batches,
+    while the compensated (Kahan-Babuska-Neumaier) running sum carries the rounding error of each addition in a second tensor, such that the error
+    of the total stays at the order of the rounding error of a single addition, independent of the number of batches.
+
+    Methods:
+        __init__(shape, device, dtype, compensated): Initialise a running sum of zeros.
+        add_(value, index): Add a tensor (or a tensor to the rows of index) to the running sum.
+        total(): Get the sum, including the compensation.
+
+    Attributes:
+        sum (torch.Tensor): Running sum, excluding the compensation.
+        compensation (torch.Tensor or None): Accumulated rounding error of the additions, or None if not compensated.
+
+    Example::
+        iq = RunningSum((len(q),), device='cpu', dtype=torch.float32, compensated=True)
+        for batch in batches:
+            iq.add_(torch.sum(batch, dim=0))
+        print(iq.total())
+    """
+
+    def __init__(self, shape, device='cpu', dtype=torch.float32, compensated=False):
+        self.sum = torch.zeros(shape, device=device, dtype=dtype)
+        self.compensation = torch.zeros_like(self.sum) if compensated else None
+
+    def __len__(self):
+        return len(self.sum)
+
+    @property
+    def dtype(self):
+        return self.sum.dtype
+
+    def add_(self, value, index=None):
+        value = value.to(dtype=self.sum.dtype)
+        if self.compensation is None:
+            if index is None:
+                self.sum += value
+            else:
+                self.sum.index_add_(0, index, value)
+            return
+
+        # Scatter into a dense tensor first, such that every row receives a single compensated addition
+        if index is not None:
+            value = torch.zeros_like(self.sum).index_add_(0, index, value)
+
+        # Neumaier's variant of Kahan summation, which is also exact when the addend is larger than the running sum
+        total = self.sum + value
+        self.compensation += torch.where(self.sum.abs() >= value.abs(), (self.sum - total) + value, (value - total) + self.sum)
+        self.sum = total
+
+    def total(self):
+        if self.compensation is None:
+            return self.sum
+        return self.sum + self.compensation
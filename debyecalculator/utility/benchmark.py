@@ -100,15 +100,18 @@ class DebyeBenchmarker:
         radii: Union[List, np.ndarray, torch.Tensor] = [5],
         show_progress_bar: bool = True,
         custom_cif: str = None,
+        outputs: Union[List[str], None] = None,
         **kwargs,
     ) -> None:
         """
         Initialize DebyeBenchmarker.
 
         Parameters:
+            function (str): Name of the function to benchmark, either 'gr', 'iq', 'sq', 'fq' or 'compute'.
             radii (Union[List, np.ndarray, torch.Tensor]): List of radii for benchmarking.
             show_progress_bar (bool): Flag to control progress bar display.
             custom_cif (str): Custom CIF file path (if provided).
+            outputs (Union[List[str], None]): Outputs to request when benchmarking 'compute'. If None, all outputs are requested.
             **kwargs: Additional keyword arguments for DebyeCalculator.
         Raises:
             ValueError: If an invalid function name is parsed to the class.
@@ -129,14 +132,20 @@ class DebyeBenchmarker:
             self.func = self.debye_calc.iq
         elif function == 'sq':
             self.func = self.debye_calc.sq
+        elif function == 'fq':
+            self.func = self.debye_calc.fq
+        elif function == 'compute':
+            outputs = ['iq', 'sq', 'fq', 'gr'] if outputs is None else list(outputs)
+            self.function_name = 'compute(' + ','.join(outputs) + ')'
+            self.func = lambda structure_source: self.debye_calc.compute(structure_source, outputs=outputs)
         else:
-            raise ValueError("Invalid value for 'function', please provide either 'gr', 'iq' or 'sq'")
+            raise ValueError("Invalid value for 'function', please provide either 'gr', 'iq', 'sq', 'fq' or 'compute'")
 
         self.show_progress_bar = show_progress_bar
 
-        self.ref_stat_csv_titan_10k = pkg_resources.resource_filename(__name__, 'benchmark_reference_TITANRTX_10k.csv')
-        self.reference_stat_titan_10k = from_csv(self.ref_stat_csv_titan_10k)
-        self.reference_stat_titan_10k.name = 'TITAN RTX'
+        self.ref_stat_csv_titan = pkg_resources.resource_filename(__name__, 'benchmark_reference_TITANRTX.csv')
+        self.reference_stat_titan = from_csv(self.ref_stat_csv_titan)
+        self.reference_stat_titan.name = 'TITAN RTX'
         
         self.ref_stat_csv_diffpy = pkg_resources.resource_filename(__name__, 'benchmark_reference_DiffPy.csv')
         self.reference_stat_diffpy = from_csv(self.ref_stat_csv_diffpy)
@@ -297,6 +306,62 @@ class DebyeBenchmarker:
             cuda_mem_calculations = list(cuda_mem_calculations)
         )
 
+def benchmark_precision(
+    radii: Union[List, np.ndarray, torch.Tensor] = [5, 10],
+    precisions: List[str] = ['float64', 'mixed', 'float32', 'float16', 'bfloat16'],
+    function: str = 'iq',
+    reference: str = 'float64',
+    repetitions: int = 1,
+    custom_cif: str = None,
+    **kwargs,
+) -> PrettyTable:
+    """
+    Benchmark the speed and accuracy of the precision modes of DebyeCalculator.
+
+    For each precision mode, the time is measured with DebyeBenchmarker, and the error is the maximum absolute deviation from the reference
+    precision mode on the same nanoparticles, relative to the maximum absolute value of the reference.
+
+    Parameters:
+        radii (Union[List, np.ndarray, torch.Tensor]): List of radii for benchmarking.
+        precisions (List[str]): Precision modes to benchmark.
+        function (str): Name of the function to benchmark, either 'gr', 'iq', 'sq' or 'fq'.
+        reference (str): Precision mode of the reference values.
+        repetitions (int): Number of repetitions for benchmarking.
+        custom_cif (str): Custom CIF file path (if provided).
+        **kwargs: Additional keyword arguments for DebyeCalculator.
+
+    Returns:
+        PrettyTable: Table of the mean time, speed-up relative to the reference and relative error of each precision mode and radius.
+
+    Raises:
+        ValueError: If an invalid function name is parsed.
+    """
+    if function not in ['gr', 'iq', 'sq', 'fq']:
+        raise ValueError("Invalid value for 'function', please provide either 'gr', 'iq', 'sq' or 'fq'")
+
+    benchmarkers, stats = {}, {}
+    for precision in dict.fromkeys([reference] + list(precisions)):
+        benchmarkers[precision] = DebyeBenchmarker(function=function, radii=radii, show_progress_bar=False, custom_cif=custom_cif, precision=precision, **kwargs)
+        stats[precision] = benchmarkers[precision].benchmark(repetitions=repetitions, dummy_repititions=1)
+
+    # Values of each precision mode on the same nanoparticles
+    cif_file = custom_cif if custom_cif is not None else benchmarkers[reference].cif
+    device = benchmarkers[reference].debye_calc.device
+    nanoparticles = generate_nanoparticles(cif_file, list(radii), _reverse_order=False, disable_pbar=True, device=device, _benchmarking=True)
+    values = {precision: [np.asarray(benchmarker.func((nano.elements, nano.xyz))[1], dtype=np.float64) for nano in nanoparticles] for precision, benchmarker in benchmarkers.items()}
+
+    pt = PrettyTable(['Precision', 'Radius [Å]', 'Num. atoms', 'Mean [s]', 'Speed-up', 'Max. rel. error'])
+    pt.align = 'r'
+    pt.padding_width = 1
+    pt.title = f'Precision modes / {function} / DEVICE:{device.upper()} / REFERENCE: {reference}'
+    for precision in precisions:
+        for i, radius in enumerate(stats[precision].radii):
+            error = np.max(np.abs(values[precision][i] - values[reference][i])) / np.max(np.abs(values[reference][i]))
+            speedup = stats[reference].means[i] / stats[precision].means[i]
+            pt.add_row([precision, str(float(radius)), str(int(stats[precision].num_atoms[i])), f'{stats[precision].means[i]:1.5f}', f'{speedup:1.2f}', f'{error:1.1e}'])
+
+    return pt
+
 def to_csv(stat: Statistics, path: str) -> None:
     """
     Save Statistics instance to a CSV file.
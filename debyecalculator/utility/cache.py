@@ -0,0 +1,60 @@
+import collections
+
+class StructureCache:
+    """
+    StructureCache
+    This class provides a least-recently-used (LRU) cache bounded by the total size in bytes of its entries. It is used by DebyeCalculator to keep prepared structures, keyed by a hash of their content, such that repeated calculations on the same structure skip the setup.
+
+    Methods:
+        __init__(max_bytes): Initialize the cache with a byte budget. A budget of 0 disables the cache.
+        get(key): Get the entry of a key (and mark it as most recently used), or None on a miss.
+        put(key, value, nbytes): Add an entry of the given size, evicting the least recently used entries to stay within the byte budget.
+        clear(): Remove all entries and reset the hit and miss counters.
+
+    Attributes:
+        hits (int): Number of lookups that found an entry.
+        misses (int): Number of lookups that did not find an entry.
+        nbytes (int): Total size in bytes of the cached entries.
+
+    Example::
+        cache = StructureCache(max_bytes=2**20)
+        if cache.get("key") is None:
+            cache.put("key", value, nbytes=1024)
+        print(cache.hits, cache.misses)
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value, nbytes):
+        # Entries larger than the full budget are never cached
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        while self._entries and self.nbytes + nbytes > self.max_bytes:
+            self.nbytes -= self._entries.popitem(last=False)[1][1]
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,116 @@
+import os
+import yaml
+import pkg_resources
+import numpy as np
+import torch
+from typing import Dict, List
+
+class ElementTable:
+    """
+    ElementTable
+    This class holds the contents of elements_info.yaml as a dense (n_elements x 14) coefficient matrix with a symbol to row index. The columns are the
+    Waasmaier-Kirfel coefficients a1-a5, c and b1-b5, the coherent neutron scattering length, the atomic number and the atomic radius (missing values are NaN).
+    The table is loaded once per process by get_element_table(), and the coefficient tensor is built once per device.
+
+    Methods:
+        __init__(symbols, coefficients): Initialize the table from the element symbols and their coefficient rows.
+        __getitem__(symbol): Get the coefficient row of an element as a numpy array.
+        rows(symbols): Get the row indices of a sequence of element symbols.
+        number_rows(atomic_numbers): Get the row indices of an array of atomic numbers (neutral atoms only).
+        tensor(device): Get the float32 coefficient tensor on the given device.
+
+    Attributes:
+        symbols (List[str]): Element symbols in the order of the YAML file.
+        index (Dict[str, int]): Row index of each element symbol.
+        coefficients (np.ndarray): Coefficient matrix of shape (n_elements, 14).
+        atomic_numbers_to_elements (Dict[int, str]): Element symbol of each atomic number (neutral atoms only).
+    """
+
+    def __init__(self, symbols: List[str], coefficients: np.ndarray):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.coefficients = coefficients
+        self._tensors = {}
+
+        # The first 98 entries are the neutral atoms H-Cf, followed by ions
+        self.atomic_numbers_to_elements = {int(row[12]): symbol for symbol, row in zip(self.symbols[:98], self.coefficients[:98])}
+
+        # Row index of each atomic number (-1 for atomic numbers without a neutral atom), for array lookups
+        self._number_rows = np.full(max(self.atomic_numbers_to_elements, default=0) + 1, -1, dtype=np.int64)
+        for number, symbol in self.atomic_numbers_to_elements.items():
+            self._number_rows[number] = self.index[symbol]
+
+    def __getitem__(self, symbol: str) -> np.ndarray:
+        return self.coefficients[self.index[symbol]]
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.index
+
+    def rows(self, symbols) -> List[int]:
+        return [self.index[symbol] for symbol in symbols]
+
+    def number_rows(self, atomic_numbers: np.ndarray) -> np.ndarray:
+        atomic_numbers = np.asarray(atomic_numbers, dtype=np.int64)
+        unknown = (atomic_numbers < 0) | (atomic_numbers >= len(self._number_rows))
+        rows = self._number_rows[np.where(unknown, 0, atomic_numbers)]
+        if np.any(unknown | (rows < 0)):
+            raise KeyError(f'Unknown atomic number(s): {np.unique(atomic_numbers[unknown | (rows < 0)]).tolist()}')
+        return rows
+
+    def tensor(self, device: str) -> torch.Tensor:
+        device = str(device)
+        if device not in self._tensors:
+            self._tensors[device] = torch.from_numpy(self.coefficients).to(device=device, dtype=torch.float32)
+        return self._tensors[device]
+
+_ELEMENT_TABLE = None
+
+def _read_element_table(yaml_path: str, npy_path: str) -> ElementTable:
+    """
+    Read the element table from its binary cache if that is newer than the YAML file, and otherwise parse the YAML file and (try to) write the binary cache.
+
+    Parameters:
+        yaml_path (str): Path of elements_info.yaml.
+        npy_path (str): Path of the binary cache.
+
+    Returns:
+        ElementTable: The parsed element table.
+    """
+    try:
+        if os.path.getmtime(npy_path) >= os.path.getmtime(yaml_path):
+            table = np.load(npy_path, allow_pickle=False)
+            return ElementTable([str(s) for s in table['symbol']], table['coefficients'].astype(np.float64))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open(yaml_path, 'r') as yaml_file:
+        elements_info = yaml.safe_load(yaml_file)
+    symbols = list(elements_info.keys())
+    coefficients = np.array([[np.nan if v is None else v for v in values] for values in elements_info.values()], dtype=np.float64)
+
+    # The binary cache is optional, e.g. the package directory may be read-only
+    table = np.zeros(len(symbols), dtype=[('symbol', 'U8'), ('coefficients', np.float64, (coefficients.shape[1],))])
+    table['symbol'] = symbols
+    table['coefficients'] = coefficients
+    try:
+        tmp_path = f'{npy_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as npy_file:
+            np.save(npy_file, table, allow_pickle=False)
+        os.replace(tmp_path, npy_path)
+    except OSError:
+        pass
+
+    return ElementTable(symbols, coefficients)
+
+def get_element_table() -> ElementTable:
+    """
+    Get the process-wide element table, loading it on the first call.
+
+    Returns:
+        ElementTable: The element table of elements_info.yaml.
+    """
+    global _ELEMENT_TABLE
+    if _ELEMENT_TABLE is None:
+        yaml_path = pkg_resources.resource_filename(__name__, 'elements_info.yaml')
+        _ELEMENT_TABLE = _read_element_table(yaml_path, os.path.splitext(yaml_path)[0] + '.npy')
+    return _ELEMENT_TABLE
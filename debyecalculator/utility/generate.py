@@ -3,7 +3,6 @@
 # Handle import of torch (prerequisite)
 try:
     import torch
-    from torch import cdist
 except ModuleNotFoundError:
     raise ImportError(
         "\n\nDebyeCalculator (and generate_nanoparticles) requires PyTorch, which is not installed. "
@@ -16,26 +15,37 @@ except ModuleNotFoundError:
 
 
 import numpy as np
+from ase import Atoms
 from ase.io import read
-from ase.build import make_supercell
 from ase.build.tools import sort as ase_sort
 from typing import Union, List
 from collections import namedtuple
-import yaml
-import pkg_resources
+import hashlib
 import warnings
 from tqdm.auto import tqdm
+from debyecalculator.utility.elements import get_element_table
+from debyecalculator.utility.neighbours import neighbour_pairs
+from debyecalculator.utility.cache import StructureCache
 
 NanoParticle = namedtuple('NanoParticle', 'elements size occupancy xyz')
 NanoParticleASE = namedtuple('NanoParticleASE', 'ase_structure np_size')
 NanoParticleASEGraph = namedtuple('NanoParticleASEGraph', 'ase_structure np_size edges distances')
+NanoParticleIndices = namedtuple('NanoParticleIndices', 'supercell indices np_size')
+Supercell = namedtuple('Supercell', 'r_max cell symbols positions center_dists direction edge_dists bond_radii atom_radii atom_order')
+# LRU caches of the parsed unit cells and of the largest supercell (with its bonds) built so far for each CIF, keyed by a hash of the CIF and the generation settings.
+# Set max_bytes to 0 to disable a cache.
+UNIT_CELL_CACHE = StructureCache(max_bytes=2**24)
+SUPERCELL_CACHE = StructureCache(max_bytes=2**30)
+
 NanoParticleType = Union[
     List[NanoParticle],
     NanoParticle,
     List[NanoParticleASE],
     NanoParticleASE,
     List[NanoParticleASEGraph],
-    NanoParticleASEGraph
+    NanoParticleASEGraph,
+    List[NanoParticleIndices],
+    NanoParticleIndices
 ]
 
 def get_default_atoms(
@@ -105,12 +115,16 @@ def generate_nanoparticles(
     _override_device: bool = False,
     _lightweight_mode: bool = False,
     _return_ase: bool = False,
+    _return_indices: bool = False,
     _reverse_order: bool = True,
     _benchmarking: bool = False,
 ) -> NanoParticleType:
     """
     Generate spherical nanoparticles from a given CIF and radii.
 
+    The bonds of the supercell are found once, after which each atom is assigned the smallest radius from which it is included. The nanoparticle of
+    each radius is then a prefix of the atoms sorted by that radius, such that a series of many radii costs little more than the largest nanoparticle.
+
     Args:
         cif_file (str): Input CIF file.
         radii (Union[List[float], float]): List of floats or float of radii for nanoparticles to be generated.
@@ -123,6 +137,7 @@ def generate_nanoparticles(
         _override_device (bool): Ignore object device and run on CPU.
         _lightweight_mode (bool): Whether to use lightweight mode. Defaults to False.
         _return_ase (bool): Whether to return ASE objects. Defaults to False.
+        _return_indices (bool): Whether to return the indices of the atoms of each nanoparticle in a shared (centred) ASE supercell instead of copies of the atoms. Defaults to False.
         _reverse_order (bool): Whether to generate particles in reverse radii order
         _benchmarking (bool): Stripped down version for benchmarking
 
@@ -147,8 +162,7 @@ def generate_nanoparticles(
             device = device
 
     # Fetch atomic numbers and radii
-    with open(pkg_resources.resource_filename(__name__, 'elements_info.yaml'), 'r') as yaml_file:
-        elements_info = yaml.safe_load(yaml_file)
+    elements_info = get_element_table()
 
     # Fix radii type
     if isinstance(radii, list):
@@ -166,8 +180,8 @@ def generate_nanoparticles(
     elif isinstance(metals, list):
         if isinstance(metals[0], str):
             try:
-                metals = [elements_info(elm)[12] for elm in metals]
-            except ImportError:
+                metals = [int(elements_info[elm][12]) for elm in metals]
+            except KeyError:
                 raise ImportError('FAILED: Invalid element found')
     else:
         raise ValueError('FAILED: Please provide valid metals for generation of nanoparticles')
@@ -177,88 +191,40 @@ def generate_nanoparticles(
     elif isinstance(ligands, list):
         if isinstance(ligands[0], str):
             try:
-                ligands = [elements_info(elm)[12] for elm in ligands]
-            except ImportError:
+                ligands = [int(elements_info[elm][12]) for elm in ligands]
+            except KeyError:
                 raise ImportError('FAILED: Invalid element found')
 
-    # Read the input unit cell structure
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        unit_cell = read(cif_file)
-    cell_dims = np.array(unit_cell.cell.cellpar()[:3])
-    r_max = np.amax(radii)
-
-    # Create a supercell to encompass the entire range of nanoparticles and center it
-    size_check = np.array([False, False, False])
-    padding = np.array([-2,-2,-2])
-    while not all(size_check):
-        padding[~size_check] += 2 # Symmetric padding to ensure the particle does not exceed the supercell boundary
-        supercell_matrix = np.diag((np.ceil(r_max / cell_dims)) * 2 + padding)
-        cell = make_supercell(prim=unit_cell, P=supercell_matrix)
-        size_check = cell.get_positions().max(axis=0) >= (r_max * 2 + 5) # Check if the supercell is larger than diameter of largest particle + 5 Angstroms of padding
-        
-    cell.center(about=0.) # Center the supercell
+    # Get the supercell of the largest radius (with its bonds), built or served from the cache
+    supercell = get_supercell(cif_file, np.amax(radii), metals, device, _lightweight_mode, _benchmarking)
+    cell, positions = supercell.cell, supercell.positions
 
-    # Convert positions to torch and send to device
-    positions = torch.from_numpy(cell.get_positions()).to(dtype = torch.float32, device = device)
-    
     # Benchmarking
     if _benchmarking:
         nanoparticle_tuple_list = []
+        cell_norms = torch.norm(positions, p=2, dim=-1).cpu().numpy()
         for r in sorted(radii, reverse=_reverse_order):
-            cell_norms = torch.norm(positions, p=2, dim=-1).cpu()
-            np_cell = cell[cell_norms <= r]
-            elements = np_cell.get_chemical_symbols()
+            included_atoms = np.nonzero(cell_norms <= r)[0]
+            elements = supercell.symbols[included_atoms].tolist()
             try:
-                occupancy = np_cell.info['occupancy']
+                occupancy = cell.info['occupancy']
             except:
-                occupancy = torch.ones((np_cell.get_global_number_of_atoms()), dtype=torch.float32)
+                occupancy = torch.ones(len(included_atoms), dtype=torch.float32)
             nanoparticle_tuple_list.append(
                 NanoParticle(
                     elements = elements,
                     size = len(elements),
                     occupancy = occupancy,
-                    xyz = torch.from_numpy(np_cell.get_positions()).to(device=device)
+                    xyz = torch.from_numpy(cell.positions[included_atoms]).to(device=device)
                 )
             )
         return nanoparticle_tuple_list
 
-    # Find atomic radii
-    atomic_radii = torch.tensor(np.array([
-        elements_info[elm][13]
-        for elm in cell.get_chemical_symbols()
-        ], dtype='float'), device=device)
-
-    if _lightweight_mode:
-        center_dists = torch.norm(positions, dim=1)
-    else:
-        # Find all metals and center around the nearest metal
-        metal_filter = torch.BoolTensor([a in metals for a in cell.get_atomic_numbers()]).to(device = device)
-
-        # Find the most central metal atom and center the cell around it
-        center_dists = torch.norm(positions, dim=1)
-        positions -= positions[metal_filter][torch.argmin(center_dists[metal_filter])]
-        center_dists = torch.norm(positions, dim=1)
-
-        # Update the cell positions
-        cell.positions = positions.cpu()
-
-    # Calculate distance matrix
-    cell_dists = cdist(positions, positions)
+    center_dists, direction, edge_dists = supercell.center_dists, supercell.direction, supercell.edge_dists
+    bond_radii, atom_radii, atom_order = supercell.bond_radii, supercell.atom_radii, supercell.atom_order
 
-    # Create mask of threshold for bonds
-    bond_threshold = torch.zeros_like(cell_dists, device=device)
-    for i, r1 in enumerate(atomic_radii):
-        bond_threshold[i,:] = (r1 + atomic_radii) * 1.25
-    bond_threshold.fill_diagonal_(0.)
-
-    # Find edges
-    direction = torch.argwhere(cell_dists < bond_threshold).T
-
-    # Handle case with no edges
-    if len(direction[0]) == 0:
-        min_dist = torch.amin(cell_dists[cell_dists > 0])
-        direction = torch.argwhere(cell_dists < min_dist * 1.1).T
+    # Per-atom arrays of the supercell, indexed by the nanoparticles
+    symbols, cell_positions = supercell.symbols, cell.positions
 
     # Initialize nanoparticle lists and progress bar
     nanoparticle_tuple_list = []
@@ -274,71 +240,72 @@ def generate_nanoparticles(
             incl_indices = torch.nonzero(incl_mask).flatten()
 
             # Get edges to be included
-            included_edges = direction[:,~(torch.isin(direction[0], ~incl_indices) + torch.isin(direction[1], ~incl_indices))]
+            edge_mask = ~(torch.isin(direction[0], ~incl_indices) + torch.isin(direction[1], ~incl_indices))
+            included_edges, included_dists = direction[:,edge_mask], edge_dists[edge_mask]
             
             # Get included atoms
             included_atoms = included_edges.unique()
             
         else:
-            # Mask all metal atoms outside of the radius
-            excl_mask = (center_dists > r) & metal_filter
-            # Mask all metal atoms within the radius
-            incl_mask = (center_dists <= r) & metal_filter
-
-            # Get indices of atoms to be included and excluded
-            excl_indices = torch.nonzero(excl_mask).flatten()
-            incl_indices = torch.nonzero(incl_mask).flatten()
+            # The included atoms are a prefix of the atoms sorted by the radius from which they are included
+            num_included = torch.searchsorted(atom_radii, torch.tensor([r], dtype=atom_radii.dtype, device=device), right=True)
+            included_atoms = torch.sort(atom_order[:int(num_included)]).values
 
             # Get edges to be included
-            included_edges = direction[:,(torch.isin(direction[0], incl_indices) + torch.isin(direction[1], incl_indices))]
-
-            # Remove edges to be excluded
-            included_edges = included_edges[:,~(torch.isin(included_edges[0], excl_indices) + torch.isin(included_edges[1], excl_indices))]
-            
-            # Get included atoms
-            included_atoms = included_edges.unique()
-
-        # Get Atoms object for the NP
-        np_cell = cell[included_atoms.cpu()]
+            if return_graph_elements:
+                edge_mask = bond_radii <= r
+                included_edges, included_dists = direction[:,edge_mask], edge_dists[edge_mask]
 
         # Remove NPs with only one atom
-        if len(np_cell) == 1:
+        if len(included_atoms) == 1:
             pbar.update(1)
             continue
 
         # Determine NP size
-        nanoparticle_size = torch.amax(center_dists[included_atoms.cpu()]) * 2
+        nanoparticle_size = torch.amax(center_dists[included_atoms]) * 2
+        included_atoms = included_atoms.cpu().numpy()
         
-        # Sort the atoms
+        # Sort the atoms (by element, as ase.build.tools.sort)
         if sort_atoms:
-            np_cell = ase_sort(np_cell)
-            if np_cell.get_chemical_symbols()[0] in ligands:
-                np_cell = np_cell[::-1]
+            included_atoms = included_atoms[np.argsort(symbols[included_atoms], kind='stable')]
+            if symbols[included_atoms[0]] in ligands:
+                included_atoms = included_atoms[::-1]
         
         # Get occupancy (if any)
         try:
-            occupancy = np_cell.info['occupancy']
+            occupancy = cell.info['occupancy']
         except:
-            occupancy = torch.ones((np_cell.get_global_number_of_atoms()), dtype=torch.float32)
+            occupancy = torch.ones(len(included_atoms), dtype=torch.float32)
 
         # Append nanoparticle
-        if not _return_ase:
-            elements = np_cell.get_chemical_symbols()
+        if _return_indices:
+            nanoparticle_tuple_list.append(
+                NanoParticleIndices(
+                    supercell = cell,
+                    indices = included_atoms,
+                    np_size = nanoparticle_size.item()
+                )
+            )
+        elif not _return_ase:
+            elements = symbols[included_atoms].tolist()
             nanoparticle_tuple_list.append(
                 NanoParticle(
                     elements = elements,
                     size = len(elements),
                     occupancy = occupancy,
-                    xyz = torch.from_numpy(np_cell.get_positions()).to(device=device)
+                    xyz = torch.from_numpy(cell_positions[included_atoms]).to(device=device)
                 )
             )
         else:
+            # Get Atoms object for the NP
+            np_cell = cell[included_atoms]
+
             if return_graph_elements:
                 if sort_atoms:
                     raise NotImplementedError('FAILED: return_graph_elements is not yet implemented for sorted atoms')
         
                 # Get included distances
-                np_dists = cell_dists[included_edges[0], included_edges[1]]
+                np_dists = included_dists
 
                 # Reorganise the included edges
                 reorganised_edges = transform_edge_indices(included_edges)
@@ -363,6 +330,196 @@ def generate_nanoparticles(
     pbar.close()
     return nanoparticle_tuple_list
 
+def _cif_hash(cif_file: str) -> str:
+    with open(cif_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def get_unit_cell(
+    cif_file: str,
+    cif_hash: Union[str, None] = None,
+) -> Atoms:
+    """
+    Get the unit cell of a CIF, parsed once and kept in UNIT_CELL_CACHE, keyed by a hash of the CIF content.
+
+    Parameters:
+        cif_file (str): Input CIF file.
+        cif_hash (Union[str, None]): SHA-256 hex digest of the CIF content, if already known. Default is None.
+
+    Returns:
+        Atoms: The (cached) unit cell, which must not be modified.
+    """
+    if cif_hash is None:
+        cif_hash = _cif_hash(cif_file)
+    unit_cell = UNIT_CELL_CACHE.get(cif_hash)
+    if unit_cell is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            unit_cell = read(cif_file)
+        UNIT_CELL_CACHE.put(cif_hash, unit_cell, unit_cell.positions.nbytes * 4)
+    return unit_cell
+
+def get_supercell(
+    cif_file: str,
+    r_max: float,
+    metals: List[int],
+    device: str = 'cpu',
+    _lightweight_mode: bool = False,
+    _benchmarking: bool = False,
+) -> Supercell:
+    """
+    Get the centred supercell of a CIF that encompasses nanoparticles up to a given radius, together with its bonds.
+
+    The supercell is built once, by tiling the fractional coordinates of the unit cell over the lattice translations around the most central metal atom.
+    The number of repetitions follows from the perpendicular spacing of the lattice planes, such that the supercell holds every atom within the radius
+    plus the longest possible bond of the centre, also for skewed cells. The nanoparticle of a radius is therefore independent of the largest radius.
+
+    Supercells are kept in SUPERCELL_CACHE (and parsed unit cells in UNIT_CELL_CACHE), keyed by a hash of the CIF content and the settings. A cached supercell
+    serves every radius up to the one it was built for, such that it is only rebuilt when a larger radius is requested.
+
+    Parameters:
+        cif_file (str): Input CIF file.
+        r_max (float): Largest radius of the nanoparticles.
+        metals (List[int]): Atomic numbers of the metal atoms.
+        device (str): Device of the tensors. Default is 'cpu'.
+        _lightweight_mode (bool): Whether to use lightweight mode. Defaults to False.
+        _benchmarking (bool): Stripped down version for benchmarking, without bonds. Defaults to False.
+
+    Returns:
+        Supercell: The largest radius it encompasses, the ASE supercell, its chemical symbols, its positions and distances to the centre, its bonds and their distances and (except in
+        lightweight mode) the radius from which each bond is included, and the radius from which each atom is included, with the atoms sorted by it.
+    """
+    # Hash the CIF content, such that an edited file is never served from the cache
+    cif_hash = _cif_hash(cif_file)
+    key = cif_hash + repr((sorted(metals), str(device), _lightweight_mode, _benchmarking))
+    supercell = SUPERCELL_CACHE.get(key)
+    if supercell is not None and supercell.r_max >= r_max:
+        return supercell
+
+    # Read the input unit cell structure
+    unit_cell = get_unit_cell(cif_file, cif_hash)
+
+    # Fractional coordinates of the unit cell (wrapped as by make_supercell) and the longest possible bond
+    elements_info = get_element_table()
+    frac = np.mod(unit_cell.get_scaled_positions(wrap=False) + 1e-5, 1.0) - 1e-5
+    atomic_numbers = unit_cell.get_atomic_numbers()
+    max_bond = np.amax(elements_info.coefficients[elements_info.number_rows(atomic_numbers), 13]) * 2 * 1.25
+
+    # Centre of the bounding box of the unit cell, shifted by half a cell, which is (up to a lattice translation) the centre of a supercell with an even
+    # number of repetitions
+    center = (frac.min(axis=0) + frac.max(axis=0) - 1) / 2
+
+    # Center around the most central metal atom, among the unit cell atoms in the cells around the centre
+    if not (_lightweight_mode or _benchmarking):
+        neighbour_cells = np.stack(np.meshgrid(*[np.arange(-1, 2)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+        candidates = (neighbour_cells[:,None,:] + frac[None,:,:]).reshape(-1, 3)
+        candidate_dists = np.linalg.norm((candidates - center) @ unit_cell.cell.array, axis=1)
+        candidate_dists[~np.tile(np.isin(atomic_numbers, metals), len(neighbour_cells))] = np.inf
+        if np.isinf(candidate_dists).all():
+            raise ValueError('FAILED: No metal atoms found in the structure')
+        center = candidates[np.argmin(candidate_dists)]
+
+    # Repetitions of the unit cell on either side of the centre, from the perpendicular spacing of its lattice planes, such that the supercell
+    # contains every atom within the largest radius plus the longest bond of the centre
+    plane_spacings = 1 / np.linalg.norm(unit_cell.cell.reciprocal(), axis=1)
+    repetitions = np.ceil((r_max + max_bond) / plane_spacings).astype(int) + 1
+    translations = np.stack(np.meshgrid(*[np.arange(-n, n + 1) for n in repetitions], indexing='ij'), axis=-1).reshape(-1, 3)
+
+    # Build the supercell once, by tiling the fractional coordinates over the translations (in the order of make_supercell), and keep the sphere
+    # within the largest radius plus the longest bond of the centre
+    xyz = (translations[:,None,:] + (frac - center)[None,:,:]).reshape(-1, 3) @ unit_cell.cell.array
+    keep = np.nonzero(np.einsum('ij,ij->i', xyz, xyz) <= (r_max + max_bond)**2)[0]
+    cell = unit_cell[np.tile(np.arange(len(unit_cell)), len(translations))[keep]]
+    cell.info = {}
+    cell.set_cell(np.diag(2 * repetitions + 1) @ unit_cell.cell.array)
+    cell.positions = xyz[keep]
+
+    # Convert positions to torch and send to device
+    positions = torch.from_numpy(cell.get_positions()).to(dtype = torch.float32, device = device)
+    symbols = np.array(cell.get_chemical_symbols())
+
+    if _benchmarking:
+        supercell = Supercell(r_max, cell, symbols, positions, None, None, None, None, None, None)
+    else:
+        # Find atomic radii, with an array lookup of the atomic numbers in the element table
+        atomic_numbers = cell.get_atomic_numbers()
+        atomic_radii = torch.from_numpy(elements_info.coefficients[elements_info.number_rows(atomic_numbers), 13]).to(device=device)
+        center_dists = torch.norm(positions, dim=1)
+        if not _lightweight_mode:
+            metal_filter = torch.from_numpy(np.isin(atomic_numbers, metals)).to(device = device)
+
+        # Find edges
+        direction, edge_dists = find_bonds(positions, atomic_radii)
+
+        if not _lightweight_mode:
+            # Radius from which each bond is included: once its metal atoms are within the radius (bonds between non-metals are never included)
+            metal_dists = torch.where(metal_filter, center_dists, torch.zeros_like(center_dists))
+            bond_radii = torch.maximum(metal_dists[direction[0]], metal_dists[direction[1]])
+            bond_radii[~(metal_filter[direction[0]] | metal_filter[direction[1]])] = float('inf')
+
+            # Radius from which each atom is included, with its first included bond, and the atoms sorted by it
+            atom_radii = torch.full_like(center_dists, float('inf')).scatter_reduce_(0, direction[0], bond_radii, reduce='amin')
+            atom_radii, atom_order = torch.sort(atom_radii, stable=True)
+
+        supercell = Supercell(r_max, cell, symbols, positions, center_dists, direction, edge_dists,
+                              *((None, None, None) if _lightweight_mode else (bond_radii, atom_radii, atom_order)))
+
+    # Cache the supercell, sized by its tensors and the ASE arrays
+    nbytes = cell.positions.nbytes * 3 + symbols.nbytes + sum(t.element_size() * t.numel() for t in supercell[3:] if t is not None)
+    SUPERCELL_CACHE.put(key, supercell, nbytes)
+
+    return supercell
+
+def find_bonds(
+    positions: torch.Tensor,
+    atomic_radii: torch.Tensor,
+    batch_size: int = 1_000_000,
+):
+    """
+    Find the bonds of a structure, between atoms closer than 1.25 times the sum of their atomic radii, with a cell list neighbour search.
+
+    Only the pairs within 1.25 times twice the largest atomic radius are considered, such that the cost is O(M) for M atoms instead of the O(M^2) of a
+    dense distance matrix. If no atoms are bonded, all atoms closer than 1.1 times the smallest interatomic distance are connected instead (including each atom to itself).
+
+    Parameters:
+        positions (torch.Tensor): Atomic positions of shape (M, 3).
+        atomic_radii (torch.Tensor): Atomic radius of each atom.
+        batch_size (int): Approximate number of candidate pairs per tile of the neighbour search. Default is 1,000,000.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Edges of shape (2, n_edges), with each bond in both directions, in the row-major order of the distance matrix, and their distances.
+    """
+    def pairs_within(cutoff):
+        pairs = list(neighbour_pairs(positions, cutoff, batch_size))
+        if not pairs:
+            return [torch.zeros(0, dtype=torch.int64, device=positions.device)] * 2 + [torch.zeros(0, dtype=positions.dtype, device=positions.device)]
+        return [torch.cat(t) for t in zip(*pairs)]
+
+    # Bonds between the candidate pairs, with the threshold of each pair evaluated as in a dense (float32) threshold matrix
+    i, j, d = pairs_within(float(atomic_radii.max()) * 2 * 1.25)
+    bonded = d < ((atomic_radii[i] + atomic_radii[j]) * 1.25).to(dtype=d.dtype)
+    i, j, d = i[bonded], j[bonded], d[bonded]
+
+    # Handle case with no edges
+    if len(d) == 0 and len(positions) > 1:
+        extent = float(torch.norm(positions.amax(dim=0) - positions.amin(dim=0)))
+        cutoff = float(atomic_radii.max()) * 2 * 1.25
+        while len(d) == 0:
+            cutoff = min(cutoff * 2, extent)
+            i, j, d = pairs_within(cutoff)
+        min_dist = torch.amin(d[d > 0])
+        i, j, d = pairs_within(float(min_dist) * 1.1)
+        within = d < min_dist * 1.1
+        self_loops = torch.arange(len(positions), device=positions.device)
+        i, j, d = torch.cat([i[within], self_loops]), torch.cat([j[within], self_loops]), torch.cat([d[within], torch.zeros_like(self_loops, dtype=d.dtype)])
+
+    # Both directions of each bond (self-loops once), sorted as torch.argwhere on a dense matrix
+    reverse = i != j
+    direction = torch.cat([torch.stack([i, j]), torch.stack([j[reverse], i[reverse]])], dim=1)
+    dists = torch.cat([d, d[reverse]])
+    order = torch.argsort(direction[0] * len(positions) + direction[1])
+
+    return direction[:,order], dists[order]
+
 def transform_edge_indices(edge_indices):
 
     # Extract unique nodes from the edge indices
@@ -0,0 +1,120 @@
+import torch
+from typing import Tuple, Union
+
+def lattice_sites(
+    xyz: torch.Tensor,
+    cell: torch.Tensor,
+    labels: torch.Tensor,
+    tolerance: float = 1e-3,
+) -> Union[Tuple[torch.Tensor, torch.Tensor, torch.Tensor], None]:
+    """
+    Decompose the atoms of a structure carved from a lattice into integer lattice translations and basis sites.
+
+    Each atom is written as xyz = (n + o_s) @ cell, with an integer translation n and the fractional position o_s of its basis site s.
+    Atoms share a basis site if they have the same fractional position modulo the lattice (to within about 1e-3) and the same label.
+
+    Parameters:
+        xyz (torch.Tensor): Atomic positions of shape (N, 3).
+        cell (torch.Tensor): Lattice vectors as the rows of a (3, 3) matrix.
+        labels (torch.Tensor): Integer label of each atom (e.g. its element and occupancy) that basis sites must not mix.
+        tolerance (float): Maximum deviation in Å of an atom from its lattice position. Default is 1e-3.
+
+    Returns:
+        Union[Tuple[torch.Tensor, torch.Tensor, torch.Tensor], None]: Integer translations of shape (N, 3), basis site of each atom and
+        fractional positions of the basis sites of shape (n_sites, 3), or None if the atoms are not on the lattice.
+    """
+    cell = cell.to(device=xyz.device, dtype=torch.float64)
+    frac = xyz.to(dtype=torch.float64) @ torch.linalg.inv(cell)
+
+    # Group the atoms by their (rounded) fractional position modulo the lattice
+    key = torch.remainder(torch.round(torch.remainder(frac, 1.0) * 1000).to(dtype=torch.int64), 1000)
+    translations = torch.round(frac - key / 1000).to(dtype=torch.int64)
+    _, site = torch.unique(torch.cat([key, labels.unsqueeze(-1).to(dtype=torch.int64)], dim=1), dim=0, return_inverse=True)
+    num_sites = int(site.max()) + 1 if len(site) > 0 else 0
+
+    # Exact fractional positions of the sites, averaged over their atoms
+    counts = torch.bincount(site, minlength=num_sites).to(dtype=torch.float64)
+    offsets = torch.zeros((num_sites, 3), dtype=torch.float64, device=xyz.device).index_add_(0, site, frac - translations) / counts.unsqueeze(-1)
+
+    deviation = torch.norm((translations + offsets[site]) @ cell - xyz.to(dtype=torch.float64), dim=-1)
+    if len(deviation) == 0 or deviation.max() > tolerance:
+        return None
+
+    return translations, site, offsets
+
+def lattice_distances(
+    translations: torch.Tensor,
+    site: torch.Tensor,
+    offsets: torch.Tensor,
+    cell: torch.Tensor,
+    site_classes: torch.Tensor,
+    site_weights: torch.Tensor,
+    resolution: float = 1e-8,
+    batch_size: int = 1_000_000,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Find the distinct pair distances of a structure on a lattice, with their multiplicities, per class of basis site pairs.
+
+    The number of atom pairs between basis sites s and t separated by each lattice translation is the cross-correlation of the occupancy grids of
+    the two sites, computed with FFTs in O(M log M) for M lattice cells instead of O(N^2) over the atom pairs. Pair vectors of the same length are
+    then merged, such that each distinct distance (including those related by the point-group symmetry of the lattice and the particle) is kept once.
+
+    Parameters:
+        translations (torch.Tensor): Integer translations of the atoms of shape (N, 3), as from lattice_sites.
+        site (torch.Tensor): Basis site of each atom, as from lattice_sites.
+        offsets (torch.Tensor): Fractional positions of the basis sites of shape (n_sites, 3), as from lattice_sites.
+        cell (torch.Tensor): Lattice vectors as the rows of a (3, 3) matrix.
+        site_classes (torch.Tensor): Class of each ordered pair of basis sites of shape (n_sites, n_sites), e.g. their element-pair class.
+        site_weights (torch.Tensor): Weight of each ordered pair of basis sites of shape (n_sites, n_sites), e.g. their occupancy product.
+        resolution (float): Distances that agree to within this resolution in Å are merged. Default is 1e-8.
+        batch_size (int): Approximate number of lattice translations of the correlations computed at once. Default is 1,000,000.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: Distinct distances (float64), their classes and total weights (float64), over the unique atom pairs.
+    """
+    device = translations.device
+    cell = cell.to(device=device, dtype=torch.float64)
+    num_sites = len(offsets)
+
+    # Occupancy grid of each site over the bounding box of the translations, padded such that the correlation does not wrap around
+    translations = translations - translations.amin(dim=0)
+    extent = translations.amax(dim=0) + 1
+    shape = tuple(int(2 * e - 1) for e in extent)
+    grids = torch.zeros((num_sites,) + shape, dtype=torch.float64, device=device)
+    grids[site, translations[:,0], translations[:,1], translations[:,2]] = 1.0
+    spectra = torch.fft.rfftn(grids, s=shape, dim=(1,2,3))
+    del grids
+
+    shape = torch.tensor(shape, device=device)
+    chunk = max(1, batch_size // int(torch.prod(shape)))
+    distances, classes, weights = [], [], []
+    for s in range(num_sites):
+        for start in range(s, num_sites, chunk):
+            t = torch.arange(start, min(start + chunk, num_sites), device=device)
+
+            # Number of pairs (i in s, j in t) for each translation n_i - n_j, with negative translations wrapped around
+            counts = torch.round(torch.fft.irfftn(spectra[s].unsqueeze(0) * spectra[t].conj(), s=tuple(shape.tolist()), dim=(1,2,3)))
+            index = torch.nonzero(counts > 0.5)
+            count = counts[index[:,0], index[:,1], index[:,2], index[:,3]]
+            t, index = t[index[:,0]], torch.where(index[:,1:] >= (shape + 1) // 2, index[:,1:] - shape, index[:,1:])
+
+            # Each unordered pair within a site is counted for both n_i - n_j and n_j - n_i, excluding the atom itself
+            same_site = t == s
+            keep = ~same_site | torch.any(index != 0, dim=1)
+            t, index, count = t[keep], index[keep], torch.where(same_site, count / 2, count)[keep]
+
+            distances.append(torch.norm((index + offsets[s] - offsets[t]) @ cell, dim=-1))
+            classes.append(site_classes[s, t])
+            weights.append(count * site_weights[s, t])
+
+    distances, classes, weights = torch.cat(distances), torch.cat(classes), torch.cat(weights)
+    distances, classes, weights = distances[weights > 0], classes[weights > 0], weights[weights > 0]
+
+    # Merge equal distances of each class, at their weighted mean distance
+    rounded = torch.round(distances / resolution).to(dtype=torch.int64)
+    key, inverse = torch.unique(classes * (int(rounded.max()) + 1 if len(rounded) > 0 else 1) + rounded, return_inverse=True)
+    merged_weights = torch.zeros(len(key), dtype=torch.float64, device=device).index_add_(0, inverse, weights)
+    merged_distances = torch.zeros_like(merged_weights).index_add_(0, inverse, weights * distances) / merged_weights
+    merged_classes = torch.zeros(len(key), dtype=torch.int64, device=device).scatter_(0, inverse, classes)
+
+    return merged_distances, merged_classes, merged_weights
@@ -0,0 +1,74 @@
+import torch
+from typing import Iterator, Tuple
+
+# Offsets of the neighbouring cells in the upper half of the 3x3x3 block, such that each pair of cells is visited once
+_HALF_SHELL = [(0, 0, 0)] + [
+    (dx, dy, dz)
+    for dx in (-1, 0, 1)
+    for dy in (-1, 0, 1)
+    for dz in (-1, 0, 1)
+    if (dx, dy, dz) > (0, 0, 0)
+]
+
+def neighbour_pairs(
+    xyz: torch.Tensor,
+    cutoff: float,
+    batch_size: int = 1_000_000,
+) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+    """
+    Generate all pairs of atoms within a cutoff distance with a cell list, in O(N) for a structure of constant density.
+
+    The atoms are hashed into cubic cells with an edge length of the cutoff and sorted by cell. Candidate pairs are then enumerated between
+    each cell and its 13 neighbouring cells of the upper half shell (and within the cell itself), in tiles of about batch_size candidates.
+
+    Parameters:
+        xyz (torch.Tensor): Atomic positions of shape (N, 3).
+        cutoff (float): Cutoff distance (inclusive).
+        batch_size (int): Approximate number of candidate pairs per tile. Default is 1,000,000.
+
+    Yields:
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: Atom indices i and j (i != j, each pair once) and distances of the pairs within the cutoff.
+    """
+    size = len(xyz)
+    if size < 2:
+        return
+    device = xyz.device
+
+    # Hash the atoms into cells and sort them by cell
+    cell = torch.floor((xyz - xyz.amin(dim=0)) / cutoff).to(dtype=torch.int64)
+    dims = cell.amax(dim=0) + 1
+    cell_id = (cell[:,0] * dims[1] + cell[:,1]) * dims[2] + cell[:,2]
+    cell_id, order = torch.sort(cell_id)
+    cell = cell[order]
+    xyz_sorted = xyz[order]
+    counts = torch.bincount(cell_id, minlength=int(torch.prod(dims)))
+    starts = torch.cumsum(counts, dim=0) - counts
+
+    for offset in _HALF_SHELL:
+        # Neighbouring cell of each (sorted) atom, if inside the grid
+        neighbour = cell + torch.tensor(offset, device=device)
+        inside = torch.all((neighbour >= 0) & (neighbour < dims), dim=1)
+        neighbour_id = (neighbour[:,0] * dims[1] + neighbour[:,1]) * dims[2] + neighbour[:,2]
+        num_candidates = torch.where(inside, counts[neighbour_id.clamp(0, len(counts)-1)], torch.zeros_like(neighbour_id))
+        candidate_ends = torch.cumsum(num_candidates, dim=0)
+
+        # Tiles of consecutive atoms with about batch_size candidates in total
+        first = 0
+        while first < size:
+            last = int(torch.searchsorted(candidate_ends, candidate_ends[first] - num_candidates[first] + batch_size, right=True))
+            last = min(max(last, first + 1), size)
+
+            a = torch.repeat_interleave(torch.arange(first, last, device=device), num_candidates[first:last])
+            if len(a) > 0:
+                slot = torch.arange(len(a), device=device) - (candidate_ends[a] - num_candidates[a] - (candidate_ends[first] - num_candidates[first]))
+                b = starts[neighbour_id[a]] + slot
+
+                # Within a cell, each pair is kept once
+                if offset == (0, 0, 0):
+                    keep = b > a
+                    a, b = a[keep], b[keep]
+
+                d = torch.norm(xyz_sorted[a] - xyz_sorted[b], dim=-1)
+                within = d <= cutoff
+                yield order[a][within], order[b][within], d[within]
+            first = last
@@ -10,6 +10,8 @@ class Profiler:
         __init__(): Initialize the Profiler object with default settings.
         reset(): Reset the profiler data and start tracking time from the current point.
         time(name): Record the execution time for a specific section of code with the given name.
+        note(name, value): Record a (non-timing) value, such as an automatically chosen setting, with the given name.
+        notes(): Get the dictionary of the latest recorded notes.
         means(): Get the dictionary of mean times for each recorded section.
         vars(): Get the dictionary of variances of the recorded times for each section.
         stds(): Get the dictionary of standard deviations of the recorded times for each section.
@@ -32,6 +34,7 @@ class Profiler:
         self._means = collections.defaultdict(int)
         self._vars = collections.defaultdict(int)
         self._counts = collections.defaultdict(int)
+        self._notes = {}
         self.reset()
 
     def reset(self):
@@ -51,6 +54,12 @@ class Profiler:
         self._vars[name] = var
         self._counts[name] += 1
 
+    def note(self, name, value):
+        self._notes[name] = value
+
+    def notes(self):
+        return self._notes
+
     def means(self):
         return self._means
 
@@ -77,4 +86,6 @@ class Profiler:
                 100 * means[k] / total,
             )
         result += "\nTotal: %.3fms" % (1000 * total)
+        for k, v in self._notes.items():
+            result += "\n   -> %s: %s" % (k, v)
         return result
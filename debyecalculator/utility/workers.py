@@ -0,0 +1,67 @@
+import threading
+import warnings
+import torch
+from typing import Any, Dict, List, Union
+
+# DebyeCalculator of the current worker thread (or worker process)
+_worker = threading.local()
+
+def initialise_worker(
+    parameters: Dict[str, Any],
+    num_threads: Union[int, None] = None,
+) -> None:
+    """
+    Initialise a worker of DebyeCalculator.map with its own DebyeCalculator and number of intra-op threads.
+
+    Parameters:
+        parameters (Dict[str, Any]): Keyword arguments of the DebyeCalculator of the worker.
+        num_threads (Union[int, None]): Number of PyTorch intra-op threads of the worker. If None, the PyTorch default is kept. Default is None.
+    """
+    # Imported here, as DebyeCalculator imports this module
+    from debyecalculator.debye_calculator import DebyeCalculator
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    # Device warnings have already been issued by the calculator that is mapped
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        _worker.calculator = DebyeCalculator(**parameters)
+
+def compute_in_worker(
+    structure_source: Any,
+    kwargs: Dict[str, Any],
+) -> Any:
+    """
+    Calculate the outputs of a single structure source with the DebyeCalculator of the current worker, as in DebyeCalculator.compute.
+
+    Parameters:
+        structure_source (Any): Atomic structure source, as in DebyeCalculator.compute.
+        kwargs (Dict[str, Any]): Keyword arguments of DebyeCalculator.compute.
+
+    Returns:
+        Any: The results of DebyeCalculator.compute, as numpy arrays on CPU.
+    """
+    return _worker.calculator.compute(structure_source, keep_on_device=False, **kwargs)
+
+def compute_shards_in_worker(
+    structure_source: Any,
+    shards: List[int],
+    kwargs: Dict[str, Any],
+) -> List[str]:
+    """
+    Evaluate shards of the pair sum of a single structure with the DebyeCalculator of the current worker, as in DebyeCalculator.compute_shard.
+
+    The structure is prepared once for all the shards.
+
+    Parameters:
+        structure_source (Any): Atomic structure source, as in DebyeCalculator.compute_shard.
+        shards (List[int]): Indices of the shards.
+        kwargs (Dict[str, Any]): Keyword arguments num_shards, directory and radii of DebyeCalculator.compute_shard.
+
+    Returns:
+        List[str]: Paths of the shard files.
+    """
+    calculator = _worker.calculator
+    structure = calculator._initialise_shard_structure(structure_source, kwargs['radii'])
+    return calculator._compute_shards(structure, shards, kwargs['num_shards'], kwargs['directory'])
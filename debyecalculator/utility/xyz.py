@@ -0,0 +1,76 @@
+import numpy as np
+from itertools import islice
+from collections import namedtuple
+
+XYZData = namedtuple('XYZData', 'symbols codes xyz occupancy')
+
+def read_xyz(
+    xyz_file: str,
+    chunk_size: int = 65536,
+) -> XYZData:
+    """
+    Read an XYZ file of 4 (element, x, y, z) or 5 (element, x, y, z, occupancy) columns.
+
+    The atom lines are parsed in chunks of chunk_size lines, each split into a single token array that is converted to float32 in bulk.
+    Element symbols are mapped to integer codes chunk by chunk, such that no per-atom Python strings are created.
+
+    Parameters:
+        xyz_file (str): Path to the XYZ file. The first two lines (atom count and comment) are skipped.
+        chunk_size (int): Number of lines parsed at a time. Default is 65536.
+
+    Returns:
+        XYZData: Sorted unique element symbols, element code (index into the symbols) of each atom, float32 positions of shape (n_atoms, 3)
+        and float32 occupancies (None for 4 columns).
+
+    Raises:
+        ValueError: If the atom lines do not have a consistent number of 4 or 5 columns.
+    """
+    symbols, codes, xyz, occupancy = [], [], [], []
+    symbol_codes = {}
+    num_columns = None
+
+    with open(xyz_file, 'rb') as f:
+        for _ in range(2):
+            f.readline()
+        while True:
+            lines = [line for line in islice(f, chunk_size) if line.strip()]
+            if not lines:
+                break
+
+            # Split the whole chunk at once into a (n_lines, n_columns) token array
+            if num_columns is None:
+                num_columns = len(lines[0].split())
+                if num_columns not in [4, 5]:
+                    raise ValueError(f'Expected 4 or 5 columns in {xyz_file}, but got {num_columns}')
+            tokens = np.array(b' '.join(lines).split())
+            if len(tokens) != len(lines) * num_columns:
+                raise ValueError(f'Encountered inconsistent number of columns in {xyz_file}')
+            tokens = tokens.reshape(len(lines), num_columns)
+
+            # Map the element symbols of the chunk to global integer codes
+            chunk_symbols, chunk_inverse = np.unique(tokens[:,0], return_inverse=True)
+            for symbol in chunk_symbols:
+                if symbol not in symbol_codes:
+                    symbol_codes[symbol] = len(symbol_codes)
+                    symbols.append(symbol.decode())
+            codes.append(np.array([symbol_codes[s] for s in chunk_symbols], dtype=np.int64)[chunk_inverse.reshape(-1)])
+
+            xyz.append(tokens[:,1:4].astype(np.float32))
+            if num_columns == 5:
+                occupancy.append(tokens[:,4].astype(np.float32))
+
+    if num_columns is None:
+        return XYZData([], np.zeros(0, dtype=np.int64), np.zeros((0, 3), dtype=np.float32), None)
+
+    # Re-map the codes to the sorted symbols
+    order = np.argsort(symbols)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    codes = rank[np.concatenate(codes)]
+
+    return XYZData(
+        [symbols[i] for i in order],
+        codes,
+        np.concatenate(xyz),
+        np.concatenate(occupancy) if num_columns == 5 else None,
+    )